@@ -0,0 +1,31 @@
+from fastapi import APIRouter
+
+from core.answer_cache import answer_cache
+from services.rag_service import rag_service
+
+
+router = APIRouter()
+
+
+@router.get("/stats")
+async def cache_stats():
+    """
+    Счётчики кэша ответов: попадания (в памяти и в SQLite), промахи,
+    вытеснения и текущий размер. В `single_flight` — сколько одинаковых
+    одновременных запросов было объединено в один вызов модели.
+    """
+    from clients.gemini_client import gemini_client
+
+    single_flight = {"rag": rag_service.single_flight.get_stats()}
+    if gemini_client is not None:
+        single_flight["chat"] = gemini_client.single_flight.get_stats()
+    return {**answer_cache.get_stats(), "single_flight": single_flight}
+
+
+@router.delete("/")
+async def clear_cache():
+    """
+    Полностью очищает кэш ответов.
+    """
+    await answer_cache.clear()
+    return {"status": "ok"}
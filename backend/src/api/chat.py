@@ -1,10 +1,19 @@
 from pathlib import Path
-from fastapi import APIRouter, File, UploadFile
+from typing import List, Optional
+
+from fastapi import APIRouter, File, UploadFile, Query
 from fastapi.exceptions import HTTPException
 
+from api.sse import sse_response
 from config import settings
 from schemas.chat_prompt import PromptSchema, PromptResponseSchema
+from schemas.chat_session import (
+    ChatMessageSchema,
+    ChatSessionCreateSchema,
+    ChatSessionSchema,
+)
 from services.chat_service import chat_service
+from services.session_service import session_service
 
 
 router = APIRouter()
@@ -16,7 +25,63 @@ async def prompt(prompt: PromptSchema):
     Обработчик POST запроса для чата.
     Принимает сообщение от пользователя и возвращает ответ от AI.
     Если указан corpus_id и RAG включен, использует RAG для генерации ответа.
+    Если указан session_id, ответ учитывает историю разговора в сессии.
     """
     return await chat_service.generate_response(
-        prompt.message, corpus_id=prompt.corpus_id
+        prompt.message, corpus_id=prompt.corpus_id, session_id=prompt.session_id
+    )
+
+
+@router.post("/stream")
+async def prompt_stream(prompt: PromptSchema):
+    """
+    Потоковый вариант чата через Server-Sent Events.
+    События `token` содержат фрагменты ответа, финальное событие `done` —
+    полный текст (и relevant_docs, если использовался RAG).
+    """
+    return await sse_response(
+        chat_service.stream_response(
+            prompt.message, corpus_id=prompt.corpus_id, session_id=prompt.session_id
+        )
     )
+
+
+@router.post("/sessions", response_model=ChatSessionSchema)
+async def create_session(session: Optional[ChatSessionCreateSchema] = None):
+    """
+    Создаёт сессию чата. Её session_id передаётся в /chat/ и /chat/stream,
+    чтобы модель видела историю разговора.
+    """
+    return await session_service.create_session(
+        corpus_id=session.corpus_id if session else None
+    )
+
+
+@router.get("/sessions/{session_id}", response_model=ChatSessionSchema)
+async def get_session(session_id: str, limit: int = Query(20, ge=0, le=200)):
+    """
+    Сессия со сводкой ранней истории и последними сообщениями.
+    """
+    return await session_service.get_session(session_id, limit)
+
+
+@router.get("/sessions/{session_id}/messages", response_model=List[ChatMessageSchema])
+async def list_session_messages(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before_id: Optional[int] = None,
+):
+    """
+    Полная история сессии постранично: до `limit` сообщений перед `before_id`.
+    """
+    return await session_service.list_messages(session_id, limit, before_id)
+
+
+@router.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """
+    Удаляет сессию и её историю.
+    """
+    if not await session_service.delete_session(session_id):
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    return {"status": "ok"}
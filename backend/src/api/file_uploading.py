@@ -1,20 +1,29 @@
+import uuid
 from pathlib import Path
 from typing import List, Optional
 
-from fastapi import APIRouter, File, UploadFile, Form
+from fastapi import APIRouter, File, UploadFile, Form, Request
 from fastapi.exceptions import HTTPException
 
-import shutil
-
 from config import settings
+from core.executors import run_blocking
+from core.files import UploadTooLargeError, save_stream
+from core.metrics import UPLOAD_BYTES, UPLOAD_FILES
+from core.tracing import span
+from schemas.ingestion import IngestionJobSchema
+from services.ingestion_service import ingestion_service
 from services.rag_service import rag_service
 
 
 router = APIRouter()
 
+# Файлы загрузок до добавления в корпус: UPLOAD_DIR/incoming/<id загрузки>/<имя>
+INCOMING_DIR_NAME = "incoming"
+
 
 @router.post("/")
 async def upload_files(
+    request: Request,
     files: List[UploadFile] = File(...),
     corpus_id: Optional[str] = Form(None),
 ):
@@ -24,20 +33,42 @@ async def upload_files(
     - Если `corpus_id` передан и RAG включен — файлы добавляются в существующий корпус.
     - Если corpus_id не передан, но RAG включен — создаётся новый корпус (по имени первого файла).
     - Если RAG выключен — файлы просто сохраняются на диск.
+
+    Добавление в корпус выполняется в фоне: ответ содержит `job_id`,
+    прогресс можно смотреть через `GET /jobs/{job_id}`.
     """
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
 
-    settings.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-
-    saved_files = []
+    # Проверяем всё, что известно заранее, до записи на диск
     for file in files:
         if file.filename == "":
             raise HTTPException(status_code=400, detail="One of files has empty name")
+        if file.size is not None and file.size > settings.MAX_UPLOAD_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Файл {file.filename} больше {settings.MAX_UPLOAD_SIZE} байт",
+            )
 
-        file_path = settings.UPLOAD_DIR / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    # Своя директория на каждую загрузку: одноимённые файлы из параллельных
+    # загрузок не перезаписывают друг друга, пока задача ждёт в очереди
+    upload_dir = settings.UPLOAD_DIR / INCOMING_DIR_NAME / uuid.uuid4().hex
+    upload_dir.mkdir(parents=True, exist_ok=True)
+
+    saved_files = []
+    for file in files:
+        file_path = upload_dir / Path(file.filename).name
+        # Пишем кусками в пуле потоков: память не зависит от размера файла,
+        # а event loop не блокируется
+        try:
+            with span("save", filename=file.filename):
+                written = await run_blocking(
+                    save_stream, file.file, file_path, settings.MAX_UPLOAD_SIZE
+                )
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        UPLOAD_BYTES.inc(written)
+        UPLOAD_FILES.inc()
 
         saved_files.append({"filename": file.filename, "location": str(file_path)})
 
@@ -56,30 +87,27 @@ async def upload_files(
         target_corpus_id = corpus.name
         created_corpus = corpus
 
-    rag_results = []
-    for info in saved_files:
-        try:
-            rag_file_id = await rag_service.upload_file_to_corpus(
-                corpus_id=target_corpus_id,
-                file_path=info["location"],
-                display_name=info["filename"],
-            )
-            rag_results.append(
-                {
-                    "filename": info["filename"],
-                    "file_id": rag_file_id,
-                }
-            )
-        except Exception as e:
-            print(f"⚠️ Ошибка загрузки файла {info['filename']} в RAG: {e}")
+    # Копирование в корпус и индексация идут в фоне, ответ возвращаем сразу
+    job = await ingestion_service.submit(target_corpus_id, saved_files)
 
     return {
-        "message": "Файлы загружены и доступны в RAG."
-        if rag_results
-        else "Файлы сохранены, но не удалось добавить их в RAG.",
+        "message": "Файлы загружены, идёт добавление в RAG.",
+        "job_id": job.job_id,
+        "status_url": request.url_for("get_upload_job", job_id=job.job_id).path,
         "corpus_id": target_corpus_id,
         "corpus_name": created_corpus.display_name
         if created_corpus
         else target_corpus_id,
-        "uploaded": rag_results,
+        "files": saved_files,
     }
+
+
+@router.get("/jobs/{job_id}", response_model=IngestionJobSchema)
+async def get_upload_job(job_id: str):
+    """
+    Возвращает прогресс фоновой загрузки и ошибки по каждому файлу.
+    """
+    job = ingestion_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
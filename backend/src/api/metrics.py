@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from core.metrics import CONTENT_TYPE, registry
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Метрики конвейера в текстовом формате Prometheus.
+    """
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
@@ -1,15 +1,22 @@
-from fastapi import APIRouter, HTTPException
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Response
+from typing import Literal, Optional
 
 from schemas.rag import (
+    BatchQuerySchema,
+    BatchRAGResponseSchema,
     CorpusSchema,
     CorpusCreateSchema,
+    MultiQuerySchema,
+    MultiRAGResponseSchema,
     QuerySchema,
     RAGResponseSchema,
     FileInfoSchema,
 )
 from services.rag_service import rag_service
 from config import settings
+from api.sse import sse_response
+from clients.gemini_rag_client import RetrievalModeError
+from rag.catalog import CorpusNotFoundError
 
 
 router = APIRouter()
@@ -32,12 +39,25 @@ async def create_corpus(corpus: CorpusCreateSchema):
 
 
 @router.get("/corpus", response_model=list[CorpusSchema])
-async def list_corpora():
+async def list_corpora(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    q: Optional[str] = None,
+    sort: Literal["name", "created", "updated", "size", "files"] = "created",
+    order: Literal["asc", "desc"] = "asc",
+):
     """
-    Получает список всех корпусов.
+    Получает страницу корпусов.
+    `q` — подстрока в имени корпуса; общее число корпусов под фильтром
+    возвращается в заголовке X-Total-Count.
     """
     _ensure_rag_enabled()
-    return await rag_service.list_corpora()
+    corpora, total = await rag_service.list_corpora(
+        limit=limit, offset=offset, query=q, sort=sort, descending=order == "desc"
+    )
+    response.headers["X-Total-Count"] = str(total)
+    return corpora
 
 
 @router.delete("/corpus/{corpus_id}")
@@ -53,12 +73,45 @@ async def delete_corpus(corpus_id: str):
 
 
 @router.get("/corpus/{corpus_id}/files", response_model=list[FileInfoSchema])
-async def list_files(corpus_id: str):
+async def list_files(
+    corpus_id: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    q: Optional[str] = None,
+    status: Optional[Literal["pending", "indexed", "failed"]] = None,
+    sort: Literal["name", "size", "added", "status"] = "name",
+    order: Literal["asc", "desc"] = "asc",
+):
+    """
+    Получает страницу файлов в корпусе (книги) со статусом извлечения.
+    Общее число файлов под фильтром — в заголовке X-Total-Count.
+    """
+    _ensure_rag_enabled()
+    try:
+        files, total = await rag_service.list_files(
+            corpus_id,
+            limit=limit,
+            offset=offset,
+            query=q,
+            status=status,
+            sort=sort,
+            descending=order == "desc",
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Корпус не найден")
+    response.headers["X-Total-Count"] = str(total)
+    return files
+
+
+@router.post("/catalog/rescan")
+async def rescan_catalog():
     """
-    Получает список файлов в корпусе (книги).
+    Сверяет каталог корпусов с файлами на диске и исправляет расхождения.
+    То же самое без запуска сервера: `python -m rag.catalog`.
     """
     _ensure_rag_enabled()
-    return await rag_service.list_files(corpus_id)
+    return await rag_service.rescan_catalog()
 
 
 @router.delete("/corpus/{corpus_id}/files/{filename}")
@@ -79,8 +132,89 @@ async def query_corpus(query: QuerySchema):
     Выполняет поиск в корпусе и генерирует ответ на основе найденных документов.
     """
     _ensure_rag_enabled()
-    return await rag_service.generate_rag_response(
-        corpus_id=query.corpus_id,
-        query=query.query,
-        max_results=query.max_results,
-    )
+    try:
+        return await rag_service.generate_rag_response(
+            corpus_id=query.corpus_id,
+            query=query.query,
+            max_results=query.max_results,
+            retrieval_mode=query.retrieval_mode,
+        )
+    except CorpusNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RetrievalModeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/query/multi", response_model=MultiRAGResponseSchema)
+async def query_corpora(query: MultiQuerySchema):
+    """
+    Отвечает на вопрос сразу по нескольким корпусам (по умолчанию — по всем).
+    Поиск во всех корпусах идёт параллельно; корпуса, не успевшие
+    к дедлайну, пропускаются и помечаются в `shards` как timeout.
+    """
+    _ensure_rag_enabled()
+    try:
+        return await rag_service.generate_rag_multi(
+            query=query.query,
+            corpus_ids=query.corpus_ids,
+            max_results=query.max_results,
+            retrieval_mode=query.retrieval_mode,
+            deadline=query.deadline,
+        )
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/query/batch", response_model=BatchRAGResponseSchema)
+async def query_corpus_batch(batch: BatchQuerySchema):
+    """
+    Отвечает на список вопросов к одному корпусу.
+    Корпус индексируется и просматривается один раз на весь пакет,
+    вопросы с общим контекстом задаются модели одним запросом.
+    Ответы возвращаются в порядке вопросов.
+    """
+    _ensure_rag_enabled()
+    if not batch.queries:
+        raise HTTPException(status_code=400, detail="Список вопросов пуст")
+    if len(batch.queries) > settings.RAG_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Не больше {settings.RAG_BATCH_MAX_QUERIES} вопросов за раз",
+        )
+    try:
+        answers, stats = await rag_service.generate_rag_batch(
+            corpus_id=batch.corpus_id,
+            queries=batch.queries,
+            max_results=batch.max_results,
+            retrieval_mode=batch.retrieval_mode,
+        )
+    except CorpusNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RetrievalModeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return BatchRAGResponseSchema(answers=answers, stats=stats)
+
+
+@router.post("/query/stream")
+async def query_corpus_stream(query: QuerySchema):
+    """
+    Потоковый вариант /query через Server-Sent Events.
+    События `token` содержат фрагменты ответа, финальное событие `done` —
+    полный текст и relevant_docs.
+    """
+    _ensure_rag_enabled()
+    try:
+        return await sse_response(
+            rag_service.stream_rag_response(
+                corpus_id=query.corpus_id,
+                query=query.query,
+                max_results=query.max_results,
+                retrieval_mode=query.retrieval_mode,
+            )
+        )
+    except CorpusNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RetrievalModeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
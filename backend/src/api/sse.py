@@ -0,0 +1,68 @@
+import json
+from typing import AsyncIterator, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+
+from clients.gemini_rag_client import RetrievalModeError
+from core.dispatcher import DispatcherError
+from core.session_store import SessionNotFoundError
+from rag.catalog import CorpusNotFoundError
+
+
+def format_sse(event: str, data: dict) -> str:
+    """
+    Форматирует одно событие Server-Sent Events.
+    """
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def _encode(
+    first: Optional[Tuple[str, dict]], events: AsyncIterator[Tuple[str, dict]]
+) -> AsyncIterator[str]:
+    try:
+        if first is None:
+            return
+        yield format_sse(*first)
+        if first[0] == "error":
+            return
+        async for event, data in events:
+            yield format_sse(event, data)
+    except Exception as e:
+        # Заголовки уже отправлены, поэтому ошибку отдаём отдельным событием
+        yield format_sse("error", {"detail": str(e)})
+
+
+async def sse_response(events: AsyncIterator[Tuple[str, dict]]) -> StreamingResponse:
+    """
+    Оборачивает поток событий (имя, данные) в ответ text/event-stream.
+
+    Первое событие дожидается до отправки заголовков: если модель
+    перегружена (очередь диспетчера полна или истёк дедлайн),
+    клиент получает обычный HTTP 429/504, а не событие error
+    (как и 404 для неизвестной сессии чата или корпуса
+    и 400 для недоступного режима поиска).
+    """
+    try:
+        first = await anext(events)
+    except StopAsyncIteration:
+        first = None
+    except (
+        DispatcherError,
+        SessionNotFoundError,
+        CorpusNotFoundError,
+        RetrievalModeError,
+    ):
+        raise
+    except Exception as e:
+        first = ("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        _encode(first, events),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Чтобы nginx не буферизовал поток
+            "X-Accel-Buffering": "no",
+        },
+    )
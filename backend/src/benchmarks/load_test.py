@@ -0,0 +1,280 @@
+"""
+Нагрузочный бенчмарк API без сети и без квоты Gemini.
+
+Поднимает приложение в процессе (httpx.ASGITransport), подменяет модель
+локальной заглушкой (LLM_BACKEND=fake) и гоняет /api/chat/, /api/rag/query
+и /api/upload_file/ на заданных уровнях конкурентности.
+Печатает p50/p95/p99 и пропускную способность, может сохранить результат
+в JSON и сравнить его с базовым, завершившись с кодом 1 при регрессии.
+
+Запуск из backend/src:
+
+    python -m benchmarks.load_test --concurrency 1,8,32 --requests 200
+    python -m benchmarks.load_test --output base.json
+    python -m benchmarks.load_test --baseline base.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+SCENARIOS = ("chat", "rag", "upload")
+TOPICS = (
+    "процесс", "поток", "память", "планировщик", "файловая система",
+    "прерывание", "драйвер", "виртуальная память", "семафор", "кэш",
+)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк API")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=200, help="Запросов на уровень")
+    parser.add_argument(
+        "--distinct",
+        type=int,
+        default=0,
+        help="Сколько разных вопросов (0 — все разные, кэш ответов не помогает)",
+    )
+    parser.add_argument(
+        "--answer-cache",
+        action="store_true",
+        help="Не выключать кэш ответов (по умолчанию каждый запрос идёт в модель)",
+    )
+    parser.add_argument("--latency", type=float, default=0.2, help="Заглушка: до первого токена, с")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--response-tokens", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--book", type=Path, help="Файл книги для RAG (по умолчанию синтетический)")
+    parser.add_argument("--output", type=Path, help="Сохранить результаты в JSON")
+    parser.add_argument("--baseline", type=Path, help="Сравнить с сохранёнными результатами")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="Допустимое ухудшение p95 и пропускной способности (доля)",
+    )
+    return parser.parse_args(argv)
+
+
+def configure_environment(args: argparse.Namespace, workdir: Path) -> None:
+    """
+    Настройки должны попасть в окружение до импорта config.
+    """
+    os.environ.update(
+        {
+            "LLM_BACKEND": "fake",
+            "RAG_ENABLED": "true",
+            "UPLOAD_DIR": str(workdir / "uploads"),
+            "ANSWER_CACHE_ENABLED": "true" if args.answer_cache else "false",
+            "ANSWER_CACHE_DB": "",
+            "FAKE_LLM_LATENCY": str(args.latency),
+            "FAKE_LLM_TOKENS_PER_SECOND": str(args.tokens_per_second),
+            "FAKE_LLM_RESPONSE_TOKENS": str(args.response_tokens),
+            "FAKE_LLM_ERROR_RATE": str(args.error_rate),
+            "FAKE_LLM_SEED": str(args.seed),
+        }
+    )
+
+
+def synthetic_book(paragraphs: int = 400, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    words = [w for topic in TOPICS for w in topic.split()] + [
+        "система", "ядро", "ресурс", "пользователь", "задача", "операция",
+        "данные", "адрес", "страница", "очередь", "время", "запрос",
+    ]
+    lines = []
+    for i in range(paragraphs):
+        sentence = " ".join(rnd.choice(words) for _ in range(rnd.randint(20, 60)))
+        lines.append(f"{i + 1}. {sentence.capitalize()}.")
+    return "\n\n".join(lines)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Перцентиль методом ближайшего ранга.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, round(q / 100 * len(ordered) + 0.5))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+async def run_level(
+    request: Callable[[int], Awaitable[int]], total: int, concurrency: int
+) -> Dict[str, float]:
+    """
+    Выполняет `total` запросов, держа не больше `concurrency` одновременно.
+    """
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                status = await request(i)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    ok = statuses.get("200", 0)
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "ok": ok,
+        "errors": total - ok,
+        "statuses": statuses,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput_rps": ok / elapsed if elapsed else 0.0,
+        "elapsed_s": elapsed,
+    }
+
+
+async def wait_for_job(client, status_url: str, timeout: float = 120.0) -> dict:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        job = (await client.get(status_url)).json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        await asyncio.sleep(0.05)
+    raise TimeoutError(f"Загрузка не завершилась: {status_url}")
+
+
+async def run_benchmark(args: argparse.Namespace, workdir: Path) -> Dict[str, dict]:
+    import httpx
+
+    from main import app
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+    distinct = args.distinct or args.requests
+
+    def question(i: int) -> str:
+        k = i % distinct
+        return f"Что в книге сказано про {TOPICS[k % len(TOPICS)]}? (вопрос {k})"
+
+    results: Dict[str, dict] = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=300
+        ) as client:
+            book = args.book
+            if book is None:
+                book = workdir / "book.txt"
+                book.write_text(synthetic_book(seed=args.seed), encoding="utf-8")
+            with open(book, "rb") as fh:
+                response = await client.post(
+                    "/api/upload_file/", files={"files": (book.name, fh)}
+                )
+            response.raise_for_status()
+            setup = response.json()
+            job = await wait_for_job(client, setup["status_url"])
+            if job["status"] != "completed":
+                raise RuntimeError(f"Не удалось проиндексировать книгу: {job}")
+            corpus_id = setup["corpus_id"]
+
+            async def chat(i: int) -> int:
+                r = await client.post("/api/chat/", json={"message": question(i)})
+                return r.status_code
+
+            async def rag(i: int) -> int:
+                r = await client.post(
+                    "/api/rag/query",
+                    json={"corpus_id": corpus_id, "query": question(i)},
+                )
+                return r.status_code
+
+            upload_seq = iter(range(10**9))
+
+            async def upload(i: int) -> int:
+                n = next(upload_seq)
+                body = f"Заметка {n}. " + synthetic_book(paragraphs=5, seed=n)
+                r = await client.post(
+                    "/api/upload_file/",
+                    files={"files": (f"note-{n}.txt", body.encode("utf-8"))},
+                    data={"corpus_id": corpus_id},
+                )
+                return r.status_code
+
+            requests = {"chat": chat, "rag": rag, "upload": upload}
+            for scenario in scenarios:
+                for level in levels:
+                    key = f"{scenario}@{level}"
+                    results[key] = await run_level(requests[scenario], args.requests, level)
+                    print(format_row(key, results[key]), flush=True)
+    return results
+
+
+def format_row(key: str, r: dict) -> str:
+    return (
+        f"{key:<12} ok={r['ok']:<5} err={r['errors']:<4} "
+        f"p50={r['p50_ms']:8.1f}ms p95={r['p95_ms']:8.1f}ms p99={r['p99_ms']:8.1f}ms "
+        f"{r['throughput_rps']:8.1f} rps"
+    )
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    Возвращает список регрессий относительно базового прогона.
+    """
+    regressions = []
+    for key, base in baseline.items():
+        current = results.get(key)
+        if current is None:
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{key}: p95 {current['p95_ms']:.1f}ms > {base['p95_ms']:.1f}ms"
+            )
+        if current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{key}: {current['throughput_rps']:.1f} rps < {base['throughput_rps']:.1f} rps"
+            )
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{key}: ошибок {current['errors']} > {base['errors']}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="kasa-bench-") as tmp:
+        workdir = Path(tmp)
+        configure_environment(args, workdir)
+        results = asyncio.run(run_benchmark(args, workdir))
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"✅ Результаты сохранены в {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print("❌ Регрессии производительности:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("✅ Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
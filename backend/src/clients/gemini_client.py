@@ -1,48 +1,113 @@
+import logging
 from functools import lru_cache
-from google import genai
+from typing import AsyncIterator, Optional
+
 from google.genai.errors import APIError
 
+from clients.llm_backend import LLMBackend, get_llm_backend
 from config import settings
+from core.dispatcher import DispatcherError, PRIORITY_INTERACTIVE, get_gemini_dispatcher
+from core.single_flight import SingleFlight
+from core.tracing import log_event
 
 
 class GeminiClient:
     """
     Класс-обертка для взаимодействия с Gemini API.
     Инициализируется в FastAPI lifespan startup.
+
+    Сама модель вызывается через LLMBackend: по умолчанию это Gemini,
+    а с LLM_BACKEND=fake — локальная заглушка без сети.
     """
 
-    def __init__(self, api_key: str, model_name: str = "gemini-2.5-flash"):
+    def __init__(
+        self,
+        api_key: str,
+        model_name: str = "gemini-2.5-flash",
+        backend: Optional[LLMBackend] = None,
+    ):
         """
         Инициализация клиента Gemini API.
+
+        Args:
+            api_key: Ключ Gemini API
+            model_name: Название модели
+            backend: Готовый бэкенд модели (по умолчанию из settings.LLM_BACKEND)
         """
         self.model_name = model_name
-        print(f"⚙️ Инициализация клиента Gemini API (модель: {self.model_name})...")
+        # Одинаковые одновременные промпты отправляются в модель один раз
+        self.single_flight = SingleFlight()
+        # Общая очередь, лимит одновременных запросов и повторы
+        self.dispatcher = get_gemini_dispatcher()
+        log_event("Инициализация клиента Gemini API", model=self.model_name)
 
         try:
-            self.client = genai.Client(api_key=api_key)
-            print("🎉 Клиент Gemini API успешно инициализирован.")
+            self.backend = backend or get_llm_backend(api_key=api_key)
+            # Клиент google-genai (у локальной заглушки его нет)
+            self.client = getattr(self.backend, "client", None)
+            log_event("Клиент модели инициализирован", backend=self.backend.name)
         except Exception as e:
             raise RuntimeError(f"❌ Ошибка инициализации Gemini Client: {e}")
 
-    def generate_text(self, prompt: str) -> str:
+    async def generate_text(
+        self, prompt: str, priority: int = PRIORITY_INTERACTIVE
+    ) -> str:
         """
         Отправляет одноразовый запрос на генерацию текста.
+        Использует асинхронный клиент, чтобы не блокировать event loop.
+        Одинаковые запросы, пришедшие одновременно, ждут один общий ответ.
+
+        Запрос идёт через общий диспетчер; при переполнении очереди
+        выбрасывается OverloadedError, при истечении дедлайна —
+        DeadlineExceededError.
         """
-        if self.client is None:
+        if self.backend is None:
             return "❌ Ошибка: Клиент не инициализирован."
 
-        print(f"⚙️ Запрос к модели {self.model_name}...")
+        return await self.single_flight.do(
+            (self.model_name, prompt), lambda: self._generate_text(prompt, priority)
+        )
+
+    async def _generate_text(self, prompt: str, priority: int) -> str:
+        log_event("Запрос к модели", logging.DEBUG, model=self.model_name)
         try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=[prompt],
+            return await self.dispatcher.run(
+                lambda: self.backend.generate(self.model_name, prompt),
+                priority=priority,
             )
-            return response.text
+        except DispatcherError:
+            raise
         except APIError as e:
             return f"❌ Ошибка API: {e}"
         except Exception as e:
             return f"❌ Непредвиденная ошибка: {e}"
 
+    async def stream_text(
+        self, prompt: str, priority: int = PRIORITY_INTERACTIVE
+    ) -> AsyncIterator[str]:
+        """
+        Потоково отдаёт фрагменты ответа по мере генерации.
+        Слот диспетчера занят до конца потока.
+        """
+        if self.backend is None:
+            yield "❌ Ошибка: Клиент не инициализирован."
+            return
+
+        log_event("Потоковый запрос к модели", logging.DEBUG, model=self.model_name)
+        try:
+            stream = self.dispatcher.stream(
+                lambda: self.backend.open_stream(self.model_name, prompt),
+                priority=priority,
+            )
+            async for text in stream:
+                yield text
+        except DispatcherError:
+            raise
+        except APIError as e:
+            yield f"❌ Ошибка API: {e}"
+        except Exception as e:
+            yield f"❌ Непредвиденная ошибка: {e}"
+
 
 # Глобальный экземпляр будет создан в lifespan
 gemini_client: GeminiClient | None = None
@@ -1,12 +1,80 @@
-from typing import Optional, List
+import contextvars
+import heapq
+import json
+import logging
+import re
+import shutil
+import threading
+import time
+from typing import AsyncIterator, Optional, List, Dict, Tuple
 from pathlib import Path
 
 from google import genai
 from google.genai.errors import APIError
-from docx import Document  # для извлечения текста из .docx
-from pypdf import PdfReader  # для извлечения текста из .pdf
 
+from clients.llm_backend import GeminiBackend, LLMBackend
 from config import settings
+from core.dispatcher import (
+    DispatcherError,
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    get_gemini_dispatcher,
+)
+from core.executors import get_executor, run_blocking
+from core.files import fsync_paths, write_text_atomic
+from core.metrics import INDEX_BUILD_SECONDS, RETRIEVAL_SECONDS
+from core.tracing import log_event, span
+from rag.blob_store import BLOBS_DIR_NAME, BlobStore, RefsCorruptedError
+from rag.corpus_index import CorpusIndex
+from rag.catalog import (
+    FILE_FAILED,
+    FILE_INDEXED,
+    FILE_PENDING,
+    CorpusCatalog,
+    CorpusNotFoundError,
+)
+from rag.fts_index import FtsIndex
+from rag.context import assemble_context, context_budget, estimate_tokens
+from rag.extraction import ExtractionError
+from rag.vector_index import get_embedder
+
+RETRIEVAL_MODES = ("bm25", "dense", "hybrid", "fts")
+# Константа сглаживания в Reciprocal Rank Fusion для гибридного режима
+RRF_K = 60
+# Манифест корпуса: имя файла -> sha256 блоба в хранилище
+MANIFEST_FILE = ".manifest.json"
+# Директория с индексами корпуса
+INDEX_DIR_NAME = ".cache"
+DEFAULT_SYSTEM_PROMPT = (
+    "Ты ассистент, который отвечает на вопросы по книге. "
+    "Отвечай просто, без форматирования."
+)
+# Начало ответа на N-й вопрос в пакетном ответе модели: «[N] ...»
+_BATCH_ANSWER_RE = re.compile(r"^\s*\[(\d+)\]\s*", re.MULTILINE)
+
+
+class RetrievalModeError(ValueError):
+    """Режим поиска неизвестен или выключен в настройках (HTTP 400)."""
+
+
+def parse_batch_answers(text: str, expected: int) -> Optional[List[str]]:
+    """
+    Делит пакетный ответ модели на ответы по номерам «[N]».
+    Возвращает None, если хотя бы одного ответа нет или он пустой.
+    """
+    if not text:
+        return None
+    answers: Dict[int, str] = {}
+    markers = list(_BATCH_ANSWER_RE.finditer(text))
+    for current, following in zip(markers, markers[1:] + [None]):
+        number = int(current.group(1))
+        end = following.start() if following is not None else len(text)
+        answer = text[current.end() : end].strip()
+        if 1 <= number <= expected and answer and number not in answers:
+            answers[number] = answer
+    if len(answers) != expected:
+        return None
+    return [answers[i] for i in range(1, expected + 1)]
 
 
 class GeminiRagClient:
@@ -15,20 +83,95 @@ class GeminiRagClient:
     Вместо официального Gemini RAG API (corpora, files и т.п.)
     мы используем обычный Gemini client и локальные файлы как «корпуса».
 
-    Корпус = директория в `UPLOAD_DIR / \"corpora\" / <corpus_id>`,
-    где лежат файлы книги.
+    Корпус = директория в `UPLOAD_DIR / \"corpora\" / <corpus_id>` с манифестом,
+    который ссылается на файлы в контентно-адресуемом хранилище
+    `UPLOAD_DIR / \"blobs\"`. Одинаковая книга в разных корпусах хранится,
+    извлекается и векторизуется один раз. В `.cache/` корпуса лежат
+    BM25-индекс и плотный векторный индекс по чанкам.
+
+    Списки корпусов и файлов берутся из каталога в SQLite (CorpusCatalog),
+    который меняется в одной транзакции с манифестом. Если включён
+    RAG_FTS_ENABLED (или режим по умолчанию — fts), чанки всех корпусов
+    ещё и лежат в общем индексе SQLite FTS5 (режим поиска "fts"): он на диске
+    и не держит корпуса в памяти.
     """
 
-    def __init__(self, genai_client: genai.Client):
+    def __init__(
+        self,
+        genai_client: Optional[genai.Client] = None,
+        backend: Optional[LLMBackend] = None,
+    ):
         """
         Инициализация клиента RAG.
 
         Args:
             genai_client: Экземпляр genai.Client для работы с API
+            backend: Бэкенд модели; если не задан, используется genai_client
         """
         self.client = genai_client
+        self.backend = backend or GeminiBackend(client=genai_client)
         self.corpora_root = settings.UPLOAD_DIR / "corpora"
         self.corpora_root.mkdir(parents=True, exist_ok=True)
+        self.blob_store = BlobStore(settings.UPLOAD_DIR / BLOBS_DIR_NAME)
+        self.embedder = get_embedder(settings.RAG_EMBEDDER, settings.RAG_EMBEDDING_DIM)
+        # Тот же диспетчер, что и у GeminiClient: общий лимит на все запросы к модели
+        self.dispatcher = get_gemini_dispatcher()
+        # corpus_id -> индексы корпуса в памяти, обновляются по файлам
+        self._indexes: Dict[str, CorpusIndex] = {}
+        self._index_lock = threading.Lock()
+        # Обновления индекса одного корпуса идут по очереди
+        self._corpus_locks: Dict[str, threading.Lock] = {}
+        self._compacting: set = set()
+        # Защищает чтение-изменение-запись манифестов
+        self._manifest_lock = threading.RLock()
+
+        self.catalog = CorpusCatalog(
+            Path(settings.CORPUS_CATALOG_DB)
+            if settings.CORPUS_CATALOG_DB
+            else settings.UPLOAD_DIR / "catalog.sqlite3"
+        )
+        self.fts: Optional[FtsIndex] = None
+        # FTS5 строится только если он включён или нужен режиму по умолчанию:
+        # иначе каждая загрузка индексировала бы чанки дважды
+        if settings.RAG_FTS_ENABLED or settings.RAG_RETRIEVAL_MODE == "fts":
+            self.fts = FtsIndex(
+                Path(settings.RAG_FTS_DB)
+                if settings.RAG_FTS_DB
+                else settings.UPLOAD_DIR / "fts.sqlite3"
+            )
+
+        # Первый запуск с каталогом: регистрируем уже существующие корпуса
+        if self.catalog.is_empty() and any(
+            d.is_dir() for d in self.corpora_root.iterdir()
+        ):
+            report = self.rescan_catalog()
+            log_event("Каталог корпусов заполнен с диска", **report)
+
+        # Сборка мусора — после заполнения каталога: он защищает блобы корпусов
+        self._collect_garbage()
+
+        if self.fts is not None:
+            get_executor().submit(contextvars.copy_context().run, self._sync_all_fts)
+
+    def _collect_garbage(self) -> None:
+        """
+        Удаляет блобы без ссылок. Если `refs.json` повреждён, счётчики
+        восстанавливаются по каталогу, а сборка мусора пропускается.
+        """
+        referenced = self.catalog.blob_refs()
+        try:
+            removed = self.blob_store.collect_garbage(referenced)
+        except RefsCorruptedError as e:
+            self.blob_store.rebuild_refs(referenced)
+            log_event(
+                "Счётчики ссылок на блобы восстановлены по каталогу",
+                logging.WARNING,
+                blobs=len(referenced),
+                error=str(e),
+            )
+            return
+        if removed:
+            log_event("Удалены блобы без ссылок", removed=removed)
 
     def _corpus_dir(self, corpus_id: str) -> Path:
         return self.corpora_root / corpus_id
@@ -43,78 +186,139 @@ class GeminiRagClient:
         safe_name = display_name.replace("/", "_").replace("\\", "_")
         corpus_dir = self._corpus_dir(safe_name)
         corpus_dir.mkdir(parents=True, exist_ok=True)
-        print(f"✅ Локальный корпус '{display_name}' создан: {corpus_dir}")
+        with self._manifest_lock, self.catalog.transaction():
+            self.catalog.add_corpus(safe_name, display_name, time.time())
+            if not (corpus_dir / MANIFEST_FILE).exists():
+                self._save_manifest(safe_name, {})
+        log_event("Корпус создан", corpus_id=safe_name, display_name=display_name)
         return safe_name
 
-    def list_corpora(self) -> List[dict]:
+    def get_corpus(self, corpus_id: str) -> Optional[dict]:
         """
-        Возвращает список локальных корпусов (директорий).
+        Корпус из каталога (с временем создания, числом и размером файлов)
+        или None, если его нет.
         """
-        corpora: List[dict] = []
-        if not self.corpora_root.exists():
-            return corpora
+        return self.catalog.get_corpus(corpus_id)
 
-        for d in self.corpora_root.iterdir():
-            if d.is_dir():
-                corpora.append(
-                    {
-                        "name": d.name,
-                        "display_name": d.name,
-                        "create_time": None,
-                    }
-                )
-        return corpora
+    def list_corpora(
+        self,
+        limit: int = 100,
+        offset: int = 0,
+        query: Optional[str] = None,
+        sort: str = "created",
+        descending: bool = False,
+    ) -> Tuple[List[dict], int]:
+        """
+        Возвращает страницу корпусов из каталога и их общее число
+        (см. CorpusCatalog.list_corpora).
+        """
+        return self.catalog.list_corpora(limit, offset, query, sort, descending)
 
-    def list_files(self, corpus_id: str) -> List[dict]:
+    def list_files(
+        self,
+        corpus_id: str,
+        limit: int = 100,
+        offset: int = 0,
+        query: Optional[str] = None,
+        status: Optional[str] = None,
+        sort: str = "name",
+        descending: bool = False,
+    ) -> Tuple[List[dict], int]:
         """
-        Возвращает список файлов в указанном корпусе.
+        Возвращает страницу файлов корпуса из каталога и их общее число.
         """
-        corpus_dir = self._corpus_dir(corpus_id)
-        if not corpus_dir.exists():
-            raise FileNotFoundError(f"Корпус не найден: {corpus_id}")
-
-        files: List[dict] = []
-        for f in corpus_dir.iterdir():
-            if f.is_file():
-                files.append(
-                    {
-                        "corpus_id": corpus_id,
-                        "filename": f.name,
-                        "size": f.stat().st_size,
-                    }
-                )
-        return files
+        return self.catalog.list_files(
+            corpus_id, limit, offset, query, status, sort, descending
+        )
 
     def upload_file_to_corpus(
         self, corpus_id: str, file_path: str, display_name: Optional[str] = None
     ) -> str:
         """
-        Копирует файл в директорию корпуса.
+        Добавляет файл в корпус и индексирует его.
+
+        Файл кладётся в хранилище по SHA-256 (жёсткой ссылкой на уже
+        сохранённую загрузку), а в манифест корпуса записывается только хэш.
+        Если такая книга уже есть в любом корпусе, её текст, чанки и векторы
+        берутся готовыми.
         """
         src = Path(file_path)
         if not src.exists():
             raise FileNotFoundError(f"Файл не найден: {file_path}")
 
-        corpus_dir = self._corpus_dir(corpus_id)
-        corpus_dir.mkdir(parents=True, exist_ok=True)
-
         target_name = display_name or src.name
-        dst = corpus_dir / target_name
-        dst.write_bytes(src.read_bytes())
+        with span("store"):
+            # Ссылка на блоб берётся сразу, чтобы его не удалил чужой decref
+            sha256 = self.blob_store.put_file(src)
+
+        try:
+            with self._manifest_lock:
+                manifest = self._load_manifest(corpus_id, create=True)
+                previous = manifest.get(target_name)
+                duplicate = previous is not None and previous["sha256"] == sha256
+                if not duplicate:
+                    entry = {
+                        "sha256": sha256,
+                        "size": src.stat().st_size,
+                        "added_at": time.time(),
+                    }
+                    with self.catalog.transaction():
+                        self.catalog.add_corpus(corpus_id, corpus_id, entry["added_at"])
+                        self.catalog.upsert_file(corpus_id, target_name, **entry)
+                        manifest[target_name] = entry
+                        self._save_manifest(corpus_id, manifest)
+        except BaseException:
+            self.blob_store.decref(sha256)
+            raise
+
+        if duplicate:
+            # У файла в манифесте уже есть своя ссылка на блоб — лишнюю отпускаем
+            self.blob_store.decref(sha256)
+            log_event("Файл уже есть в корпусе", corpus_id=corpus_id, filename=target_name)
+            return f"{corpus_id}/{target_name}"
+        # Файл с таким именем перезаписан — старый блоб больше не нужен корпусу
+        if previous is not None:
+            self.blob_store.decref(previous["sha256"])
+
+        # Индексируем сразу при загрузке, чтобы запросы не платили за парсинг
+        try:
+            self._reindex(corpus_id)
+        except Exception as e:
+            self.catalog.set_file_status(
+                corpus_id, {target_name: (FILE_FAILED, str(e))}, time.time()
+            )
+            raise
+        status, error = self.catalog.file_status(corpus_id, target_name)
+        if status == FILE_FAILED:
+            # Файл остаётся в корпусе со статусом failed, но загрузка — ошибка
+            raise ExtractionError(error or f"Не удалось разобрать файл {target_name}")
 
-        print(f"✅ Файл {src} добавлен в локальный корпус {corpus_id} как {dst.name}")
-        return str(dst)
+        log_event(
+            "Файл добавлен в корпус",
+            corpus_id=corpus_id,
+            filename=target_name,
+            blob=sha256[:12],
+        )
+        return f"{corpus_id}/{target_name}"
 
     def delete_file(self, corpus_id: str, filename: str) -> bool:
         """
         Удаляет файл из корпуса.
         """
-        corpus_dir = self._corpus_dir(corpus_id)
-        f = corpus_dir / filename
-        if not f.exists():
-            return False
-        f.unlink()
-        print(f"🗑️ Файл {f} удалён из корпуса {corpus_id}")
+        with self._manifest_lock:
+            try:
+                manifest = self._load_manifest(corpus_id)
+            except FileNotFoundError:
+                return False
+            entry = manifest.pop(filename, None)
+            if entry is None:
+                return False
+            with self.catalog.transaction():
+                self.catalog.delete_file(corpus_id, filename, time.time())
+                self._save_manifest(corpus_id, manifest)
+            self.blob_store.decref(entry["sha256"])
+        self._reindex(corpus_id)
+        log_event("Файл удалён из корпуса", corpus_id=corpus_id, filename=filename)
         return True
 
     def delete_corpus(self, corpus_id: str) -> bool:
@@ -122,171 +326,732 @@ class GeminiRagClient:
         Удаляет корпус и все файлы внутри.
         """
         corpus_dir = self._corpus_dir(corpus_id)
-        if not corpus_dir.exists():
-            return False
-
-        # Удаляем все файлы
-        for f in corpus_dir.iterdir():
-            if f.is_file():
-                f.unlink()
-        # И саму директорию
-        corpus_dir.rmdir()
-        print(f"🗑️ Корпус {corpus_id} удалён")
+        # Блокировка корпуса — чтобы не удалить директорию посреди
+        # обновления или фонового уплотнения его индекса. Проверка
+        # существования — под ней же: иначе два параллельных удаления
+        # оба отпустили бы ссылки на одни и те же блобы
+        with self._corpus_lock(corpus_id), self._manifest_lock:
+            if not corpus_dir.exists():
+                return False
+            manifest = self._load_manifest(corpus_id)
+            with self._index_lock:
+                self._indexes.pop(corpus_id, None)
+            with self.catalog.transaction():
+                self.catalog.delete_corpus(corpus_id)
+                shutil.rmtree(corpus_dir)
+            if self.fts is not None:
+                self.fts.delete_corpus(corpus_id)
+            # Блобы удаляются, только если на них не ссылаются другие корпуса
+            for entry in manifest.values():
+                self.blob_store.decref(entry["sha256"])
+        log_event("Корпус удалён", corpus_id=corpus_id)
         return True
 
-    def _read_corpus_text(self, corpus_id: str) -> str:
+    def _file_status(self, sha256: str) -> Tuple[str, Optional[str]]:
+        """
+        Статус извлечения файла по артефактам блоба: чанки для текущих
+        настроек уже есть — файл проиндексирован.
+        """
+        if not self.blob_store.blob_path(sha256).exists():
+            return FILE_FAILED, "Файл отсутствует в хранилище"
+        chunks = self.blob_store.chunks_path(
+            sha256, settings.RAG_CHUNK_SIZE, settings.RAG_CHUNK_OVERLAP
+        )
+        return (FILE_INDEXED if chunks.exists() else FILE_PENDING), None
+
+    def rescan_catalog(self) -> dict:
+        """
+        Сверяет каталог с корпусами на диске и исправляет расхождения:
+        добавляет корпуса и файлы, которых нет в каталоге, удаляет
+        исчезнувшие и обновляет изменённые. Каждый корпус сверяется
+        отдельной транзакцией, чтобы не задерживать списки надолго.
+
+        Returns:
+            dict: Сколько корпусов проверено, добавлено и удалено, сколько файлов исправлено
+        """
+        report = {
+            "corpora": 0,
+            "added": 0,
+            "removed": 0,
+            "files_updated": 0,
+            "files_removed": 0,
+            "fts_files_updated": 0,
+        }
+        with self._manifest_lock:
+            on_disk = sorted(d for d in self.corpora_root.iterdir() if d.is_dir())
+            names = {d.name for d in on_disk}
+            for corpus_id in set(self.catalog.corpus_ids()) - names:
+                self.catalog.delete_corpus(corpus_id)
+                if self.fts is not None:
+                    self.fts.delete_corpus(corpus_id)
+                report["removed"] += 1
+
+            for corpus_dir in on_disk:
+                corpus_id = corpus_dir.name
+                manifest = self._load_manifest(corpus_id)
+                now = time.time()
+                created_at = min(
+                    (entry["added_at"] for entry in manifest.values()),
+                    default=corpus_dir.stat().st_mtime,
+                )
+                with self.catalog.transaction():
+                    if self.catalog.add_corpus(corpus_id, corpus_id, created_at):
+                        report["added"] += 1
+                    known = self.catalog.file_entries(corpus_id)
+                    for name in known.keys() - manifest.keys():
+                        self.catalog.delete_file(corpus_id, name, now)
+                        report["files_removed"] += 1
+                    statuses = {}
+                    for name, entry in manifest.items():
+                        if known.get(name) == (entry["sha256"], entry["size"]):
+                            continue
+                        self.catalog.upsert_file(
+                            corpus_id, name, entry["sha256"], entry["size"], entry["added_at"]
+                        )
+                        statuses[name] = self._file_status(entry["sha256"])
+                    self.catalog.set_file_status(corpus_id, statuses, now)
+                    report["files_updated"] += len(statuses)
+            report["corpora"] = len(on_disk)
+        # FTS5 — вне блокировки манифестов: _sync_fts берёт блокировку корпуса
+        if self.fts is not None:
+            for corpus_dir in on_disk:
+                report["fts_files_updated"] += self._sync_fts(corpus_dir.name)
+        return report
+
+    def _manifest_path(self, corpus_id: str) -> Path:
+        return self._corpus_dir(corpus_id) / MANIFEST_FILE
+
+    def _load_manifest(self, corpus_id: str, create: bool = False) -> Dict[str, dict]:
         """
-        Читает содержимое всех файлов в корпусе и склеивает в один текст.
+        Читает манифест корпуса.
 
-        - Для .txt / .md читаем как обычный текст
-        - Для .docx используем python-docx
-        - Для бинарных файлов (pdf, png и т.п.) пытаемся прочитать как текст,
-          но если там в основном бинарные данные — пропускаем
+        Корпуса старого формата (файлы прямо в директории) переносятся
+        в хранилище блобов при первом обращении. Исходные файлы удаляются
+        только после того, как блобы, ссылки на них и манифест записаны
+        на диск; если перенос упал, они остаются на месте.
         """
         corpus_dir = self._corpus_dir(corpus_id)
         if not corpus_dir.exists():
-            raise FileNotFoundError(f"Корпус не найден: {corpus_id}")
+            if not create:
+                raise CorpusNotFoundError(f"Корпус не найден: {corpus_id}")
+            corpus_dir.mkdir(parents=True, exist_ok=True)
 
-        parts: List[str] = []
+        with self._manifest_lock:
+            try:
+                return json.loads(self._manifest_path(corpus_id).read_text(encoding="utf-8"))
+            except FileNotFoundError:
+                pass
 
-        for f in corpus_dir.iterdir():
-            if not f.is_file():
-                continue
+            manifest: Dict[str, dict] = {}
+            legacy = sorted(
+                f for f in corpus_dir.iterdir() if f.is_file() and not f.name.startswith(".")
+            )
+            taken: List[str] = []
+            try:
+                for f in legacy:
+                    stat = f.stat()
+                    sha256 = self.blob_store.put_file(f)
+                    taken.append(sha256)
+                    manifest[f.name] = {
+                        "sha256": sha256,
+                        "size": stat.st_size,
+                        "added_at": stat.st_mtime,
+                    }
+                self._save_manifest(corpus_id, manifest)
+            except BaseException:
+                # Оригиналы не тронуты — перенос повторится при следующем чтении
+                for sha256 in taken:
+                    self.blob_store.decref(sha256)
+                raise
+            if legacy:
+                # Оригиналы удаляются, только когда блобы, счётчики ссылок
+                # и манифест уже сброшены на диск
+                self.blob_store.sync(taken)
+                fsync_paths([self._manifest_path(corpus_id)])
+            for f in legacy:
+                f.unlink()
+            # Извлечённый текст теперь хранится рядом с блобами
+            shutil.rmtree(self._index_dir(corpus_id) / "text", ignore_errors=True)
+            if legacy:
+                log_event(
+                    "Корпус перенесён в хранилище блобов", corpus_id=corpus_id, files=len(legacy)
+                )
+            return manifest
 
-            suffix = f.suffix.lower()
+    def _save_manifest(self, corpus_id: str, manifest: Dict[str, dict]) -> None:
+        write_text_atomic(
+            self._manifest_path(corpus_id), json.dumps(manifest, ensure_ascii=False)
+        )
 
-            # Текстовые файлы
-            if suffix in {".txt", ".md", ".markdown"}:
-                try:
-                    text = f.read_text(encoding="utf-8", errors="ignore")
-                    if text.strip():
-                        parts.append(f"Файл {f.name}:\n{text}")
-                except Exception:
-                    continue
-                continue
+    def _index_dir(self, corpus_id: str) -> Path:
+        return self._corpus_dir(corpus_id) / INDEX_DIR_NAME
 
-            # DOCX-файлы (книги / документы Word)
-            if suffix == ".docx":
-                try:
-                    doc = Document(str(f))
-                    text = "\n".join(p.text for p in doc.paragraphs)
-                    if text.strip():
-                        parts.append(f"Файл {f.name}:\n{text}")
-                except Exception:
-                    # Если не удалось распарсить, просто пропускаем
-                    continue
-                continue
+    def _corpus_signature(self, corpus_id: str) -> list:
+        """
+        Сигнатура содержимого корпуса: имена файлов и хэши их содержимого.
+        По ней индексы находят добавленные, заменённые и удалённые файлы.
+        """
+        manifest = self._load_manifest(corpus_id)
+        return [[name, entry["sha256"]] for name, entry in sorted(manifest.items())]
 
-            # PDF-файлы
-            if suffix == ".pdf":
-                try:
-                    reader = PdfReader(str(f))
-                    pages_text: List[str] = []
-                    for page in reader.pages:
-                        try:
-                            page_text = page.extract_text() or ""
-                        except Exception:
-                            page_text = ""
-                        if page_text.strip():
-                            pages_text.append(page_text)
-                    text = "\n\n".join(pages_text)
-                    if text.strip():
-                        parts.append(f"Файл {f.name}:\n{text}")
-                except Exception:
-                    # Если не удалось распарсить PDF, пропускаем
-                    continue
-                continue
+    def corpus_version(self, corpus_id: str) -> str:
+        """
+        Версия содержимого корпуса — счётчик в каталоге.
+        Растёт при любом добавлении, замене или удалении файла,
+        поэтому ключи кэша со старой версией больше не находятся.
+        """
+        version = self.catalog.get_version(corpus_id)
+        if version is None:
+            raise CorpusNotFoundError(f"Корпус не найден: {corpus_id}")
+        return str(version)
+
+    def _reindex(self, corpus_id: str) -> None:
+        """
+        Обновляет индексы корпуса после изменения его файлов: FTS5
+        (только изменившиеся файлы) и, если основной режим поиска
+        не "fts", индексы в памяти.
+        """
+        if self.fts is not None:
+            self._sync_fts(corpus_id)
+        if settings.RAG_RETRIEVAL_MODE != "fts":
+            self._update_index(corpus_id)
 
-            # Всё остальное пытаемся прочитать как текст,
-            # но фильтруем очевидный бинарник
+    def _sync_all_fts(self) -> None:
+        """
+        Доиндексирует в FTS5 корпуса, загруженные до его включения
+        (запускается в фоне при старте: поиск в FTS5 только читает).
+        """
+        for corpus_id in self.catalog.corpus_ids():
             try:
-                raw = f.read_bytes()
-                # Простая эвристика: доля непечатных символов
-                sample = raw[:2000]
-                non_printable = sum(1 for b in sample if b < 9 or (13 < b < 32))
-                if sample and non_printable / len(sample) > 0.3:
-                    # Похоже на бинарный файл — пропускаем
+                self._sync_fts(corpus_id)
+            except Exception as e:
+                log_event(
+                    "Ошибка индексации корпуса в FTS5",
+                    logging.WARNING,
+                    corpus_id=corpus_id,
+                    error=str(e),
+                )
+
+    def _sync_fts(self, corpus_id: str) -> int:
+        """
+        Приводит FTS5-индекс корпуса в соответствие с манифестом:
+        добавляет новые и изменённые файлы, удаляет исчезнувшие.
+        Пишет в FTS5 под блокировкой корпуса — только путь загрузки,
+        не поиск.
+
+        Returns:
+            int: Сколько файлов переиндексировано или удалено
+        """
+        with self._corpus_lock(corpus_id):
+            size, overlap = settings.RAG_CHUNK_SIZE, settings.RAG_CHUNK_OVERLAP
+            signature = dict(self._corpus_signature(corpus_id))
+            indexed = self.fts.files(corpus_id)
+            for name in indexed.keys() - signature.keys():
+                self.fts.delete_file(corpus_id, name)
+
+            statuses: Dict[str, Tuple[str, Optional[str]]] = {}
+            with span("fts_index", corpus_id=corpus_id):
+                for name, sha256 in signature.items():
+                    if indexed.get(name) == sha256:
+                        continue
+                    suffix = Path(name).suffix.lower()
+                    try:
+                        chunks = self.blob_store.iter_chunks(sha256, suffix, size, overlap)
+                        self.fts.replace_file(corpus_id, name, sha256, chunks)
+                    except (OSError, ExtractionError) as e:
+                        statuses[name] = (FILE_FAILED, str(e))
+                        continue
+                    statuses[name] = (FILE_INDEXED, None)
+            self.catalog.set_file_status(corpus_id, statuses, time.time())
+            return len(statuses) + len(indexed.keys() - signature.keys())
+
+    def _corpus_lock(self, corpus_id: str) -> threading.Lock:
+        with self._index_lock:
+            return self._corpus_locks.setdefault(corpus_id, threading.Lock())
+
+    def _update_index(self, corpus_id: str) -> CorpusIndex:
+        """
+        Приводит BM25 и векторный индексы корпуса в соответствие с манифестом.
+
+        Удалённые и заменённые файлы помечаются tombstone, новые
+        дописываются — стоимость пропорциональна изменившимся файлам,
+        а не корпусу. Текст, чанки и векторы каждого блоба кэшируются
+        в хранилище, так что та же книга в другом корпусе не парсится
+        и не векторизуется заново. С нуля индекс собирается, только если
+        его нет ни в памяти, ни на диске.
+        """
+        with self._corpus_lock(corpus_id), span("index", corpus_id=corpus_id):
+            started = time.perf_counter()
+            version = self.catalog.get_version(corpus_id)
+            signature = dict(self._corpus_signature(corpus_id))
+            size, overlap = settings.RAG_CHUNK_SIZE, settings.RAG_CHUNK_OVERLAP
+
+            with self._index_lock:
+                index = self._indexes.get(corpus_id)
+            if index is None:
+                index = CorpusIndex.load(self._index_dir(corpus_id), self.embedder)
+            rebuilt = index is None
+            if rebuilt:
+                index = CorpusIndex.empty(self.embedder, self._index_dir(corpus_id))
+
+            for name in sorted(index.files):
+                if signature.get(name) != index.files[name][0]:
+                    index.remove_file(name)
+            statuses: Dict[str, Tuple[str, Optional[str]]] = {}
+            for name, sha256 in sorted(signature.items()):
+                if name in index.files:
+                    continue
+                suffix = Path(name).suffix.lower()
+                batch = settings.RAG_INGEST_BATCH
+                try:
+                    # Векторы считаются первым проходом и заодно кэшируют чанки,
+                    # вторым проходом чанки читаются из кэша прямо в индекс
+                    matrix = self.blob_store.get_vectors(
+                        sha256, suffix, self.embedder, size, overlap, batch
+                    )
+                except (OSError, ExtractionError) as e:
+                    statuses[name] = (FILE_FAILED, str(e))
                     continue
-                text = sample.decode("utf-8", errors="ignore")
-                if text.strip():
-                    parts.append(f"Файл {f.name} (часть содержимого):\n{text}")
-            except Exception:
-                continue
+                chunks = self.blob_store.iter_chunks(sha256, suffix, size, overlap)
+                index.add_file(name, sha256, chunks, matrix, batch)
+                statuses[name] = (FILE_INDEXED, None)
 
-        return "\n\n".join(parts)
+            if rebuilt:
+                index.save(self._index_dir(corpus_id))
+            index.version = version
+            with self._index_lock:
+                self._indexes[corpus_id] = index
+            if statuses:
+                self.catalog.set_file_status(corpus_id, statuses, time.time())
+            INDEX_BUILD_SECONDS.observe(time.perf_counter() - started)
 
-    def query_corpus(
-        self, corpus_id: str, query: str, max_results: int = 5
+        if index.needs_compaction(
+            settings.RAG_COMPACTION_TOMBSTONE_RATIO, settings.RAG_COMPACTION_MAX_SEGMENTS
+        ):
+            self._schedule_compaction(corpus_id)
+        return index
+
+    def _schedule_compaction(self, corpus_id: str) -> None:
+        """
+        Запускает уплотнение индекса корпуса в пуле потоков, не дожидаясь его.
+        """
+        with self._index_lock:
+            if corpus_id in self._compacting:
+                return
+            self._compacting.add(corpus_id)
+        get_executor().submit(contextvars.copy_context().run, self._compact, corpus_id)
+
+    def _compact(self, corpus_id: str) -> None:
+        """
+        Собирает индекс корпуса без удалённых чанков и сохраняет его как базу.
+        Поиск всё это время идёт по старому индексу.
+        """
+        try:
+            with self._corpus_lock(corpus_id), span("compact", corpus_id=corpus_id):
+                with self._index_lock:
+                    index = self._indexes.get(corpus_id)
+                if index is None or not self._corpus_dir(corpus_id).exists():
+                    return
+                compacted = index.compact(self._index_dir(corpus_id))
+                compacted.save(self._index_dir(corpus_id))
+                with self._index_lock:
+                    self._indexes[corpus_id] = compacted
+            log_event(
+                "Индекс корпуса уплотнён",
+                corpus_id=corpus_id,
+                chunks=len(compacted.bm25.chunks),
+                removed=len(index.bm25.tombstones),
+            )
+        except Exception as e:
+            log_event(
+                "Ошибка уплотнения индекса", logging.WARNING, corpus_id=corpus_id, error=str(e)
+            )
+        finally:
+            with self._index_lock:
+                self._compacting.discard(corpus_id)
+
+    def _get_indexes(self, corpus_id: str) -> CorpusIndex:
+        """
+        Возвращает актуальные индексы корпуса. Пока версия корпуса
+        в каталоге не изменилась, манифест не читается.
+        """
+        version = self.catalog.get_version(corpus_id)
+        with self._index_lock:
+            index = self._indexes.get(corpus_id)
+        if index is None or version is None or index.version != version:
+            index = self._update_index(corpus_id)
+        return index
+
+    @staticmethod
+    def _fuse(rankings: List[List[Tuple[int, float]]], top_k: int) -> List[Tuple[int, float]]:
+        """
+        Объединяет несколько ранжирований через Reciprocal Rank Fusion.
+        """
+        fused: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, (chunk_id, _) in enumerate(ranking):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    @staticmethod
+    def merge_corpus_results(
+        results: List[List[dict]], top_k: int, retrieval_mode: str
     ) -> List[dict]:
         """
-        Упрощённый «поиск»: возвращаем один большой чанк со всем текстом корпуса.
+        Сливает найденные в разных корпусах чанки в общий top-k.
+
+        Оценки BM25 (bm25, fts) зависят от статистики корпуса и между
+        корпусами несравнимы, поэтому в каждом корпусе они делятся на
+        лучшую оценку этого корпуса и попадают в [0, 1]; при равенстве
+        выше идёт большая исходная оценка. Косинусная близость (dense)
+        и RRF (hybrid) от корпуса не зависят и сравниваются как есть.
+        Запасные чанки с нулевой оценкой остаются в конце.
         """
-        text = self._read_corpus_text(corpus_id)
-        if not text:
-            return []
+        normalize = retrieval_mode in ("bm25", "fts")
+        scored: List[Tuple[float, float, dict]] = []
+        for docs in results:
+            top = max((doc["relevance_score"] or 0.0 for doc in docs), default=0.0)
+            for doc in docs:
+                raw = doc["relevance_score"] or 0.0
+                score = raw / top if normalize and top > 0 else raw
+                scored.append((score, raw, {**doc, "relevance_score": score}))
+        best = heapq.nlargest(top_k, scored, key=lambda item: (item[0], item[1]))
+        return [doc for _, _, doc in best]
 
-        return [
-            {
-                "file_uri": corpus_id,
-                "chunk_uri": f"{corpus_id}#0",
-                "chunk": text,
-                "relevance_score": 1.0,
-            }
-        ]
+    def check_retrieval_mode(self, retrieval_mode: str) -> None:
+        """
+        Выбрасывает RetrievalModeError, если режим неизвестен
+        или это fts при выключенном FTS5-индексе.
+        """
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise RetrievalModeError(f"Неизвестный режим поиска: {retrieval_mode}")
+        if retrieval_mode == "fts" and self.fts is None:
+            raise RetrievalModeError("Поиск fts выключен: установите RAG_FTS_ENABLED=true")
 
-    def generate_rag_response(
+    def query_corpus(
         self,
         corpus_id: str,
         query: str,
-        model_name: str = "gemini-2.5-flash",
         max_results: int = 5,
-        system_prompt: Optional[str] = None,
-    ) -> str:
+        retrieval_mode: str = "bm25",
+    ) -> List[dict]:
         """
-        Генерирует ответ на основе текста из выбранного «корпуса» (книги).
+        Ищет в корпусе до `max_results` самых релевантных чанков.
+
+        Режимы поиска:
+        - "bm25" — лексический поиск по инвертированному индексу
+        - "dense" — косинусная близость локальных эмбеддингов
+        - "hybrid" — оба списка, объединённые через Reciprocal Rank Fusion
+
+        Если ничего не найдено (например, «сделай конспект» в режиме bm25),
+        возвращаются первые чанки с нулевым score, чтобы модель всё равно
+        получила ограниченный контекст.
         """
-        try:
-            relevant_docs = self.query_corpus(corpus_id, query, max_results)
+        self.check_retrieval_mode(retrieval_mode)
 
-            if not relevant_docs:
-                return (
-                    "Извините, не удалось прочитать загруженную книгу "
-                    "или в ней нет текста."
-                )
+        started = time.perf_counter()
+        if retrieval_mode == "fts":
+            results = self._query_fts(corpus_id, query, max_results)
+            RETRIEVAL_SECONDS.observe(time.perf_counter() - started, retrieval_mode)
+            return results
 
-            context = "\n\n".join(
-                [
-                    f"Документ {i+1}:\n{doc['chunk']}"
-                    for i, doc in enumerate(relevant_docs)
-                ]
+        index = self._get_indexes(corpus_id)
+        if retrieval_mode == "bm25":
+            hits = index.bm25.search(query, max_results)
+        elif retrieval_mode == "dense":
+            hits = index.vectors.search(query, max_results)
+        else:
+            # Берём с запасом, чтобы слияние было из чего делать
+            pool = max_results * 4
+            hits = self._fuse(
+                [index.bm25.search(query, pool), index.vectors.search(query, pool)],
+                max_results,
             )
+        results = self._hits_to_results(corpus_id, index, hits, max_results)
+        RETRIEVAL_SECONDS.observe(time.perf_counter() - started, retrieval_mode)
+        return results
 
-            base_prompt = system_prompt or (
-                "Ты ассистент, который отвечает на вопросы по книге. "
-                "Отвечай просто, без форматирования."
-            )
+    def query_corpus_batch(
+        self,
+        corpus_id: str,
+        queries: List[str],
+        max_results: int = 5,
+        retrieval_mode: str = "bm25",
+    ) -> List[List[dict]]:
+        """
+        То же, что query_corpus, но сразу для списка вопросов к одному корпусу.
 
-            prompt = f"""{base_prompt}
+        Индексы загружаются один раз, а плотный поиск по всем вопросам —
+        одно матричное произведение (VectorIndex.search_many).
+        Результаты идут в порядке вопросов.
+        """
+        self.check_retrieval_mode(retrieval_mode)
+
+        started = time.perf_counter()
+        if retrieval_mode == "fts":
+            results = [self._query_fts(corpus_id, q, max_results) for q in queries]
+            RETRIEVAL_SECONDS.observe(time.perf_counter() - started, retrieval_mode)
+            return results
+
+        index = self._get_indexes(corpus_id)
+        if retrieval_mode == "bm25":
+            batch_hits = [index.bm25.search(q, max_results) for q in queries]
+        elif retrieval_mode == "dense":
+            batch_hits = index.vectors.search_many(queries, max_results)
+        else:
+            pool = max_results * 4
+            dense = index.vectors.search_many(queries, pool)
+            batch_hits = [
+                self._fuse([index.bm25.search(q, pool), dense_hits], max_results)
+                for q, dense_hits in zip(queries, dense)
+            ]
+        results = [
+            self._hits_to_results(corpus_id, index, hits, max_results)
+            for hits in batch_hits
+        ]
+        RETRIEVAL_SECONDS.observe(time.perf_counter() - started, retrieval_mode)
+        return results
+
+    @staticmethod
+    def _hits_to_results(
+        corpus_id: str, index: CorpusIndex, hits: List[Tuple[int, float]], max_results: int
+    ) -> List[dict]:
+        if not hits:
+            hits = [(i, 0.0) for i in index.bm25.live_ids(max_results)]
+
+        # Текст читается из хранилища только для найденных чанков
+        return [
+            GeminiRagClient._chunk_result(corpus_id, index.chunk(chunk_id), score)
+            for chunk_id, score in hits
+        ]
+
+    @staticmethod
+    def _chunk_result(corpus_id: str, chunk: dict, score: float) -> dict:
+        return {
+            "file_uri": f"{corpus_id}/{chunk['file']}",
+            "chunk_uri": f"{corpus_id}/{chunk['file']}#{chunk['position']}",
+            "chunk": chunk["text"],
+            "page": chunk.get("page"),
+            "relevance_score": score,
+        }
+
+    def _query_fts(self, corpus_id: str, query: str, max_results: int) -> List[dict]:
+        """
+        Поиск одним запросом к FTS5-индексу; если ничего не найдено,
+        возвращаются первые чанки корпуса с нулевым score, как в bm25.
+
+        Только читает: FTS5 обновляется при загрузке и удалении файлов
+        (_reindex), а корпуса, загруженные до включения FTS, — при старте.
+        """
+        chunks = self.fts.search(corpus_id, query, max_results) or self.fts.first_chunks(
+            corpus_id, max_results
+        )
+        return [self._chunk_result(corpus_id, chunk, chunk["score"]) for chunk in chunks]
+
+    def build_rag_prompt(
+        self,
+        query: str,
+        relevant_docs: List[dict],
+        system_prompt: Optional[str] = None,
+        history: Optional[str] = None,
+    ) -> str:
+        """
+        Собирает промпт для модели из вопроса и найденных чанков
+        (и истории разговора, если вопрос задан в сессии чата).
+        """
+        context = self._format_context(relevant_docs)
+        base_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
+        history_block = f"История разговора:\n{history}\n\n" if history else ""
+
+        return f"""{base_prompt}
 
 Контекст (текст книги или её части):
 {context}
 
-Вопрос пользователя: {query}
+{history_block}Вопрос пользователя: {query}
 
 Дай развёрнутый ответ, опираясь ТОЛЬКО на текст выше. Если ответа нет в тексте, честно скажи об этом.
 Ответ:"""
 
-            response = self.client.models.generate_content(
-                model=model_name,
-                contents=[prompt],
+    @staticmethod
+    def _format_context(relevant_docs: List[dict]) -> str:
+        return "\n\n".join(
+            [
+                f"Документ {i+1} ({doc['file_uri']}"
+                + (f", стр. {doc['page']}" if doc.get("page") else "")
+                + f"):\n{doc['chunk']}"
+                for i, doc in enumerate(relevant_docs)
+            ]
+        )
+
+    def build_batch_rag_prompt(
+        self,
+        queries: List[str],
+        relevant_docs: List[dict],
+        system_prompt: Optional[str] = None,
+    ) -> str:
+        """
+        Промпт для нескольких вопросов с общим контекстом: модель отвечает
+        на все вопросы одним ответом, каждый ответ начинается с «[N]».
+        """
+        context = self._format_context(relevant_docs)
+        base_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
+        questions = "\n".join(f"[{i + 1}] {q}" for i, q in enumerate(queries))
+
+        return f"""{base_prompt}
+
+Контекст (текст книги или её части):
+{context}
+
+Вопросы пользователя:
+{questions}
+
+Ответь на каждый вопрос отдельно, опираясь ТОЛЬКО на текст выше. Если ответа нет в тексте, честно скажи об этом.
+Начинай каждый ответ с новой строки с номера вопроса в квадратных скобках, например «[1] ...», и не пропускай вопросы.
+Ответы:"""
+
+    async def generate_batch_from_documents(
+        self,
+        queries: List[str],
+        relevant_docs: List[dict],
+        model_name: str = "gemini-2.5-flash",
+        system_prompt: Optional[str] = None,
+        priority: int = PRIORITY_BATCH,
+    ) -> Optional[List[str]]:
+        """
+        Отвечает на несколько вопросов одним запросом к модели.
+
+        Returns:
+            Ответы в порядке вопросов или None, если модель не ответила
+            в ожидаемом формате (тогда вопросы задаются по одному).
+        """
+        if not relevant_docs:
+            return None
+        try:
+            prompt = self.build_batch_rag_prompt(queries, relevant_docs, system_prompt)
+            text = await self.dispatcher.run(
+                lambda: self.backend.generate(model_name, prompt),
+                priority=priority,
+            )
+        except DispatcherError:
+            raise
+        except Exception as e:
+            log_event(
+                "Ошибка пакетной генерации RAG ответа",
+                logging.WARNING,
+                questions=len(queries),
+                error=str(e),
             )
+            return None
+        return parse_batch_answers(text, len(queries))
 
-            return response.text
+    async def generate_from_documents(
+        self,
+        query: str,
+        relevant_docs: List[dict],
+        model_name: str = "gemini-2.5-flash",
+        system_prompt: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        history: Optional[str] = None,
+    ) -> str:
+        """
+        Генерирует ответ по уже найденным чанкам, не обращаясь к индексу.
+
+        Args:
+            query: Вопрос пользователя
+            relevant_docs: Чанки в формате query_corpus
+            model_name: Название модели
+            system_prompt: Системный промпт
+            priority: Приоритет запроса в очереди диспетчера
+            history: История разговора сессии чата
+        """
+        if not relevant_docs:
+            return (
+                "Извините, не удалось прочитать загруженную книгу "
+                "или в ней нет текста."
+            )
+
+        try:
+            prompt = self.build_rag_prompt(query, relevant_docs, system_prompt, history)
+            return await self.dispatcher.run(
+                lambda: self.backend.generate(model_name, prompt),
+                priority=priority,
+            )
+        except DispatcherError:
+            raise
         except APIError as e:
             return f"❌ Ошибка генерации RAG ответа: {e}"
         except Exception as e:
             return f"❌ Непредвиденная ошибка при генерации ответа: {e}"
 
+    async def stream_from_documents(
+        self,
+        query: str,
+        relevant_docs: List[dict],
+        model_name: str = "gemini-2.5-flash",
+        system_prompt: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        history: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """
+        То же, что generate_from_documents, но отдаёт ответ по частям
+        по мере генерации.
+        """
+        if not relevant_docs:
+            yield (
+                "Извините, не удалось прочитать загруженную книгу "
+                "или в ней нет текста."
+            )
+            return
+
+        try:
+            prompt = self.build_rag_prompt(query, relevant_docs, system_prompt, history)
+            stream = self.dispatcher.stream(
+                lambda: self.backend.open_stream(model_name, prompt),
+                priority=priority,
+            )
+            async for text in stream:
+                yield text
+        except DispatcherError:
+            raise
+        except APIError as e:
+            yield f"❌ Ошибка генерации RAG ответа: {e}"
+        except Exception as e:
+            yield f"❌ Непредвиденная ошибка при генерации ответа: {e}"
+
+    async def generate_rag_response(
+        self,
+        corpus_id: str,
+        query: str,
+        model_name: str = "gemini-2.5-flash",
+        max_results: int = 5,
+        system_prompt: Optional[str] = None,
+        retrieval_mode: str = "bm25",
+    ) -> str:
+        """
+        Генерирует ответ на основе текста из выбранного «корпуса» (книги).
+
+        Выполняет поиск сам; если чанки уже найдены, используйте
+        generate_from_documents, чтобы не искать второй раз.
+        """
+        try:
+            # Поиск может упереться в парсинг файлов — выполняем его в пуле
+            relevant_docs = await run_blocking(
+                self.query_corpus, corpus_id, query, max_results, retrieval_mode
+            )
+        except Exception as e:
+            return f"❌ Непредвиденная ошибка при генерации ответа: {e}"
+
+        # Чанки укладываются в бюджет токенов модели
+        reserved = estimate_tokens(self.build_rag_prompt(query, [], system_prompt))
+        relevant_docs, _ = assemble_context(
+            relevant_docs, context_budget(model_name), reserved
+        )
+
+        return await self.generate_from_documents(
+            query, relevant_docs, model_name=model_name, system_prompt=system_prompt
+        )
+
 
 # Глобальный экземпляр будет создан в lifespan
 gemini_rag_client: GeminiRagClient | None = None
@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import random
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Optional
+
+from config import settings
+
+
+class LLMBackend(ABC):
+    """
+    Базовый класс бэкенда языковой модели.
+
+    GeminiClient и GeminiRagClient обращаются к модели только через
+    эти два метода, поэтому реальный Gemini API можно подменить
+    локальной заглушкой (бенчмарки, разработка без ключа).
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def generate(self, model: str, prompt: str) -> str:
+        """
+        Возвращает полный ответ модели на промпт.
+        """
+
+    @abstractmethod
+    async def open_stream(self, model: str, prompt: str) -> AsyncIterator[str]:
+        """
+        Открывает потоковую генерацию и возвращает итератор фрагментов текста.
+        """
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Бэкенд поверх официального клиента google-genai (асинхронный API).
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key: str = "", client=None):
+        if client is None:
+            from google import genai
+
+            client = genai.Client(api_key=api_key)
+        self.client = client
+
+    async def generate(self, model: str, prompt: str) -> str:
+        response = await self.client.aio.models.generate_content(
+            model=model,
+            contents=[prompt],
+        )
+        return response.text
+
+    async def open_stream(self, model: str, prompt: str) -> AsyncIterator[str]:
+        stream = await self.client.aio.models.generate_content_stream(
+            model=model,
+            contents=[prompt],
+        )
+        return self._texts(stream)
+
+    @staticmethod
+    async def _texts(stream) -> AsyncIterator[str]:
+        async for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeBackend(LLMBackend):
+    """
+    Детерминированная локальная заглушка модели без сети.
+
+    - ответ зависит только от промпта (одинаковый промпт — одинаковый текст);
+    - `latency` — задержка до первого токена, `tokens_per_second` —
+      скорость генерации, так что время ответа похоже на настоящее;
+    - `error_rate` — доля запросов, которые падают с 503 (ServerError),
+      чтобы проверять повторы и деградацию; последовательность ошибок
+      задаётся `seed` и воспроизводима.
+    """
+
+    name = "fake"
+
+    WORDS = (
+        "книга", "глава", "процесс", "память", "система", "пример", "данные",
+        "ответ", "вопрос", "текст", "раздел", "идея", "вывод", "модель",
+    )
+
+    def __init__(
+        self,
+        latency: float = 0.2,
+        tokens_per_second: float = 200.0,
+        response_tokens: int = 64,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    def _tokens(self, prompt: str) -> list:
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        rnd = random.Random(digest)
+        return [rnd.choice(self.WORDS) for _ in range(self.response_tokens)]
+
+    async def _maybe_fail(self) -> None:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            from google.genai.errors import ServerError
+
+            raise ServerError(
+                503, {"error": {"code": 503, "message": "fake backend overloaded"}}
+            )
+
+    def _token_delay(self, n_tokens: int) -> float:
+        if self.tokens_per_second <= 0:
+            return 0.0
+        return n_tokens / self.tokens_per_second
+
+    async def generate(self, model: str, prompt: str) -> str:
+        await self._maybe_fail()
+        tokens = self._tokens(prompt)
+        await asyncio.sleep(self._token_delay(len(tokens)))
+        return " ".join(tokens)
+
+    async def open_stream(self, model: str, prompt: str) -> AsyncIterator[str]:
+        await self._maybe_fail()
+        return self._stream(self._tokens(prompt))
+
+    async def _stream(self, tokens: list) -> AsyncIterator[str]:
+        # Отдаём по 8 токенов, как это примерно делает настоящий API
+        for i in range(0, len(tokens), 8):
+            part = tokens[i : i + 8]
+            await asyncio.sleep(self._token_delay(len(part)))
+            yield (" " if i else "") + " ".join(part)
+
+
+def get_llm_backend(name: Optional[str] = None, api_key: str = "") -> LLMBackend:
+    """
+    Создаёт бэкенд модели по имени: gemini или fake
+    (по умолчанию settings.LLM_BACKEND).
+    """
+    name = name or settings.LLM_BACKEND
+    if name == GeminiBackend.name:
+        return GeminiBackend(api_key=api_key)
+    if name == FakeBackend.name:
+        return FakeBackend(
+            latency=settings.FAKE_LLM_LATENCY,
+            tokens_per_second=settings.FAKE_LLM_TOKENS_PER_SECOND,
+            response_tokens=settings.FAKE_LLM_RESPONSE_TOKENS,
+            error_rate=settings.FAKE_LLM_ERROR_RATE,
+            seed=settings.FAKE_LLM_SEED,
+        )
+    raise ValueError(f"Неизвестный бэкенд модели: {name}")
@@ -1,5 +1,7 @@
+import os
 from functools import lru_cache
 from pathlib import Path
+from typing import Dict
 from pydantic.v1.typing import StrPath
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -17,6 +19,61 @@ class Settings(BaseSettings):
     )
     RAG_CORPUS_ID: str = ""  # ID корпуса для RAG (опционально)
     RAG_ENABLED: bool = False  # Включить/выключить RAG
+    RAG_CHUNK_SIZE: int = 1200  # Размер чанка в символах
+    RAG_CHUNK_OVERLAP: int = 200  # Перекрытие соседних чанков в символах
+    RAG_RETRIEVAL_MODE: str = "bm25"  # Режим поиска: bm25, dense, hybrid или fts
+    RAG_MAX_RESULTS: int = 50  # Максимум чанков в ответе поиска (max_results запроса)
+    RAG_FTS_ENABLED: bool = False  # Индексировать чанки в SQLite FTS5 (включён и при RAG_RETRIEVAL_MODE=fts)
+    RAG_FTS_DB: str = ""  # База FTS5-индекса (пусто — UPLOAD_DIR/fts.sqlite3)
+    RAG_MULTI_MAX_CORPORA: int = 20  # Максимум корпусов в одном /api/rag/query/multi
+    RAG_MULTI_DEADLINE: float = 0.0  # Дедлайн поиска по всем корпусам, секунд (0 — без дедлайна)
+    RAG_COMPACTION_TOMBSTONE_RATIO: float = 0.2  # Доля удалённых чанков, после которой индекс уплотняется
+    RAG_COMPACTION_MAX_SEGMENTS: int = 8  # Сколько файлов можно дописать к базе индекса до уплотнения
+    RAG_EMBEDDER: str = "hashing"  # Локальный эмбеддер для плотного индекса
+    RAG_EMBEDDING_DIM: int = 1024  # Размерность векторов плотного индекса
+    RAG_CONTEXT_TOKEN_BUDGET: int = 8000  # Бюджет токенов RAG-промпта по умолчанию
+    RAG_CONTEXT_MODEL_BUDGETS: Dict[str, int] = {}  # Бюджеты для отдельных моделей
+    RAG_NEAR_DUPLICATE_THRESHOLD: float = 0.8  # Доля общих шинглов, при которой чанк — дубликат
+    RAG_BATCH_MAX_QUERIES: int = 50  # Максимум вопросов в /api/rag/query/batch
+    RAG_BATCH_CONCURRENCY: int = 4  # Одновременных запросов к модели из одного пакета
+    RAG_BATCH_GROUP_SIZE: int = 5  # Максимум вопросов с общим контекстом в одном запросе
+    RAG_BATCH_GROUP_OVERLAP: float = 0.5  # Доля общих чанков, при которой вопросы объединяются
+    CORPUS_CATALOG_DB: str = ""  # SQLite-каталог корпусов и файлов (пусто — UPLOAD_DIR/catalog.sqlite3)
+    BLOCKING_WORKERS: int = 4  # Потоки для парсинга и файловых операций вне event loop
+    # Процессы для параллельного извлечения PDF (1 — без пула)
+    PDF_EXTRACTION_WORKERS: int = min(4, os.cpu_count() or 1)
+    PDF_PARALLEL_MIN_PAGES: int = 16  # PDF короче этого читаются последовательно
+    EXTRACTION_WINDOW_PAGES: int = 64  # Сколько страниц PDF извлекается впрок при загрузке
+    RAG_INGEST_BATCH: int = 256  # Чанков за раз при векторизации и записи в индексы
+    MAX_UPLOAD_SIZE: int = 100 * 1024 * 1024  # Максимальный размер одного файла, байт
+    MAX_UPLOAD_REQUEST_SIZE: int = 500 * 1024 * 1024  # Максимальный размер запроса загрузки
+    INGESTION_WORKERS: int = 2  # Воркеры фоновой загрузки файлов в корпуса
+    INGESTION_MAX_JOBS: int = 1000  # Сколько задач загрузки хранить для просмотра статуса
+    LLM_BACKEND: str = "gemini"  # Бэкенд модели: gemini или fake (локальная заглушка)
+    FAKE_LLM_LATENCY: float = 0.2  # Заглушка: задержка до первого токена, секунд
+    FAKE_LLM_TOKENS_PER_SECOND: float = 200.0  # Заглушка: скорость генерации
+    FAKE_LLM_RESPONSE_TOKENS: int = 64  # Заглушка: длина ответа в токенах
+    FAKE_LLM_ERROR_RATE: float = 0.0  # Заглушка: доля ответов с ошибкой 503
+    FAKE_LLM_SEED: int = 0  # Заглушка: seed последовательности ошибок
+    GEMINI_MAX_IN_FLIGHT: int = 8  # Одновременных запросов к Gemini
+    GEMINI_MAX_QUEUE: int = 64  # Ожидающих в очереди; сверх этого — 429
+    GEMINI_MAX_RETRIES: int = 3  # Повторов при 429/5xx и сетевых ошибках
+    GEMINI_RETRY_BASE_DELAY: float = 0.5  # Базовая задержка повтора, секунд
+    GEMINI_RETRY_MAX_DELAY: float = 8.0  # Максимальная задержка повтора, секунд
+    GEMINI_REQUEST_TIMEOUT: float = 60.0  # Дедлайн запроса с учётом очереди и повторов
+    ANSWER_CACHE_ENABLED: bool = True  # Кэшировать готовые ответы модели
+    ANSWER_CACHE_MAX_ENTRIES: int = 1024  # Максимум ответов в памяти
+    ANSWER_CACHE_MAX_BYTES: int = 32 * 1024 * 1024  # Максимальный размер кэша в памяти
+    ANSWER_CACHE_TTL: int = 24 * 3600  # Время жизни ответа в кэше, секунд
+    ANSWER_CACHE_DB: str = ""  # Путь к SQLite для персистентного кэша (пусто — только память)
+    CHAT_SESSIONS_DB: str = ""  # SQLite с сессиями чата (пусто — UPLOAD_DIR/chat_sessions.sqlite3)
+    CHAT_HISTORY_TOKEN_BUDGET: int = 2000  # Бюджет токенов истории разговора в промпте
+    CHAT_SUMMARY_TOKEN_BUDGET: int = 300  # Максимальная длина сводки ранних сообщений
+    LOG_LEVEL: str = "INFO"  # Уровень структурированного лога
+    TRACE_LOG_ENABLED: bool = True  # Писать трассировку каждого запроса в лог
+    PROFILE_HEADER_ENABLED: bool = False  # Разрешить профилирование запроса заголовком X-Profile: 1
+    PROFILE_SAMPLE_RATE: float = 0.0  # Доля запросов, профилируемых автоматически
+    PROFILE_DIR: Path = Path("profiles")  # Куда сохранять профили запросов (.prof)
 
     model_config = SettingsConfigDict(
         env_file=".env.example",
@@ -30,5 +87,3 @@ def get_settings():
 
 
 settings = get_settings()
-
-print(settings.GEMINI_API_KEY)
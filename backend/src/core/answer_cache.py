@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from config import settings
+from core.metrics import ANSWER_CACHE_REQUESTS
+
+
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Приводит вопрос к канонической форме: регистр, пробелы
+    и завершающие знаки препинания не влияют на ключ кэша.
+    """
+    return _SPACES_RE.sub(" ", query).strip().rstrip("?!.… ").casefold()
+
+
+def make_cache_key(
+    query: str,
+    corpus_version: str,
+    model_name: str,
+    system_prompt: Optional[str],
+    **params: Any,
+) -> str:
+    """
+    Ключ ответа: (нормализованный вопрос, версия содержимого корпуса,
+    модель, хэш системного промпта) плюс параметры поиска.
+    """
+    prompt_hash = hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest()
+    payload = json.dumps(
+        [normalize_query(query), corpus_version, model_name, prompt_hash, params],
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(message: str) -> bool:
+    """
+    Сообщения об ошибках (начинаются с ❌) не кэшируются.
+    """
+    return bool(message) and not message.startswith("❌")
+
+
+class AnswerCache:
+    """
+    Кэш готовых ответов модели.
+
+    Два уровня:
+    - LRU в памяти, ограниченный числом записей и суммарным размером;
+    - необязательный персистентный уровень в SQLite (aiosqlite),
+      который переживает перезапуск сервера.
+
+    У каждой записи есть TTL. Записи помечены корпусом, чтобы их можно
+    было сбросить при изменении корпуса; кроме того, версия содержимого
+    корпуса входит в ключ, так что устаревший ответ не найдётся никогда.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl: float = 3600,
+        db_path: Optional[Path] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.db_path = db_path
+        # key -> (corpus_id, value, expires_at, size)
+        self._entries: "OrderedDict[str, Tuple[str, dict, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._db = None
+        self._db_lock = asyncio.Lock()
+        self.stats: Dict[str, int] = {
+            "hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    async def _get_db(self):
+        """
+        Лениво открывает SQLite-уровень (если он настроен).
+        """
+        if self.db_path is None:
+            return None
+        if self._db is None:
+            async with self._db_lock:
+                if self._db is None:
+                    import aiosqlite
+
+                    self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                    db = await aiosqlite.connect(self.db_path)
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    await db.execute(
+                        """
+                        CREATE TABLE IF NOT EXISTS answers (
+                            key TEXT PRIMARY KEY,
+                            corpus_id TEXT NOT NULL,
+                            value TEXT NOT NULL,
+                            expires_at REAL NOT NULL
+                        )
+                        """
+                    )
+                    await db.execute(
+                        "CREATE INDEX IF NOT EXISTS answers_corpus ON answers (corpus_id)"
+                    )
+                    await db.execute(
+                        "CREATE INDEX IF NOT EXISTS answers_expires ON answers (expires_at)"
+                    )
+                    await db.execute(
+                        "DELETE FROM answers WHERE expires_at < ?", (time.time(),)
+                    )
+                    await db.commit()
+                    self._db = db
+        return self._db
+
+    def _remember(self, key: str, corpus_id: str, value: dict, expires_at: float) -> None:
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        self._forget(key)
+        self._entries[key] = (corpus_id, value, expires_at, size)
+        self._bytes += size
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._entries))
+            self._forget(oldest)
+            self.stats["evictions"] += 1
+
+    def _forget(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[3]
+
+    async def get(self, key: str) -> Optional[dict]:
+        """
+        Возвращает закэшированный ответ или None.
+        """
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[2] > now:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                ANSWER_CACHE_REQUESTS.inc(1, "hit")
+                return entry[1]
+            self._forget(key)
+            self.stats["expirations"] += 1
+
+        db = await self._get_db()
+        if db is not None:
+            async with db.execute(
+                "SELECT corpus_id, value, expires_at FROM answers WHERE key = ?", (key,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is not None and row[2] > now:
+                value = json.loads(row[1])
+                self._remember(key, row[0], value, row[2])
+                self.stats["db_hits"] += 1
+                ANSWER_CACHE_REQUESTS.inc(1, "db_hit")
+                return value
+
+        self.stats["misses"] += 1
+        ANSWER_CACHE_REQUESTS.inc(1, "miss")
+        return None
+
+    async def set(self, key: str, value: dict, corpus_id: str = "") -> None:
+        """
+        Сохраняет ответ в оба уровня кэша.
+        """
+        expires_at = time.time() + self.ttl
+        self._remember(key, corpus_id, value, expires_at)
+        self.stats["stores"] += 1
+
+        db = await self._get_db()
+        if db is not None:
+            await db.execute(
+                "INSERT OR REPLACE INTO answers (key, corpus_id, value, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, corpus_id, json.dumps(value, ensure_ascii=False), expires_at),
+            )
+            await db.commit()
+
+    async def invalidate_corpus(self, corpus_id: str) -> None:
+        """
+        Удаляет все ответы по корпусу (вызывается при изменении его файлов).
+        """
+        keys = [k for k, e in self._entries.items() if e[0] == corpus_id]
+        for key in keys:
+            self._forget(key)
+        removed = len(keys)
+
+        db = await self._get_db()
+        if db is not None:
+            cursor = await db.execute(
+                "DELETE FROM answers WHERE corpus_id = ?", (corpus_id,)
+            )
+            # В SQLite лежат все записи, включая те, что были в памяти
+            removed = max(removed, cursor.rowcount)
+            await db.commit()
+        self.stats["invalidations"] += removed
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        db = await self._get_db()
+        if db is not None:
+            await db.execute("DELETE FROM answers")
+            await db.commit()
+
+    def get_stats(self) -> dict:
+        """
+        Счётчики попаданий и промахов и текущий размер кэша в памяти.
+        """
+        lookups = self.stats["hits"] + self.stats["db_hits"] + self.stats["misses"]
+        hits = self.stats["hits"] + self.stats["db_hits"]
+        return {
+            **self.stats,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "persistent": self.db_path is not None,
+        }
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+@lru_cache()
+def get_answer_cache() -> AnswerCache:
+    """
+    Фабричная функция для общего кэша ответов.
+    Использует lru_cache для singleton паттерна.
+    """
+    return AnswerCache(
+        max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+        max_bytes=settings.ANSWER_CACHE_MAX_BYTES,
+        ttl=settings.ANSWER_CACHE_TTL,
+        db_path=Path(settings.ANSWER_CACHE_DB) if settings.ANSWER_CACHE_DB else None,
+    )
+
+
+answer_cache = get_answer_cache()
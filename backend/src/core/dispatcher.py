@@ -0,0 +1,315 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+from config import settings
+from core.metrics import (
+    LLM_IN_FLIGHT,
+    LLM_QUEUE_DEPTH,
+    LLM_QUEUE_WAIT_SECONDS,
+    LLM_REQUEST_SECONDS,
+    LLM_SHED,
+)
+from core.tracing import log_event, record_span, span
+
+
+T = TypeVar("T")
+
+# Приоритеты: меньше — раньше. Интерактивный чат обгоняет фоновые задачи
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 5
+PRIORITY_BACKGROUND = 10
+
+# Коды ответа API, после которых имеет смысл повторить запрос
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class DispatcherError(RuntimeError):
+    """Запрос к модели не выполнен из-за ограничений диспетчера."""
+
+
+class OverloadedError(DispatcherError):
+    """Очередь запросов к модели переполнена — запрос отклонён (HTTP 429)."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(DispatcherError):
+    """Запрос не уложился в отведённое время (HTTP 504)."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Повторяем перегрузку и ошибки сервера API, а также сетевые сбои.
+    """
+    from google.genai.errors import APIError
+
+    if isinstance(error, APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    import httpx
+
+    return isinstance(error, (httpx.TransportError, ConnectionError))
+
+
+class GeminiDispatcher:
+    """
+    Общий диспетчер запросов к Gemini для GeminiClient и GeminiRagClient.
+
+    - не больше `max_in_flight` одновременных запросов;
+    - ожидающие стоят в ограниченной очереди с приоритетами;
+    - если очередь заполнена, новый запрос сразу отклоняется OverloadedError,
+      вместо того чтобы копить задержку у всех остальных;
+    - у каждого запроса есть общий дедлайн на ожидание и все попытки;
+    - повторяемые ошибки повторяются с экспоненциальной задержкой и джиттером.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 8,
+        max_queue: int = 64,
+        max_retries: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        timeout: float = 60.0,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self._in_flight = 0
+        # (приоритет, порядковый номер, future ожидающего)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self.stats = {
+            "completed": 0,
+            "failed": 0,
+            "retries": 0,
+            "shed": 0,
+            "deadline_exceeded": 0,
+        }
+
+    def _queued(self) -> int:
+        return sum(1 for _, _, f in self._waiters if not f.done())
+
+    async def _acquire(self, priority: int, deadline: float) -> None:
+        loop = asyncio.get_running_loop()
+        if self._in_flight < self.max_in_flight and not self._queued():
+            self._in_flight += 1
+            LLM_QUEUE_WAIT_SECONDS.observe(0.0)
+            return
+        if self._queued() >= self.max_queue:
+            self.stats["shed"] += 1
+            LLM_SHED.inc()
+            raise OverloadedError("Слишком много запросов к модели, попробуйте позже")
+
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, max(deadline - loop.time(), 0))
+            LLM_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - started)
+            record_span("queue", started, priority=priority)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                self._release()
+            self.stats["deadline_exceeded"] += 1
+            raise DeadlineExceededError("Истекло время ожидания очереди к модели")
+        except asyncio.CancelledError:
+            # Слот мог быть выдан в момент отмены — возвращаем его
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        # Слот передаётся первому живому ожидающему, счётчик не меняется
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(
+        self, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None
+    ) -> AsyncIterator[None]:
+        """
+        Занимает место среди выполняющихся запросов на время блока.
+        """
+        loop = asyncio.get_running_loop()
+        if deadline is None:
+            deadline = loop.time() + self.timeout
+        await self._acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _backoff(self, attempt: int) -> float:
+        # «Full jitter»: случайная задержка до экспоненциальной границы
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def run(
+        self,
+        func: Callable[[], Awaitable[T]],
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout: Optional[float] = None,
+    ) -> T:
+        """
+        Выполняет запрос к модели через очередь с повторами.
+
+        Args:
+            func: Фабрика корутины запроса (вызывается заново на каждую попытку)
+            priority: Приоритет в очереди (PRIORITY_*)
+            timeout: Дедлайн на весь запрос, секунд; по умолчанию self.timeout
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            try:
+                with span("llm", attempt=attempt):
+                    async with self.slot(priority, deadline):
+                        started = time.perf_counter()
+                        try:
+                            result = await asyncio.wait_for(
+                                func(), max(deadline - loop.time(), 0)
+                            )
+                        except asyncio.TimeoutError:
+                            LLM_REQUEST_SECONDS.observe(
+                                time.perf_counter() - started, "generate", "timeout"
+                            )
+                            raise
+                        except Exception:
+                            LLM_REQUEST_SECONDS.observe(
+                                time.perf_counter() - started, "generate", "error"
+                            )
+                            raise
+                        LLM_REQUEST_SECONDS.observe(
+                            time.perf_counter() - started, "generate", "ok"
+                        )
+            except asyncio.TimeoutError:
+                self.stats["deadline_exceeded"] += 1
+                raise DeadlineExceededError("Модель не ответила вовремя")
+            except DispatcherError:
+                raise
+            except Exception as e:
+                delay = self._backoff(attempt)
+                if (
+                    attempt >= self.max_retries
+                    or not is_retryable(e)
+                    or loop.time() + delay >= deadline
+                ):
+                    self.stats["failed"] += 1
+                    raise
+                attempt += 1
+                self.stats["retries"] += 1
+                log_event(
+                    "Повтор запроса к модели",
+                    logging.WARNING,
+                    attempt=attempt,
+                    delay=round(delay, 3),
+                    error=str(e),
+                )
+                await asyncio.sleep(delay)
+                continue
+            self.stats["completed"] += 1
+            return result
+
+    async def stream(
+        self,
+        func: Callable[[], Awaitable[AsyncIterator[T]]],
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[T]:
+        """
+        Потоковый запрос: слот занят, пока поток не закончится.
+        Повторяется только открытие потока — после первого фрагмента
+        ответ уже ушёл клиенту.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        async with self.slot(priority, deadline):
+            attempt = 0
+            while True:
+                started = time.perf_counter()
+                try:
+                    stream = await asyncio.wait_for(
+                        func(), max(deadline - loop.time(), 0)
+                    )
+                    record_span("llm", started, attempt=attempt, stream=True)
+                    break
+                except asyncio.TimeoutError:
+                    LLM_REQUEST_SECONDS.observe(
+                        time.perf_counter() - started, "stream", "timeout"
+                    )
+                    self.stats["deadline_exceeded"] += 1
+                    raise DeadlineExceededError("Модель не ответила вовремя")
+                except Exception as e:
+                    LLM_REQUEST_SECONDS.observe(
+                        time.perf_counter() - started, "stream", "error"
+                    )
+                    delay = self._backoff(attempt)
+                    if (
+                        attempt >= self.max_retries
+                        or not is_retryable(e)
+                        or loop.time() + delay >= deadline
+                    ):
+                        self.stats["failed"] += 1
+                        raise
+                    attempt += 1
+                    self.stats["retries"] += 1
+                    log_event(
+                        "Повтор потокового запроса к модели",
+                        logging.WARNING,
+                        attempt=attempt,
+                        delay=round(delay, 3),
+                        error=str(e),
+                    )
+                    await asyncio.sleep(delay)
+            async for item in stream:
+                yield item
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, "stream", "ok")
+            self.stats["completed"] += 1
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "in_flight": self._in_flight,
+            "queued": self._queued(),
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+        }
+
+
+@lru_cache()
+def get_gemini_dispatcher() -> GeminiDispatcher:
+    """
+    Фабричная функция для общего диспетчера запросов к Gemini.
+    Использует lru_cache для singleton паттерна.
+    """
+    dispatcher = GeminiDispatcher(
+        max_in_flight=settings.GEMINI_MAX_IN_FLIGHT,
+        max_queue=settings.GEMINI_MAX_QUEUE,
+        max_retries=settings.GEMINI_MAX_RETRIES,
+        base_delay=settings.GEMINI_RETRY_BASE_DELAY,
+        max_delay=settings.GEMINI_RETRY_MAX_DELAY,
+        timeout=settings.GEMINI_REQUEST_TIMEOUT,
+    )
+    # Глубина очереди считается в момент отдачи /metrics
+    LLM_QUEUE_DEPTH.set_function(dispatcher._queued)
+    LLM_IN_FLIGHT.set_function(lambda: dispatcher._in_flight)
+    return dispatcher
+
+
+gemini_dispatcher = get_gemini_dispatcher()
@@ -0,0 +1,77 @@
+import asyncio
+import contextvars
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, TypeVar
+
+from config import settings
+
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Общий ограниченный пул потоков для блокирующей работы
+    (парсинг PDF/DOCX, индексация, файловые операции).
+    Создаётся лениво при первом обращении.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.BLOCKING_WORKERS,
+                    thread_name_prefix="blocking",
+                )
+    return _executor
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Общий пул процессов для CPU-bound работы на чистом Python
+    (постраничный парсинг PDF). Процессы запускаются через spawn,
+    чтобы не копировать потоки и состояние event loop через fork.
+    """
+    global _process_pool
+    if _process_pool is None or _process_pool._broken:
+        with _executor_lock:
+            # Если процесс пула упал, пул непригоден — создаём новый
+            if _process_pool is None or _process_pool._broken:
+                _process_pool = ProcessPoolExecutor(
+                    max_workers=settings.PDF_EXTRACTION_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _process_pool
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Выполняет блокирующую функцию в пуле, не останавливая event loop.
+    Контекст (трассировка запроса) переносится в поток, как в asyncio.to_thread.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_executor(), partial(context.run, func, *args, **kwargs)
+    )
+
+
+def shutdown_executor() -> None:
+    """
+    Останавливает пулы (вызывается при завершении приложения).
+    """
+    global _executor, _process_pool
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
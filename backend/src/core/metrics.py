@@ -0,0 +1,285 @@
+import bisect
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# Границы по умолчанию для длительностей, секунд
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric(ABC):
+    """
+    Базовая метрика в формате Prometheus.
+
+    Запись — это поиск в словаре по кортежу значений меток и сложение
+    под коротким локом, поэтому метрики можно писать и из event loop,
+    и из пула потоков без заметных накладных расходов.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """
+        Строки сэмплов метрики для /metrics (без HELP и TYPE).
+        """
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        # Счётчик без меток виден в /metrics сразу, с нулём
+        self._values: Dict[Tuple[str, ...], float] = {} if labels else {(): 0}
+
+    def inc(self, amount: float = 1, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}"
+            for k, v in items
+        ]
+
+
+class Gauge(Metric):
+    """
+    Текущее значение. Можно задать функцию, которая вызывается при
+    отдаче /metrics (например, длина очереди), — тогда на горячем пути
+    ничего не пишется вовсе.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+    def set_function(self, func: Callable[[], float], *label_values: str) -> None:
+        with self._lock:
+            self._functions[label_values] = func
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for key, func in functions:
+            try:
+                values[key] = func()
+            except Exception:
+                continue
+        return [
+            f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}"
+            for k, v in values.items()
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам..., +Inf, сумма]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(label_values)
+            if row is None:
+                row = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            row[index] += 1
+            row[-1] += value
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        """
+        Замеряет длительность блока (даже если он завершился исключением).
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), row[:-1]):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(row[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def counter(name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, labels))
+
+
+def gauge(name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+    return registry.register(Gauge(name, documentation, labels))
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labels: Sequence[str] = (),
+    buckets: Optional[Sequence[float]] = None,
+) -> Histogram:
+    return registry.register(
+        Histogram(name, documentation, labels, buckets or DEFAULT_BUCKETS)
+    )
+
+
+# --- Метрики конвейера ---------------------------------------------------
+
+EXTRACTION_SECONDS = histogram(
+    "kasa_extraction_seconds",
+    "Время извлечения текста из файла",
+    ["file_type"],
+)
+EXTRACTED_CHARS = counter(
+    "kasa_extracted_chars_total",
+    "Извлечено символов текста",
+    ["file_type"],
+)
+INDEX_BUILD_SECONDS = histogram(
+    "kasa_index_build_seconds",
+    "Время сборки BM25 и векторного индексов корпуса",
+)
+RETRIEVAL_SECONDS = histogram(
+    "kasa_retrieval_seconds",
+    "Время поиска чанков в корпусе",
+    ["mode"],
+)
+PROMPT_BUILD_SECONDS = histogram(
+    "kasa_prompt_build_seconds",
+    "Время сборки контекста RAG-промпта в бюджете токенов",
+)
+PROMPT_TOKENS = histogram(
+    "kasa_prompt_tokens",
+    "Оценка числа токенов RAG-промпта",
+    buckets=TOKEN_BUCKETS,
+)
+LLM_REQUEST_SECONDS = histogram(
+    "kasa_llm_request_seconds",
+    "Длительность одной попытки запроса к модели",
+    ["kind", "outcome"],
+)
+LLM_QUEUE_WAIT_SECONDS = histogram(
+    "kasa_llm_queue_wait_seconds",
+    "Ожидание свободного слота в диспетчере запросов к модели",
+)
+LLM_QUEUE_DEPTH = gauge(
+    "kasa_llm_queue_depth",
+    "Запросов к модели в очереди диспетчера",
+)
+LLM_IN_FLIGHT = gauge(
+    "kasa_llm_in_flight",
+    "Выполняющихся запросов к модели",
+)
+LLM_SHED = counter(
+    "kasa_llm_shed_total",
+    "Запросов к модели, отклонённых из-за переполнения очереди",
+)
+ANSWER_CACHE_REQUESTS = counter(
+    "kasa_answer_cache_requests_total",
+    "Обращения к кэшу ответов по результату",
+    ["result"],
+)
+CHAT_SECONDS = histogram(
+    "kasa_chat_seconds",
+    "Полное время ответа чата",
+    ["mode"],
+)
+UPLOAD_BYTES = counter(
+    "kasa_upload_bytes_total",
+    "Принято байт в загрузках файлов",
+)
+UPLOAD_FILES = counter(
+    "kasa_upload_files_total",
+    "Принято файлов",
+)
+INGESTION_QUEUE_DEPTH = gauge(
+    "kasa_ingestion_queue_depth",
+    "Файлов в очереди фоновой загрузки в корпуса",
+)
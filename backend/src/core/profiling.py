@@ -0,0 +1,87 @@
+import cProfile
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Mapping, Optional
+
+from config import settings
+
+
+PROFILE_HEADER = "x-profile"
+
+# cProfile нельзя запускать дважды одновременно — профилируем по одному запросу
+_profile_lock = threading.Lock()
+
+
+def should_profile(headers: Mapping[str, str]) -> bool:
+    """
+    Нужно ли профилировать запрос: по заголовку `X-Profile: 1`
+    (если он разрешён настройкой) или случайной выборкой PROFILE_SAMPLE_RATE.
+    """
+    if settings.PROFILE_HEADER_ENABLED and headers.get(PROFILE_HEADER) == "1":
+        return True
+    rate = settings.PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+class RequestProfiler:
+    """
+    Профиль cProfile одного запроса, сохраняемый в PROFILE_DIR как
+    `<время>-<trace_id>.prof` (смотреть через snakeviz или pstats).
+
+    cProfile видит только поток event loop: работа в пуле потоков
+    (парсинг, индексация) попадает в профиль как ожидание run_blocking,
+    её длительность видна в интервалах трассировки. Пока идёт профиль,
+    в него попадают и корутины других запросов — это цена профилирования
+    на живом сервере.
+    """
+
+    def __init__(self, trace_id: str, directory: Optional[Path] = None):
+        directory = directory or settings.PROFILE_DIR
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.path = Path(directory) / f"{stamp}-{trace_id}.prof"
+        self._profile: Optional[cProfile.Profile] = None
+        self._stopped: Optional[cProfile.Profile] = None
+
+    @classmethod
+    def start_for(cls, trace_id: str) -> Optional["RequestProfiler"]:
+        """
+        Запускает профиль, если сейчас не профилируется другой запрос.
+        """
+        if not _profile_lock.acquire(blocking=False):
+            return None
+        profiler = cls(trace_id)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Уже работает другой профилировщик (например, запуск под cProfile)
+            _profile_lock.release()
+            return None
+        profiler._profile = profile
+        return profiler
+
+    def stop(self) -> None:
+        """
+        Останавливает профиль (в потоке event loop, где он был запущен).
+        """
+        if self._profile is None:
+            return
+        profile, self._profile = self._profile, None
+        try:
+            profile.disable()
+        finally:
+            _profile_lock.release()
+        self._stopped = profile
+
+    def save(self) -> Optional[Path]:
+        """
+        Сохраняет остановленный профиль на диск (блокирующая операция).
+        """
+        if self._stopped is None:
+            return None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._stopped.dump_stats(str(self.path))
+        self._stopped = None
+        return self.path
@@ -0,0 +1,241 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from config import settings
+
+
+class SessionNotFoundError(KeyError):
+    """Сессии чата с таким ID нет (HTTP 404)."""
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+SESSION_COLUMNS = (
+    "id, corpus_id, summary, summary_tokens, summarized_upto, created_at, updated_at"
+)
+MESSAGE_COLUMNS = "id, role, content, tokens, created_at"
+
+
+def _session_row(row) -> dict:
+    return dict(
+        zip(
+            (
+                "session_id",
+                "corpus_id",
+                "summary",
+                "summary_tokens",
+                "summarized_upto",
+                "created_at",
+                "updated_at",
+            ),
+            row,
+        )
+    )
+
+
+def _message_row(row) -> dict:
+    return dict(zip(("id", "role", "content", "tokens", "created_at"), row))
+
+
+class SessionStore:
+    """
+    Хранилище сессий чата в SQLite (aiosqlite).
+
+    - sessions: одна строка на сессию — сводка ранних сообщений и ID
+      последнего сообщения, вошедшего в сводку (summarized_upto);
+    - messages: все сообщения; индекс (session_id, id) делает выборку
+      «хвоста» после сводки и постраничный просмотр истории поиском
+      по диапазону, без сканирования таблицы.
+
+    Хвост после сводки ограничен бюджетом токенов истории (его
+    сворачивает SessionService), поэтому ход разговора читает
+    постоянное число строк, сколько бы сообщений ни было в сессии.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._db = None
+        self._db_lock = asyncio.Lock()
+        # Записи из нескольких запросов не должны перемешиваться в одной транзакции
+        self._write_lock = asyncio.Lock()
+
+    async def _get_db(self):
+        """
+        Лениво открывает базу и создаёт таблицы.
+        """
+        if self._db is None:
+            async with self._db_lock:
+                if self._db is None:
+                    import aiosqlite
+
+                    self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                    db = await aiosqlite.connect(self.db_path)
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    await db.execute("PRAGMA foreign_keys=ON")
+                    await db.executescript(
+                        """
+                        CREATE TABLE IF NOT EXISTS sessions (
+                            id TEXT PRIMARY KEY,
+                            corpus_id TEXT,
+                            summary TEXT NOT NULL DEFAULT '',
+                            summary_tokens INTEGER NOT NULL DEFAULT 0,
+                            summarized_upto INTEGER NOT NULL DEFAULT 0,
+                            created_at TEXT NOT NULL,
+                            updated_at TEXT NOT NULL
+                        );
+                        CREATE TABLE IF NOT EXISTS messages (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            session_id TEXT NOT NULL
+                                REFERENCES sessions (id) ON DELETE CASCADE,
+                            role TEXT NOT NULL,
+                            content TEXT NOT NULL,
+                            tokens INTEGER NOT NULL,
+                            created_at TEXT NOT NULL
+                        );
+                        CREATE INDEX IF NOT EXISTS messages_session
+                            ON messages (session_id, id);
+                        """
+                    )
+                    await db.commit()
+                    self._db = db
+        return self._db
+
+    async def create_session(self, corpus_id: Optional[str] = None) -> dict:
+        db = await self._get_db()
+        now = _now()
+        session_id = uuid.uuid4().hex
+        async with self._write_lock:
+            await db.execute(
+                "INSERT INTO sessions (id, corpus_id, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (session_id, corpus_id, now, now),
+            )
+            await db.commit()
+        return await self.get_session(session_id)
+
+    async def get_session(self, session_id: str) -> dict:
+        """
+        Возвращает сессию по ID или выбрасывает SessionNotFoundError.
+        """
+        db = await self._get_db()
+        async with db.execute(
+            f"SELECT {SESSION_COLUMNS} FROM sessions WHERE id = ?", (session_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            raise SessionNotFoundError(session_id)
+        return _session_row(row)
+
+    async def delete_session(self, session_id: str) -> bool:
+        db = await self._get_db()
+        async with self._write_lock:
+            cursor = await db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            await db.commit()
+        return cursor.rowcount > 0
+
+    async def append_messages(
+        self, session_id: str, messages: List[Tuple[str, str, int]]
+    ) -> None:
+        """
+        Добавляет сообщения (role, content, tokens) одной транзакцией.
+        """
+        db = await self._get_db()
+        now = _now()
+        async with self._write_lock:
+            await db.executemany(
+                "INSERT INTO messages (session_id, role, content, tokens, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(session_id, role, content, tokens, now) for role, content, tokens in messages],
+            )
+            await db.execute(
+                "UPDATE sessions SET updated_at = ? WHERE id = ?", (now, session_id)
+            )
+            await db.commit()
+
+    async def get_messages_after(self, session_id: str, after_id: int) -> List[dict]:
+        """
+        Сообщения сессии с ID больше `after_id` (ещё не вошедшие в сводку).
+        """
+        db = await self._get_db()
+        async with db.execute(
+            f"SELECT {MESSAGE_COLUMNS} FROM messages "
+            "WHERE session_id = ? AND id > ? ORDER BY id",
+            (session_id, after_id),
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return [_message_row(row) for row in rows]
+
+    async def count_tokens_after(self, session_id: str, after_id: int) -> int:
+        db = await self._get_db()
+        async with db.execute(
+            "SELECT COALESCE(SUM(tokens), 0) FROM messages WHERE session_id = ? AND id > ?",
+            (session_id, after_id),
+        ) as cursor:
+            (total,) = await cursor.fetchone()
+        return total
+
+    async def list_messages(
+        self, session_id: str, limit: int = 50, before_id: Optional[int] = None
+    ) -> List[dict]:
+        """
+        Страница истории: до `limit` сообщений перед `before_id`
+        (по умолчанию — самые новые), в хронологическом порядке.
+        """
+        db = await self._get_db()
+        async with db.execute(
+            f"SELECT {MESSAGE_COLUMNS} FROM messages "
+            "WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (session_id, before_id if before_id is not None else 2**63 - 1, limit),
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return [_message_row(row) for row in reversed(rows)]
+
+    async def save_summary(
+        self,
+        session_id: str,
+        summary: str,
+        summary_tokens: int,
+        summarized_upto: int,
+        expected_upto: int,
+    ) -> bool:
+        """
+        Сохраняет новую сводку, только если её никто не обновил с момента
+        чтения (expected_upto) — параллельные сворачивания не затирают друг друга.
+        """
+        db = await self._get_db()
+        async with self._write_lock:
+            cursor = await db.execute(
+                "UPDATE sessions SET summary = ?, summary_tokens = ?, summarized_upto = ? "
+                "WHERE id = ? AND summarized_upto = ?",
+                (summary, summary_tokens, summarized_upto, session_id, expected_upto),
+            )
+            await db.commit()
+        return cursor.rowcount > 0
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+@lru_cache()
+def get_session_store() -> SessionStore:
+    """
+    Фабричная функция для хранилища сессий чата.
+    Использует lru_cache для singleton паттерна.
+    """
+    db_path = (
+        Path(settings.CHAT_SESSIONS_DB)
+        if settings.CHAT_SESSIONS_DB
+        else settings.UPLOAD_DIR / "chat_sessions.sqlite3"
+    )
+    return SessionStore(db_path)
+
+
+session_store = get_session_store()
@@ -0,0 +1,52 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов (single-flight).
+
+    Первый вызов с данным ключом запускает работу отдельной задачей,
+    остальные ждут тот же результат. Работа защищена asyncio.shield:
+    если один из ожидающих отменён (клиент закрыл соединение), общая
+    задача продолжается для остальных.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.stats: Dict[str, int] = {"calls": 0, "executions": 0, "shared": 0}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Выполняет `func()` или присоединяется к уже идущему вызову с тем же ключом.
+
+        Args:
+            key: Ключ запроса; одинаковые ключи объединяются
+            func: Фабрика корутины, которая выполняет работу
+        """
+        self.stats["calls"] += 1
+        task = self._tasks.get(key)
+        if task is None:
+            self.stats["executions"] += 1
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t, key=key: self._done(key, t))
+        else:
+            self.stats["shared"] += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Забираем исключение, чтобы asyncio не ругался, если все ожидающие отменены
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "in_flight": self.in_flight()}
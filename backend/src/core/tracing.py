@@ -0,0 +1,238 @@
+import itertools
+import json
+import logging
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional
+
+from config import settings
+
+
+# Входящий X-Request-ID принимаем, только если он похож на идентификатор
+_TRACE_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("kasa_trace", default=None)
+_current_span: ContextVar[Optional[int]] = ContextVar("kasa_span", default=None)
+
+
+class Span:
+    __slots__ = ("span_id", "parent_id", "name", "start", "end", "attrs")
+
+    def __init__(self, span_id: int, parent_id: Optional[int], name: str, attrs: dict):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+
+class Trace:
+    """
+    Трассировка одного запроса (или одной фоновой задачи): идентификатор
+    и плоский список вложенных интервалов со ссылками на родителя.
+
+    Интервалы могут добавляться из event loop и из пула потоков
+    (run_blocking копирует контекст), поэтому запись идёт под локом.
+    """
+
+    def __init__(self, name: str, trace_id: Optional[str] = None):
+        if not trace_id or not _TRACE_ID_RE.match(trace_id):
+            trace_id = uuid.uuid4().hex[:16]
+        self.trace_id = trace_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.spans: List[Span] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start_span(self, name: str, parent_id: Optional[int], attrs: dict) -> Span:
+        with self._lock:
+            span = Span(next(self._ids), parent_id, name, attrs)
+            self.spans.append(span)
+        return span
+
+    def finish(self) -> None:
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def server_timing(self) -> str:
+        """
+        Значение заголовка Server-Timing: суммарная длительность каждого
+        этапа (повторяющиеся этапы складываются) и общее время.
+        """
+        totals: Dict[str, float] = {}
+        with self._lock:
+            spans = [s for s in self.spans if s.end is not None]
+        for span in spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+        parts.append(f"total;dur={self.duration * 1000:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "duration_ms": round(self.duration * 1000, 3),
+            "spans": [
+                {
+                    "id": s.span_id,
+                    "parent": s.parent_id,
+                    "name": s.name,
+                    "start_ms": round((s.start - self.start) * 1000, 3),
+                    "duration_ms": round(s.duration * 1000, 3),
+                    **({"attrs": s.attrs} if s.attrs else {}),
+                    **({} if s.end is not None else {"unfinished": True}),
+                }
+                for s in spans
+            ],
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+def activate(trace: Optional[Trace]):
+    """
+    Делает трассировку текущей для контекста; возвращает токен для deactivate.
+    """
+    return _current_trace.set(trace), _current_span.set(None)
+
+
+def deactivate(tokens) -> None:
+    trace_token, span_token = tokens
+    _current_span.reset(span_token)
+    _current_trace.reset(trace_token)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Span]]:
+    """
+    Интервал этапа обработки; вложенные интервалы становятся его детьми.
+    Вне трассировки ничего не делает.
+
+    Не оборачивайте им yield в асинхронных генераторах: генератор может
+    продолжиться в другом контексте — для потоков есть record_span.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.start_span(name, _current_span.get(), attrs)
+    token = _current_span.set(current.span_id)
+    try:
+        yield current
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def record_span(name: str, started: float, **attrs) -> None:
+    """
+    Добавляет уже завершившийся интервал (started — time.perf_counter()).
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    current = trace.start_span(name, _current_span.get(), attrs)
+    current.start = started
+    current.end = time.perf_counter()
+
+
+@contextmanager
+def traced(name: str, trace_id: Optional[str] = None, **fields) -> Iterator[Trace]:
+    """
+    Трассировка фоновой задачи вне HTTP-запроса: по завершении
+    интервалы пишутся в структурированный лог.
+    """
+    trace = Trace(name, trace_id)
+    tokens = activate(trace)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+        deactivate(tokens)
+        log_trace(trace, **fields)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна JSON-строка на запись: время, уровень, сообщение, trace_id
+    текущего запроса и произвольные поля из extra={"fields": {...}}.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None) or current_trace_id()
+        if trace_id:
+            payload["trace_id"] = trace_id
+        payload.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            payload["error"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+@lru_cache()
+def get_logger() -> logging.Logger:
+    """
+    Логгер приложения со структурированным (JSON) выводом в stderr.
+    Использует lru_cache для singleton паттерна.
+    """
+    logger = logging.getLogger("kasa")
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+    logger.setLevel(settings.LOG_LEVEL.upper())
+    logger.propagate = False
+    return logger
+
+
+def log_event(message: str, level: int = logging.INFO, **fields) -> None:
+    """
+    Пишет событие в структурированный лог с trace_id текущего запроса.
+    """
+    logger = get_logger()
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"fields": fields})
+
+
+def log_trace(trace: Trace, **fields) -> None:
+    """
+    Пишет трассировку целиком: одна запись на запрос или задачу.
+    """
+    if not settings.TRACE_LOG_ENABLED:
+        return
+    payload = trace.to_dict()
+    payload.update(fields)
+    get_logger().info("trace", extra={"fields": payload, "trace_id": trace.trace_id})
@@ -1,14 +1,21 @@
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Awaitable, Callable, Optional
 from api import router as api_router
+from api.metrics import router as metrics_router
 from config import settings
+from core.dispatcher import DeadlineExceededError, OverloadedError
+from core.executors import run_blocking
+from core.profiling import RequestProfiler, should_profile
+from core.session_store import SessionNotFoundError
+from core.tracing import Trace, activate, deactivate, log_event, log_trace
 from services import chat_service
 from view import router as view_router
 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 import uvicorn
 
 
@@ -31,12 +38,36 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
         import clients.gemini_rag_client as rag_module
 
         rag_module.gemini_rag_client = GeminiRagClient(
-            genai_client=gemini_client_instance.client
+            genai_client=gemini_client_instance.client,
+            backend=gemini_client_instance.backend,
         )
-        print("✅ RAG клиент инициализирован.")
+        log_event("RAG клиент инициализирован")
+
+        from services.ingestion_service import ingestion_service
+
+        ingestion_service.start()
 
     yield
 
+    from core.answer_cache import answer_cache
+    from core.executors import shutdown_executor
+    from core.session_store import session_store
+    from services.ingestion_service import ingestion_service
+    from services.session_service import session_service
+
+    await ingestion_service.stop()
+    if settings.RAG_ENABLED:
+        import clients.gemini_rag_client as rag_module
+
+        if rag_module.gemini_rag_client is not None:
+            rag_module.gemini_rag_client.catalog.close()
+            if rag_module.gemini_rag_client.fts is not None:
+                rag_module.gemini_rag_client.fts.close()
+    await session_service.close()
+    await session_store.close()
+    await answer_cache.close()
+    shutdown_executor()
+
 
 app = FastAPI(debug=True, lifespan=lifespan)
 
@@ -48,10 +79,117 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """
+    Отклоняет слишком большие загрузки по Content-Length ещё до чтения тела.
+    """
+    if request.method == "POST" and request.url.path.startswith("/api/upload_file"):
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > settings.MAX_UPLOAD_REQUEST_SIZE:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": "Слишком большой запрос на загрузку"},
+            )
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Трассировка запроса: trace_id (берётся из X-Request-ID, если он есть)
+    возвращается в X-Request-ID, длительности этапов — в Server-Timing,
+    а все интервалы пишутся одной записью в структурированный лог.
+
+    Для потоковых ответов заголовки уходят до генерации, поэтому
+    Server-Timing содержит этапы до первого байта, а лог пишется
+    после того, как тело ответа отдано целиком.
+    """
+    trace = Trace(f"{request.method} {request.url.path}", request.headers.get("x-request-id"))
+    tokens = activate(trace)
+    profiler = RequestProfiler.start_for(trace.trace_id) if should_profile(request.headers) else None
+    try:
+        response = await call_next(request)
+    except Exception:
+        await _finish_trace(trace, profiler, request, 500)
+        raise
+    finally:
+        deactivate(tokens)
+
+    response.headers["X-Request-ID"] = trace.trace_id
+    response.headers["Server-Timing"] = trace.server_timing()
+    if profiler is not None:
+        response.headers["X-Profile-File"] = profiler.path.name
+
+    return _TracedResponse(
+        response, lambda: _finish_trace(trace, profiler, request, response.status_code)
+    )
+
+
+class _TracedResponse:
+    """
+    ASGI-обёртка ответа: трассировка завершается (и лок профилировщика
+    отпускается) в finally — даже если клиент отключился до того,
+    как началась отдача тела, и body_iterator так и не был прочитан.
+    """
+
+    def __init__(self, response, finish: Callable[[], Awaitable[None]]):
+        self.response = response
+        self.finish = finish
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            await self.finish()
+
+
+async def _finish_trace(
+    trace: Trace, profiler: Optional[RequestProfiler], request: Request, status: int
+) -> None:
+    trace.finish()
+    profile_path = None
+    if profiler is not None:
+        profiler.stop()
+        profile_path = await run_blocking(profiler.save)
+    log_trace(
+        trace,
+        method=request.method,
+        path=request.url.path,
+        status=status,
+        **({"profile": str(profile_path)} if profile_path else {}),
+    )
+
+
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    """
+    Очередь запросов к модели переполнена — сбрасываем нагрузку.
+    """
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
+
+@app.exception_handler(SessionNotFoundError)
+async def session_not_found_handler(request: Request, exc: SessionNotFoundError):
+    return JSONResponse(status_code=404, content={"detail": "Сессия не найдена"})
+
+
+@app.exception_handler(DeadlineExceededError)
+async def deadline_handler(request: Request, exc: DeadlineExceededError):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
 BASE_DIR = Path(__file__).resolve().parent
 
 app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
 app.include_router(api_router, prefix="/api")
+app.include_router(metrics_router)
 app.include_router(view_router, prefix="")
 
 
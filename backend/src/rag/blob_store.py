@@ -0,0 +1,297 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from itertools import batched
+from pathlib import Path
+from typing import Callable, Collection, Dict, Iterable, Iterator, List
+
+import numpy as np
+
+from core.files import fsync_paths, temp_path, link_or_copy, write_text_atomic
+from core.metrics import EXTRACTED_CHARS, EXTRACTION_SECONDS
+from core.tracing import log_event, record_span, span
+from rag.chunking import chunk_records
+from rag.extraction import EXTRACTION_VERSION, TextRecord, iter_records
+from rag.vector_index import Embedder
+
+
+BLOBS_DIR_NAME = "blobs"
+
+# Блоб без ссылок удаляется сборщиком мусора только если он старше этого,
+# чтобы не задеть загрузку, которая ещё не успела увеличить счётчик
+GC_GRACE_SECONDS = 3600
+
+
+class RefsCorruptedError(ValueError):
+    """refs.json повреждён: счётчики ссылок нужно восстановить по каталогу."""
+
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Считает SHA-256 файла потоково, не загружая его целиком в память.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while chunk := fh.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """
+    Контентно-адресуемое хранилище файлов книг.
+
+    Каждое уникальное содержимое хранится один раз под своим SHA-256:
+    - `<root>/<sha[:2]>/<sha>` — сам файл
+    - `<root>/<sha[:2]>/<sha>.<артефакт>` — извлечённый текст, чанки, векторы
+
+    Корпуса ссылаются на блобы по хэшу, `refs.json` хранит счётчики ссылок.
+    Когда счётчик падает до нуля, блоб и все его артефакты удаляются.
+    Источник истины — каталог корпусов: по нему счётчики восстанавливаются
+    (rebuild_refs), если `refs.json` повреждён.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.refs_path = root / "refs.json"
+        self._lock = threading.RLock()
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256
+
+    def artifact_path(self, sha256: str, name: str) -> Path:
+        return self.root / sha256[:2] / f"{sha256}.{name}"
+
+    def put_file(self, path: Path) -> str:
+        """
+        Кладёт файл в хранилище, берёт на блоб ссылку и возвращает его SHA-256.
+        Если такое содержимое уже есть, ничего не копируется.
+
+        Запись блоба и incref — одна критическая секция: иначе между ними
+        decref того же содержимого из другого корпуса мог бы удалить блоб.
+        Ссылку нужно отпустить (decref), если файл в итоге не попал в манифест.
+        """
+        sha256 = file_sha256(path)
+        dst = self.blob_path(sha256)
+        with self._lock:
+            if not dst.exists():
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                link_or_copy(path, dst)
+            self.incref(sha256)
+        return sha256
+
+    def _load_refs(self) -> Dict[str, int]:
+        """
+        Счётчики ссылок; пустые, только если `refs.json` ещё нет.
+        Повреждённый файл — RefsCorruptedError: записать поверх него
+        пустой словарь значило бы потерять счётчики всех блобов.
+        """
+        try:
+            data = self.refs_path.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return {}
+        try:
+            refs = json.loads(data)
+        except ValueError as e:
+            raise RefsCorruptedError(f"Повреждён {self.refs_path}: {e}") from e
+        if not isinstance(refs, dict):
+            raise RefsCorruptedError(f"Повреждён {self.refs_path}: ожидался объект")
+        return refs
+
+    def _save_refs(self, refs: Dict[str, int]) -> None:
+        write_text_atomic(self.refs_path, json.dumps(refs))
+
+    def rebuild_refs(self, counts: Dict[str, int]) -> None:
+        """
+        Заменяет счётчики ссылок посчитанными по каталогу и сбрасывает их на диск.
+        """
+        with self._lock:
+            self._save_refs({sha256: count for sha256, count in counts.items() if count > 0})
+            fsync_paths([self.refs_path])
+
+    def sync(self, sha256s: Iterable[str]) -> None:
+        """
+        Сбрасывает на диск блобы и счётчики ссылок (fsync файлов и каталогов).
+        """
+        with self._lock:
+            fsync_paths([self.blob_path(sha256) for sha256 in sha256s] + [self.refs_path])
+
+    def incref(self, sha256: str) -> int:
+        with self._lock:
+            refs = self._load_refs()
+            refs[sha256] = refs.get(sha256, 0) + 1
+            self._save_refs(refs)
+            return refs[sha256]
+
+    def decref(self, sha256: str) -> int:
+        """
+        Уменьшает счётчик ссылок; на нуле удаляет блоб и его артефакты.
+        """
+        with self._lock:
+            refs = self._load_refs()
+            count = refs.get(sha256, 0) - 1
+            if count > 0:
+                refs[sha256] = count
+            else:
+                refs.pop(sha256, None)
+            self._save_refs(refs)
+            if count <= 0:
+                self._delete(sha256)
+            return max(count, 0)
+
+    def _delete(self, sha256: str) -> None:
+        directory = self.root / sha256[:2]
+        for f in directory.glob(f"{sha256}*"):
+            f.unlink(missing_ok=True)
+        log_event("Блоб удалён из хранилища", blob=sha256[:12])
+
+    def collect_garbage(self, referenced: Collection[str] = ()) -> int:
+        """
+        Удаляет блобы без ссылок (остатки прерванных загрузок).
+
+        Args:
+            referenced: Хэши, на которые ссылается каталог корпусов; они
+                не удаляются, даже если `refs.json` отстал (не был сброшен
+                на диск перед сбоем)
+
+        Returns:
+            int: Количество удалённых блобов
+
+        Raises:
+            RefsCorruptedError: `refs.json` повреждён — ничего не удаляется
+        """
+        removed = 0
+        deadline = time.time() - GC_GRACE_SECONDS
+        with self._lock:
+            refs = self._load_refs()
+            for directory in self.root.iterdir():
+                if not directory.is_dir():
+                    continue
+                for f in directory.iterdir():
+                    sha256 = f.name.split(".", 1)[0]
+                    if "." in f.name or refs.get(sha256, 0) > 0 or sha256 in referenced:
+                        continue
+                    if f.stat().st_ctime > deadline:
+                        continue
+                    self._delete(sha256)
+                    removed += 1
+        return removed
+
+    @staticmethod
+    def _cached_stream(path: Path, produce: Callable[[], Iterator]) -> Iterator:
+        """
+        Отдаёт элементы из JSONL-кэша `path`, а если его нет — из `produce()`,
+        по ходу записывая их во временный файл. Кэшем он становится,
+        только если поток дочитан до конца.
+        """
+        try:
+            fh = open(path, encoding="utf-8")
+        except FileNotFoundError:
+            pass
+        else:
+            with fh:
+                for line in fh:
+                    yield json.loads(line)
+            return
+        tmp = temp_path(path)
+        try:
+            with open(tmp, "w", encoding="utf-8") as out:
+                for item in produce():
+                    out.write(json.dumps(item, ensure_ascii=False) + "\n")
+                    yield item
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def _extract(self, sha256: str, suffix: str) -> Iterator[TextRecord]:
+        file_type = suffix.lstrip(".") or "none"
+        records = iter_records(self.blob_path(sha256), suffix=suffix)
+        # Считаем только время извлечения, без обработки записей потребителем
+        elapsed, chars = 0.0, 0
+        while True:
+            started = time.perf_counter()
+            record = next(records, None)
+            elapsed += time.perf_counter() - started
+            if record is None:
+                break
+            chars += len(record.text)
+            yield record
+        record_span("extract", time.perf_counter() - elapsed, file_type=file_type)
+        EXTRACTION_SECONDS.observe(elapsed, file_type)
+        EXTRACTED_CHARS.inc(chars, file_type)
+
+    def iter_records(self, sha256: str, suffix: str) -> Iterator[TextRecord]:
+        """
+        Потоково отдаёт извлечённый текст блоба (см. rag.extraction.iter_records).
+        Файл разбирается только один раз: записи кэшируются рядом с блобом.
+
+        Args:
+            sha256: Хэш блоба
+            suffix: Расширение исходного файла (".pdf", ".docx", ...)
+        """
+        path = self.artifact_path(sha256, f"records.v{EXTRACTION_VERSION}.jsonl")
+        for row in self._cached_stream(path, lambda: self._extract(sha256, suffix)):
+            yield TextRecord(*row)
+
+    def chunks_path(self, sha256: str, chunk_size: int, overlap: int) -> Path:
+        return self.artifact_path(
+            sha256, f"chunks.v{EXTRACTION_VERSION}.{chunk_size}-{overlap}.jsonl"
+        )
+
+    def iter_chunks(
+        self, sha256: str, suffix: str, chunk_size: int, overlap: int
+    ) -> Iterator[dict]:
+        """
+        Потоково отдаёт чанки блоба для заданных параметров чанкинга:
+        извлечение, чанкинг и запись кэша идут одним проходом, и в памяти
+        не бывает текста всей книги.
+        """
+        path = self.chunks_path(sha256, chunk_size, overlap)
+        return self._cached_stream(
+            path,
+            lambda: chunk_records(
+                ((record.page, record.text) for record in self.iter_records(sha256, suffix)),
+                chunk_size,
+                overlap,
+            ),
+        )
+
+    def get_vectors(
+        self,
+        sha256: str,
+        suffix: str,
+        embedder: Embedder,
+        chunk_size: int,
+        overlap: int,
+        batch_size: int = 256,
+    ) -> np.ndarray:
+        """
+        Возвращает эмбеддинги чанков блоба (строка = позиция чанка в файле).
+        Чанки читаются потоком и векторизуются пачками по `batch_size`.
+        """
+        path = self.artifact_path(
+            sha256,
+            f"vectors.{embedder.name}-{embedder.dim}"
+            f".v{EXTRACTION_VERSION}.{chunk_size}-{overlap}.npy",
+        )
+        try:
+            return np.load(path)
+        except (FileNotFoundError, ValueError):
+            pass
+        rows: List[np.ndarray] = []
+        chunks = self.iter_chunks(sha256, suffix, chunk_size, overlap)
+        with span("embed"):
+            for batch in batched(chunks, batch_size):
+                rows.append(embedder.embed([chunk["text"] for chunk in batch]))
+        if rows:
+            matrix = np.vstack(rows)
+        else:
+            matrix = np.zeros((0, embedder.dim), dtype=np.float32)
+        tmp = temp_path(path)
+        with open(tmp, "wb") as fh:
+            np.save(fh, matrix)
+        os.replace(tmp, path)
+        return matrix
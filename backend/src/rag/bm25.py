@@ -0,0 +1,173 @@
+import heapq
+import json
+import math
+import os
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from rag.tokenization import tokenize
+
+
+class BM25Index:
+    """
+    Инвертированный индекс по чанкам корпуса с ранжированием Okapi BM25.
+
+    - `chunks` — список чанков, позиция = id чанка; текст может храниться
+      отдельно (см. rag.chunk_store.ChunkStore), тогда в чанке его нет
+    - `postings` — термин -> [[id чанка, частота термина], ...]
+    - `doc_len` — длина каждого чанка в терминах
+    - `tombstones` — id удалённых чанков: они не находятся поиском,
+      но остаются в postings до compact() (df до уплотнения считается
+      вместе с ними, как в сегментных индексах)
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks: List[dict] = []
+        self.postings: Dict[str, List[List[int]]] = {}
+        self.doc_len: List[int] = []
+        self.tombstones: set = set()
+        # Суммарная длина живых чанков — для avgdl без прохода по doc_len
+        self._live_len = 0
+
+    @classmethod
+    def build(cls, chunks: List[dict], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        index = cls(k1=k1, b=b)
+        for chunk in chunks:
+            index.add(chunk)
+        return index
+
+    def add(self, chunk: dict, text: Optional[str] = None) -> int:
+        """
+        Добавляет чанк в индекс и возвращает его id.
+        `text` передаётся, если текста нет в самом чанке.
+        """
+        chunk_id = len(self.chunks)
+        terms = tokenize(chunk["text"] if text is None else text)
+        self.chunks.append(chunk)
+        self.doc_len.append(len(terms))
+        self._live_len += len(terms)
+        for term, tf in Counter(terms).items():
+            self.postings.setdefault(term, []).append([chunk_id, tf])
+        return chunk_id
+
+    def remove(self, chunk_ids: Iterable[int]) -> None:
+        """
+        Помечает чанки удалёнными (tombstone) без перестройки postings.
+        """
+        for chunk_id in chunk_ids:
+            if chunk_id not in self.tombstones:
+                self.tombstones.add(chunk_id)
+                self._live_len -= self.doc_len[chunk_id]
+
+    @property
+    def live_count(self) -> int:
+        return len(self.chunks) - len(self.tombstones)
+
+    def live_ids(self, limit: int) -> List[int]:
+        """
+        Первые `limit` неудалённых id чанков.
+        """
+        ids: List[int] = []
+        for chunk_id in range(len(self.chunks)):
+            if len(ids) >= limit:
+                break
+            if chunk_id not in self.tombstones:
+                ids.append(chunk_id)
+        return ids
+
+    @property
+    def avg_doc_len(self) -> float:
+        if not self.live_count:
+            return 0.0
+        return self._live_len / self.live_count
+
+    def compact(self) -> Tuple["BM25Index", List[int]]:
+        """
+        Новый индекс без удалённых чанков: postings фильтруются
+        и перенумеровываются, чанки заново не токенизируются.
+
+        Returns:
+            Tuple[BM25Index, List[int]]: Индекс и старые id его чанков по порядку
+        """
+        kept = [i for i in range(len(self.chunks)) if i not in self.tombstones]
+        new_ids = {old: new for new, old in enumerate(kept)}
+        index = BM25Index(k1=self.k1, b=self.b)
+        index.chunks = [self.chunks[i] for i in kept]
+        index.doc_len = [self.doc_len[i] for i in kept]
+        index._live_len = sum(index.doc_len)
+        for term, postings in self.postings.items():
+            live = [[new_ids[i], tf] for i, tf in postings if i in new_ids]
+            if live:
+                index.postings[term] = live
+        return index, kept
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Возвращает до `top_k` пар (id чанка, score) по убыванию score.
+        Чанки без единого совпадающего термина не возвращаются.
+        """
+        n_docs = self.live_count
+        if n_docs == 0 or top_k <= 0:
+            return []
+
+        avgdl = self.avg_doc_len or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for chunk_id, tf in postings:
+                if chunk_id in self.tombstones:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[chunk_id] / avgdl)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (
+                    tf + norm
+                )
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def to_dict(self) -> dict:
+        return {
+            "k1": self.k1,
+            "b": self.b,
+            "chunks": self.chunks,
+            "postings": self.postings,
+            "doc_len": self.doc_len,
+            "tombstones": sorted(self.tombstones),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        index = cls(k1=data["k1"], b=data["b"])
+        index.chunks = data["chunks"]
+        index.postings = data["postings"]
+        index.doc_len = data["doc_len"]
+        index.tombstones = set(data.get("tombstones", []))
+        index._live_len = sum(
+            length for i, length in enumerate(index.doc_len) if i not in index.tombstones
+        )
+        return index
+
+    def save(self, path: Path, signature: Optional[list] = None) -> None:
+        """
+        Сохраняет индекс в JSON атомарно (через временный файл).
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = self.to_dict()
+        data["signature"] = signature
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> Tuple["BM25Index", Optional[list]]:
+        """
+        Загружает индекс и сигнатуру файлов, для которых он был построен.
+        """
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return cls.from_dict(data), data.get("signature")
@@ -0,0 +1,391 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+# Статусы извлечения файла
+FILE_PENDING = "pending"
+FILE_INDEXED = "indexed"
+FILE_FAILED = "failed"
+FILE_STATUSES = (FILE_PENDING, FILE_INDEXED, FILE_FAILED)
+
+# Допустимые сортировки списков -> колонка (вторым ключом всегда идёт PK)
+CORPUS_SORTS = {
+    "name": "display_name",
+    "created": "created_at",
+    "updated": "updated_at",
+    "size": "total_size",
+    "files": "file_count",
+}
+FILE_SORTS = {
+    "name": "filename",
+    "size": "size",
+    "added": "added_at",
+    "status": "status",
+}
+
+CORPUS_COLUMNS = "id, display_name, created_at, updated_at, file_count, total_size"
+FILE_COLUMNS = "corpus_id, filename, sha256, size, status, error, added_at, indexed_at"
+
+
+class CorpusNotFoundError(FileNotFoundError):
+    """Корпуса с таким ID нет (HTTP 404)."""
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def _like(query: str) -> str:
+    """
+    Шаблон LIKE для поиска подстроки (символы % и _ экранируются).
+    """
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _corpus_row(row) -> dict:
+    corpus_id, display_name, created_at, updated_at, file_count, total_size = row
+    return {
+        "name": corpus_id,
+        "display_name": display_name,
+        "create_time": _iso(created_at),
+        "update_time": _iso(updated_at),
+        "file_count": file_count,
+        "total_size": total_size,
+    }
+
+
+def _file_row(row) -> dict:
+    corpus_id, filename, sha256, size, status, error, added_at, indexed_at = row
+    return {
+        "corpus_id": corpus_id,
+        "filename": filename,
+        "sha256": sha256,
+        "size": size,
+        "status": status,
+        "error": error,
+        "added_at": _iso(added_at),
+        "indexed_at": _iso(indexed_at),
+    }
+
+
+class CorpusCatalog:
+    """
+    Каталог корпусов и файлов в SQLite.
+
+    Списки корпусов и файлов читаются отсюда по индексам (с пагинацией,
+    фильтром и сортировкой), а не обходом директорий и манифестов.
+    Источник истины для индексации — по-прежнему манифесты корпусов:
+    GeminiRagClient меняет каталог в той же транзакции, что и манифест
+    (см. transaction), а rescan в клиенте сверяет каталог с диском,
+    если они всё же разошлись.
+
+    Клиент RAG синхронный и работает в пуле потоков, поэтому здесь
+    обычный sqlite3 с одним соединением под блокировкой: запросы
+    каталога — короткие поиски по индексу.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Транзакции управляются явно (BEGIN/COMMIT в transaction)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS corpora (
+                id TEXT PRIMARY KEY,
+                display_name TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                file_count INTEGER NOT NULL DEFAULT 0,
+                total_size INTEGER NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS corpora_created ON corpora (created_at);
+            CREATE INDEX IF NOT EXISTS corpora_updated ON corpora (updated_at);
+            CREATE INDEX IF NOT EXISTS corpora_name ON corpora (display_name);
+            CREATE TABLE IF NOT EXISTS files (
+                corpus_id TEXT NOT NULL REFERENCES corpora (id) ON DELETE CASCADE,
+                filename TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                error TEXT,
+                added_at REAL NOT NULL,
+                indexed_at REAL,
+                PRIMARY KEY (corpus_id, filename)
+            );
+            CREATE INDEX IF NOT EXISTS files_added ON files (corpus_id, added_at);
+            CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+            """
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(corpora)")}
+        if "version" not in columns:
+            self._db.execute(
+                "ALTER TABLE corpora ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+            )
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Транзакция каталога; вложенные вызовы входят во внешнюю.
+
+        Если внутри блока (например, при записи манифеста) возникло
+        исключение, все изменения каталога в нём откатываются.
+        """
+        with self._lock:
+            if self._depth == 0:
+                self._db.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._db.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._db.execute("COMMIT")
+
+    def _fetchall(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _fetchone(self, sql: str, params: tuple = ()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchone()
+
+    def is_empty(self) -> bool:
+        return self._fetchone("SELECT 1 FROM corpora LIMIT 1") is None
+
+    def corpus_ids(self) -> List[str]:
+        return [row[0] for row in self._fetchall("SELECT id FROM corpora")]
+
+    def get_corpus(self, corpus_id: str) -> Optional[dict]:
+        row = self._fetchone(f"SELECT {CORPUS_COLUMNS} FROM corpora WHERE id = ?", (corpus_id,))
+        return _corpus_row(row) if row is not None else None
+
+    def get_version(self, corpus_id: str) -> Optional[int]:
+        """
+        Версия содержимого корпуса (None, если корпуса нет).
+        """
+        row = self._fetchone("SELECT version FROM corpora WHERE id = ?", (corpus_id,))
+        return row[0] if row is not None else None
+
+    def add_corpus(
+        self, corpus_id: str, display_name: str, created_at: float
+    ) -> bool:
+        """
+        Регистрирует корпус; существующий корпус не меняется.
+
+        Счётчик версии начинается с текущего времени в миллисекундах:
+        если каталог пересоздан (rescan), новые версии всё равно больше
+        старых и не совпадут с ключами персистентного кэша ответов.
+
+        Returns:
+            bool: Корпус добавлен (его ещё не было)
+        """
+        with self.transaction():
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO corpora (id, display_name, created_at, updated_at, version) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (corpus_id, display_name, created_at, created_at, int(time.time() * 1000)),
+            )
+        return cursor.rowcount > 0
+
+    def delete_corpus(self, corpus_id: str) -> bool:
+        with self.transaction():
+            cursor = self._db.execute("DELETE FROM corpora WHERE id = ?", (corpus_id,))
+        return cursor.rowcount > 0
+
+    def _touch(self, corpus_id: str, now: float) -> None:
+        """
+        Пересчитывает число и суммарный размер файлов корпуса
+        (по первичному ключу files), время изменения и увеличивает версию.
+        """
+        self._db.execute(
+            "UPDATE corpora SET updated_at = ?, version = version + 1, "
+            "file_count = (SELECT COUNT(*) FROM files WHERE corpus_id = ?), "
+            "total_size = (SELECT COALESCE(SUM(size), 0) FROM files WHERE corpus_id = ?) "
+            "WHERE id = ?",
+            (now, corpus_id, corpus_id, corpus_id),
+        )
+
+    def upsert_file(
+        self,
+        corpus_id: str,
+        filename: str,
+        sha256: str,
+        size: int,
+        added_at: float,
+        status: str = FILE_PENDING,
+    ) -> None:
+        with self.transaction():
+            self._db.execute(
+                "INSERT INTO files (corpus_id, filename, sha256, size, status, added_at, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (corpus_id, filename) DO UPDATE SET "
+                "sha256 = excluded.sha256, size = excluded.size, status = excluded.status, "
+                "error = NULL, added_at = excluded.added_at, indexed_at = excluded.indexed_at",
+                (
+                    corpus_id,
+                    filename,
+                    sha256,
+                    size,
+                    status,
+                    added_at,
+                    added_at if status == FILE_INDEXED else None,
+                ),
+            )
+            self._touch(corpus_id, added_at)
+
+    def delete_file(self, corpus_id: str, filename: str, now: float) -> bool:
+        with self.transaction():
+            cursor = self._db.execute(
+                "DELETE FROM files WHERE corpus_id = ? AND filename = ?",
+                (corpus_id, filename),
+            )
+            self._touch(corpus_id, now)
+        return cursor.rowcount > 0
+
+    def set_file_status(
+        self,
+        corpus_id: str,
+        statuses: Dict[str, Tuple[str, Optional[str]]],
+        now: float,
+    ) -> None:
+        """
+        Обновляет статус извлечения файлов корпуса: имя -> (статус, ошибка).
+        """
+        with self.transaction():
+            self._db.executemany(
+                "UPDATE files SET status = ?, error = ?, indexed_at = ? "
+                "WHERE corpus_id = ? AND filename = ?",
+                [
+                    (status, error, now if status == FILE_INDEXED else None, corpus_id, name)
+                    for name, (status, error) in statuses.items()
+                ],
+            )
+
+    def file_status(self, corpus_id: str, filename: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Статус файла и ошибка извлечения; (None, None), если файла нет.
+        """
+        row = self._fetchone(
+            "SELECT status, error FROM files WHERE corpus_id = ? AND filename = ?",
+            (corpus_id, filename),
+        )
+        return (row[0], row[1]) if row else (None, None)
+
+    def file_entries(self, corpus_id: str) -> Dict[str, Tuple[str, int]]:
+        """
+        Файлы корпуса в каталоге: имя -> (sha256, размер).
+        """
+        rows = self._fetchall(
+            "SELECT filename, sha256, size FROM files WHERE corpus_id = ?", (corpus_id,)
+        )
+        return {name: (sha256, size) for name, sha256, size in rows}
+
+    def blob_refs(self) -> Dict[str, int]:
+        """
+        Сколько файлов во всех корпусах ссылается на каждый блоб: sha256 -> число.
+        """
+        rows = self._fetchall("SELECT sha256, COUNT(*) FROM files GROUP BY sha256")
+        return {sha256: count for sha256, count in rows}
+
+    def list_corpora(
+        self,
+        limit: int = 100,
+        offset: int = 0,
+        query: Optional[str] = None,
+        sort: str = "created",
+        descending: bool = False,
+    ) -> Tuple[List[dict], int]:
+        """
+        Страница корпусов и общее число корпусов под фильтром.
+
+        Args:
+            limit: Размер страницы
+            offset: Сколько корпусов пропустить
+            query: Подстрока в имени или ID корпуса
+            sort: name, created, updated, size или files
+            descending: Сортировка по убыванию
+        """
+        where, params = "", ()
+        if query:
+            where = "WHERE display_name LIKE ? ESCAPE '\\' OR id LIKE ? ESCAPE '\\'"
+            params = (_like(query), _like(query))
+        direction = "DESC" if descending else "ASC"
+        with self._lock:
+            (total,) = self._db.execute(f"SELECT COUNT(*) FROM corpora {where}", params).fetchone()
+            rows = self._db.execute(
+                f"SELECT {CORPUS_COLUMNS} FROM corpora {where} "
+                f"ORDER BY {CORPUS_SORTS[sort]} {direction}, id {direction} "
+                "LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        return [_corpus_row(row) for row in rows], total
+
+    def list_files(
+        self,
+        corpus_id: str,
+        limit: int = 100,
+        offset: int = 0,
+        query: Optional[str] = None,
+        status: Optional[str] = None,
+        sort: str = "name",
+        descending: bool = False,
+    ) -> Tuple[List[dict], int]:
+        """
+        Страница файлов корпуса и их общее число под фильтром.
+        Если корпуса нет в каталоге, выбрасывает CorpusNotFoundError.
+        """
+        conditions, params = ["corpus_id = ?"], [corpus_id]
+        if query:
+            conditions.append("filename LIKE ? ESCAPE '\\'")
+            params.append(_like(query))
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        where = " AND ".join(conditions)
+        direction = "DESC" if descending else "ASC"
+        with self._lock:
+            if self.get_corpus(corpus_id) is None:
+                raise CorpusNotFoundError(f"Корпус не найден: {corpus_id}")
+            (total,) = self._db.execute(
+                f"SELECT COUNT(*) FROM files WHERE {where}", params
+            ).fetchone()
+            rows = self._db.execute(
+                f"SELECT {FILE_COLUMNS} FROM files WHERE {where} "
+                f"ORDER BY {FILE_SORTS[sort]} {direction}, filename {direction} "
+                "LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        return [_file_row(row) for row in rows], total
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+if __name__ == "__main__":
+    # python -m rag.catalog — сверить каталог с корпусами на диске без запуска сервера
+    from clients.gemini_rag_client import GeminiRagClient
+    from clients.llm_backend import FakeBackend
+
+    # Модель для сверки не нужна
+    client = GeminiRagClient(backend=FakeBackend())
+    print(f"🔧 Каталог сверен с диском: {client.rescan_catalog()}")
+    client.catalog.close()
@@ -0,0 +1,190 @@
+import fcntl
+import json
+import mmap
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+
+DATA_SUFFIX = ".bin"
+OFFSETS_SUFFIX = ".offsets"
+SEGMENTS_SUFFIX = ".segments"
+
+# Запись в таблице смещений: (начало, конец) текста в файле данных, uint64
+ENTRY_DTYPE = np.dtype("<u8")
+ENTRY_SIZE = 2 * ENTRY_DTYPE.itemsize
+
+
+def _map(fh) -> Optional[mmap.mmap]:
+    size = os.fstat(fh.fileno()).st_size
+    if size == 0:
+        return None
+    return mmap.mmap(fh.fileno(), size, access=mmap.ACCESS_READ)
+
+
+class ChunkStore:
+    """
+    Тексты чанков корпуса на диске вместо строк в памяти процесса.
+
+    - `<name>.bin` — тексты чанков в UTF-8 подряд, только дописывается;
+    - `<name>.offsets` — таблица фиксированной ширины: для каждого чанка
+      пара uint64 (начало, конец) в `.bin`; номер записи = ref чанка;
+    - `<name>.segments` — JSON-строки «ключ -> ref» для дописанных файлов,
+      чтобы после перезапуска (или в другом воркере) файл, уже дописанный
+      поверх базы, переиспользовал свои тексты, а не дописывал их снова.
+
+    Оба файла открываются через mmap, текст декодируется только для
+    чанков, которые попали в промпт. Несколько воркеров uvicorn делят
+    одни и те же страницы в page cache, а не держат свои копии.
+    Дописывание идёт под flock, поэтому воркеры могут дописывать
+    в одно хранилище одновременно.
+
+    Хранилище, однажды записанное, не переписывается: уплотнение
+    индекса создаёт новое (`create`) под новым именем.
+    """
+
+    def __init__(self, directory: Path, name: str):
+        self.directory = directory
+        self.name = name
+        self._data_fh = open(directory / f"{name}{DATA_SUFFIX}", "a+b")
+        self._offsets_fh = open(directory / f"{name}{OFFSETS_SUFFIX}", "a+b")
+        self._segments_path = directory / f"{name}{SEGMENTS_SUFFIX}"
+        self._lock = threading.Lock()
+        self._data: Optional[mmap.mmap] = None
+        self._offsets = np.zeros((0, 2), dtype=ENTRY_DTYPE)
+
+    @classmethod
+    def create(cls, directory: Path) -> "ChunkStore":
+        """
+        Новое пустое хранилище с уникальным именем.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        return cls(directory, f"chunks-{time.time_ns():x}-{os.getpid()}")
+
+    @classmethod
+    def open(cls, directory: Path, name: str) -> "ChunkStore":
+        """
+        Открывает существующее хранилище (FileNotFoundError, если его нет).
+        """
+        for suffix in (DATA_SUFFIX, OFFSETS_SUFFIX):
+            if not (directory / f"{name}{suffix}").exists():
+                raise FileNotFoundError(f"Хранилище чанков не найдено: {name}")
+        return cls(directory, name)
+
+    def __len__(self) -> int:
+        return os.fstat(self._offsets_fh.fileno()).st_size // ENTRY_SIZE
+
+    def append(self, texts: Iterable[str]) -> List[int]:
+        """
+        Дописывает тексты и возвращает их ref в порядке `texts`.
+        """
+        encoded = [text.encode("utf-8") for text in texts]
+        if not encoded:
+            return []
+        with self._lock:
+            fcntl.flock(self._offsets_fh.fileno(), fcntl.LOCK_EX)
+            try:
+                start = os.fstat(self._data_fh.fileno()).st_size
+                entries = np.empty((len(encoded), 2), dtype=ENTRY_DTYPE)
+                for row, data in enumerate(encoded):
+                    entries[row] = (start, start + len(data))
+                    start += len(data)
+                self._data_fh.write(b"".join(encoded))
+                self._data_fh.flush()
+                # Запись в таблицу — после данных: ref виден, когда текст уже на диске
+                first = os.fstat(self._offsets_fh.fileno()).st_size // ENTRY_SIZE
+                self._offsets_fh.write(entries.tobytes())
+                self._offsets_fh.flush()
+            finally:
+                fcntl.flock(self._offsets_fh.fileno(), fcntl.LOCK_UN)
+        return list(range(first, first + len(encoded)))
+
+    def segment(self, key: str) -> Optional[List[int]]:
+        """
+        ref текстов, записанных под ключом `key` (см. record), или None.
+        """
+        try:
+            lines = self._segments_path.read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            return None
+        refs = None
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Строка, недописанная при падении процесса
+                continue
+            if entry.get("key") == key:
+                refs = [
+                    ref for first, count in entry["runs"] for ref in range(first, first + count)
+                ]
+        return refs
+
+    def record(self, key: str, refs: List[int]) -> None:
+        """
+        Запоминает ref текстов под ключом `key`; последняя запись главнее.
+        Подряд идущие ref хранятся отрезками [первый, число].
+        """
+        runs: List[List[int]] = []
+        for ref in refs:
+            if runs and runs[-1][0] + runs[-1][1] == ref:
+                runs[-1][1] += 1
+            else:
+                runs.append([ref, 1])
+        line = json.dumps({"key": key, "runs": runs}) + "\n"
+        with self._lock:
+            fcntl.flock(self._offsets_fh.fileno(), fcntl.LOCK_EX)
+            try:
+                with open(self._segments_path, "a", encoding="utf-8") as fh:
+                    fh.write(line)
+            finally:
+                fcntl.flock(self._offsets_fh.fileno(), fcntl.LOCK_UN)
+
+    def _remap(self, ref: int) -> np.ndarray:
+        with self._lock:
+            offsets = self._offsets
+            if ref < offsets.shape[0]:
+                return offsets
+            # Старые отображения не закрываем: их может читать другой поток
+            mapped = _map(self._offsets_fh)
+            if mapped is not None:
+                offsets = np.frombuffer(mapped, dtype=ENTRY_DTYPE).reshape(-1, 2)
+            self._data = _map(self._data_fh)
+            self._offsets = offsets
+            return offsets
+
+    def get(self, ref: int) -> str:
+        """
+        Декодирует текст одного чанка.
+        """
+        offsets = self._offsets
+        if ref >= offsets.shape[0]:
+            offsets = self._remap(ref)
+            if ref >= offsets.shape[0]:
+                raise IndexError(f"Нет чанка {ref} в хранилище {self.name}")
+        start, end = offsets[ref]
+        if start == end:
+            return ""
+        return self._data[int(start) : int(end)].decode("utf-8")
+
+    @staticmethod
+    def remove_stale(directory: Path, keep: str) -> None:
+        """
+        Удаляет хранилища корпуса, кроме `keep`. Воркеры, которые ещё
+        читают старое хранилище, продолжают работать с открытыми файлами.
+        """
+        for path in directory.glob(f"chunks-*{OFFSETS_SUFFIX}"):
+            name = path.name[: -len(OFFSETS_SUFFIX)]
+            if name != keep:
+                path.unlink(missing_ok=True)
+                (directory / f"{name}{DATA_SUFFIX}").unlink(missing_ok=True)
+                (directory / f"{name}{SEGMENTS_SUFFIX}").unlink(missing_ok=True)
+
+    def close(self) -> None:
+        with self._lock:
+            self._data_fh.close()
+            self._offsets_fh.close()
@@ -0,0 +1,88 @@
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+# Разделитель страниц PDF: извлечение вырезает его из текста страниц
+PAGE_BREAK = "\f"
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+def _split_long(segment: str, chunk_size: int) -> List[str]:
+    """
+    Режет слишком длинный абзац по предложениям, а если и их не хватает —
+    по границе слов.
+    """
+    pieces: List[str] = []
+    current = ""
+    for sentence in _SENTENCE_RE.split(segment):
+        while len(sentence) > chunk_size:
+            cut = sentence.rfind(" ", 0, chunk_size)
+            if cut <= 0:
+                cut = chunk_size
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > chunk_size:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _tail(text: str, overlap: int) -> str:
+    """
+    Последние `overlap` символов чанка, выровненные по началу слова.
+    """
+    if overlap <= 0 or len(text) <= overlap:
+        return text if overlap > 0 else ""
+    tail = text[-overlap:]
+    space = tail.find(" ")
+    return tail[space + 1 :] if space != -1 else tail
+
+
+def chunk_records(
+    records: Iterable[Tuple[Optional[int], str]], chunk_size: int = 1200, overlap: int = 200
+) -> Iterator[dict]:
+    """
+    Потоково разбивает текст файла на чанки примерно по `chunk_size` символов.
+
+    `records` — пары (номер страницы или None, текст) в порядке файла,
+    например из rag.extraction.iter_records. Чанк отдаётся, как только
+    набран, так что в памяти держится только текущий чанк.
+
+    Границы чанков проходят по абзацам/строкам, длинные абзацы режутся
+    по предложениям. Соседние чанки перекрываются на `overlap` символов,
+    чтобы ответ на стыке не терялся.
+
+    Yields:
+        Словари {"page": номер страницы или None, "text": текст чанка}
+    """
+    overlap = min(overlap, chunk_size // 2)
+    current: List[str] = []
+    current_len = 0
+    current_page: Optional[int] = None
+
+    for page, text in records:
+        for line in text.split("\n"):
+            segment = line.strip()
+            if not segment:
+                continue
+            for piece in _split_long(segment, chunk_size):
+                if current and current_len + 1 + len(piece) > chunk_size:
+                    body = "\n".join(current)
+                    yield {"page": current_page, "text": body}
+                    tail = _tail(body, overlap)
+                    current = [tail] if tail else []
+                    current_len = len(tail)
+                    current_page = page
+                if not current:
+                    current_page = page
+                current.append(piece)
+                current_len += len(piece) + 1
+
+    if current:
+        yield {"page": current_page, "text": "\n".join(current)}
+
@@ -0,0 +1,202 @@
+import math
+import re
+from typing import List, Optional, Set, Tuple
+
+from config import settings
+
+
+# Сколько символов в среднем приходится на токен: латиница кодируется
+# плотнее кириллицы, поэтому считаем их отдельно
+ASCII_CHARS_PER_TOKEN = 4.0
+OTHER_CHARS_PER_TOKEN = 2.5
+# Заголовок «Документ N (файл, стр. M):» перед каждым чанком в промпте
+DOC_HEADER_TOKENS = 16
+# Остаток бюджета меньше этого не заполняем обрезанным чанком
+MIN_TRIMMED_TOKENS = 48
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+_WORD_RE = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Локальная оценка числа токенов без обращения к API токенизатора.
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for c in text if c < "\x80")
+    other_chars = len(text) - ascii_chars
+    return math.ceil(
+        ascii_chars / ASCII_CHARS_PER_TOKEN + other_chars / OTHER_CHARS_PER_TOKEN
+    )
+
+
+def context_budget(model_name: Optional[str] = None) -> int:
+    """
+    Бюджет токенов всего промпта для модели: из RAG_CONTEXT_MODEL_BUDGETS
+    или RAG_CONTEXT_TOKEN_BUDGET по умолчанию.
+    """
+    if model_name and model_name in settings.RAG_CONTEXT_MODEL_BUDGETS:
+        return settings.RAG_CONTEXT_MODEL_BUDGETS[model_name]
+    return settings.RAG_CONTEXT_TOKEN_BUDGET
+
+
+def _shingles(text: str, size: int = 3) -> Set[Tuple[str, ...]]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def _is_near_duplicate(
+    shingles: Set[Tuple[str, ...]], seen: List[Set[Tuple[str, ...]]], threshold: float
+) -> bool:
+    if not shingles:
+        return False
+    for other in seen:
+        if not other:
+            continue
+        overlap = len(shingles & other) / min(len(shingles), len(other))
+        if overlap >= threshold:
+            return True
+    return False
+
+
+def trim_to_sentences(text: str, max_tokens: int) -> str:
+    """
+    Оставляет целые предложения с начала текста, пока они влезают в `max_tokens`.
+    Если не влезает даже первое предложение, возвращает пустую строку.
+    """
+    kept: List[str] = []
+    used = 0
+    for sentence in _SENTENCE_END_RE.split(text):
+        cost = estimate_tokens(sentence) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(sentence)
+        used += cost
+    return " ".join(kept)
+
+
+def assemble_context(
+    docs: List[dict],
+    budget_tokens: int,
+    reserved_tokens: int = 0,
+    duplicate_threshold: Optional[float] = None,
+) -> Tuple[List[dict], dict]:
+    """
+    Отбирает чанки для промпта в пределах бюджета токенов.
+
+    Чанки берутся жадно по убыванию relevance_score, почти-дубликаты
+    (по пересечению словесных шинглов) отбрасываются, а последний
+    не влезающий целиком чанк обрезается по границе предложения.
+
+    Args:
+        docs: Чанки в формате query_corpus
+        budget_tokens: Бюджет всего промпта
+        reserved_tokens: Сколько бюджета занимают системный промпт и вопрос
+
+    Returns:
+        Tuple[List[dict], dict]: Отобранные чанки и отчёт об использовании бюджета
+    """
+    threshold = (
+        settings.RAG_NEAR_DUPLICATE_THRESHOLD
+        if duplicate_threshold is None
+        else duplicate_threshold
+    )
+    available = max(budget_tokens - reserved_tokens, 0)
+    # sorted устойчив: при равных оценках сохраняется порядок поиска
+    ranked = sorted(docs, key=lambda d: d.get("relevance_score") or 0.0, reverse=True)
+
+    selected: List[dict] = []
+    seen: List[Set[Tuple[str, ...]]] = []
+    used = 0
+    duplicates = 0
+    trimmed = 0
+    for doc in ranked:
+        shingles = _shingles(doc["chunk"])
+        if _is_near_duplicate(shingles, seen, threshold):
+            duplicates += 1
+            continue
+
+        cost = estimate_tokens(doc["chunk"]) + DOC_HEADER_TOKENS
+        if used + cost > available:
+            remaining = available - used - DOC_HEADER_TOKENS
+            if remaining < MIN_TRIMMED_TOKENS:
+                continue
+            text = trim_to_sentences(doc["chunk"], remaining)
+            if not text:
+                continue
+            doc = {**doc, "chunk": text}
+            cost = estimate_tokens(text) + DOC_HEADER_TOKENS
+            trimmed += 1
+
+        selected.append(doc)
+        seen.append(shingles)
+        used += cost
+
+    report = {
+        "budget_tokens": budget_tokens,
+        "prompt_tokens": reserved_tokens + used,
+        "context_tokens": used,
+        "chunks_retrieved": len(docs),
+        "chunks_used": len(selected),
+        "duplicates_dropped": duplicates,
+        "chunks_trimmed": trimmed,
+    }
+    return selected, report
+
+
+def group_by_shared_context(
+    retrievals: List[List[dict]],
+    budget_tokens: int,
+    reserved_tokens: List[int],
+    max_group_size: int = 5,
+    min_overlap: float = 0.5,
+) -> List[List[int]]:
+    """
+    Объединяет вопросы с общим контекстом в группы для одного запроса к модели.
+
+    Вопрос присоединяется к первой группе, в контексте которой уже есть
+    не меньше `min_overlap` его чанков, если объединённый контекст всех
+    вопросов группы целиком (без обрезки) влезает в бюджет.
+
+    Args:
+        retrievals: Найденные чанки каждого вопроса (в формате query_corpus)
+        budget_tokens: Бюджет всего промпта
+        reserved_tokens: Сколько токенов занимает каждый вопрос в промпте
+        max_group_size: Максимум вопросов в группе
+        min_overlap: Доля чанков вопроса, которые должны уже быть в группе
+
+    Returns:
+        List[List[int]]: Индексы вопросов по группам, в порядке первого вопроса
+    """
+    groups: List[List[int]] = []
+    group_chunks: List[Set[str]] = []
+    group_tokens: List[int] = []
+    for i, docs in enumerate(retrievals):
+        uris = {doc["chunk_uri"] for doc in docs}
+        costs = {
+            doc["chunk_uri"]: estimate_tokens(doc["chunk"]) + DOC_HEADER_TOKENS
+            for doc in docs
+        }
+        placed = False
+        for g, members in enumerate(groups):
+            if not uris or len(members) >= max_group_size:
+                continue
+            if len(uris & group_chunks[g]) / len(uris) < min_overlap:
+                continue
+            added = sum(cost for uri, cost in costs.items() if uri not in group_chunks[g])
+            tokens = group_tokens[g] + added + reserved_tokens[i]
+            if tokens > budget_tokens:
+                continue
+            members.append(i)
+            group_chunks[g] |= uris
+            group_tokens[g] = tokens
+            placed = True
+            break
+        if not placed:
+            groups.append([i])
+            group_chunks.append(set(uris))
+            group_tokens.append(sum(costs.values()) + reserved_tokens[i])
+    return groups
@@ -0,0 +1,203 @@
+from itertools import batched
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from rag.bm25 import BM25Index
+from rag.chunk_store import ChunkStore
+from rag.vector_index import Embedder, VectorIndex
+
+
+BM25_FILE = "bm25.json"
+
+# Сколько текстов за раз переносится в новое хранилище при уплотнении
+COMPACT_BATCH = 1024
+
+
+class CorpusIndex:
+    """
+    BM25 и векторный индексы одного корпуса, которые обновляются по файлам.
+
+    - add_file дописывает чанки, postings и векторы только нового файла;
+    - remove_file помечает чанки файла удалёнными (tombstone);
+    - compact собирает новый индекс без удалённых чанков одной матрицей.
+
+    `files` — имя файла -> [sha256, первый id чанка, число чанков];
+    id чанков у BM25Index и VectorIndex общие. На диск (`bm25.json`
+    и `vectors.npy` в `.cache/` корпуса) сохраняется только уплотнённая
+    база; изменения после неё при загрузке восстанавливаются сверкой
+    с манифестом, так что загрузка файла не переписывает индекс целиком.
+
+    Тексты чанков лежат в `store` (ChunkStore), в BM25Index — только
+    файл, позиция, страница и `ref` текста в хранилище; текст
+    декодируется в chunk() для найденных чанков.
+    """
+
+    def __init__(
+        self, bm25: BM25Index, vectors: VectorIndex, files: Dict[str, list], store: ChunkStore
+    ):
+        self.bm25 = bm25
+        self.vectors = vectors
+        self.files = files
+        self.store = store
+        # Версия корпуса в каталоге, для которой индекс актуален
+        self.version: Optional[int] = None
+        # Сколько файлов добавлено поверх сохранённой базы
+        self.appended = 0
+
+    @classmethod
+    def empty(cls, embedder: Embedder, directory: Path) -> "CorpusIndex":
+        matrix = np.zeros((0, embedder.dim), dtype=np.float32)
+        return cls(BM25Index(), VectorIndex(embedder, matrix), {}, ChunkStore.create(directory))
+
+    @property
+    def signature(self) -> list:
+        return [[name, entry[0]] for name, entry in sorted(self.files.items())]
+
+    def add_file(
+        self,
+        name: str,
+        sha256: str,
+        chunks: Iterable[dict],
+        matrix: np.ndarray,
+        batch_size: int = 256,
+    ) -> None:
+        """
+        Дописывает чанки и векторы файла (если файл с таким именем был,
+        его нужно сначала удалить через remove_file). Чанки можно
+        передать потоком: они пишутся в хранилище пачками по `batch_size`.
+
+        Если тексты этого блоба уже дописаны в хранилище (файл добавлен
+        поверх базы до перезапуска), берутся их ref, а хранилище не растёт.
+        """
+        start = len(self.bm25.chunks)
+        position = 0
+        known = self.store.segment(sha256) or []
+        refs_used: List[int] = []
+        # Сначала BM25: поиск по векторам возвращает id, которые уже есть в чанках
+        for batch in batched(chunks, batch_size):
+            if len(refs_used) + len(batch) <= len(known):
+                refs = known[len(refs_used) : len(refs_used) + len(batch)]
+            else:
+                refs = self.store.append(chunk["text"] for chunk in batch)
+            for chunk, ref in zip(batch, refs):
+                meta = {"file": name, "position": position, "page": chunk.get("page")}
+                self.bm25.add({**meta, "ref": ref}, chunk["text"])
+                position += 1
+            refs_used.extend(refs)
+        if refs_used != known:
+            self.store.record(sha256, refs_used)
+        self.vectors.append(matrix)
+        self.files[name] = [sha256, start, position]
+        self.appended += 1
+
+    def chunk(self, chunk_id: int) -> dict:
+        """
+        Чанк вместе с текстом, прочитанным из хранилища.
+        """
+        meta = self.bm25.chunks[chunk_id]
+        return {**meta, "text": self.store.get(meta["ref"])}
+
+    def remove_file(self, name: str) -> None:
+        _, start, count = self.files.pop(name)
+        ids = range(start, start + count)
+        self.bm25.remove(ids)
+        self.vectors.remove(ids)
+
+    @property
+    def tombstone_ratio(self) -> float:
+        total = len(self.bm25.chunks)
+        return len(self.bm25.tombstones) / total if total else 0.0
+
+    def needs_compaction(self, max_tombstone_ratio: float, max_segments: int) -> bool:
+        """
+        Уплотнять пора, когда удалённых чанков слишком много
+        или поверх базы накопилось много сегментов.
+        """
+        return (
+            self.tombstone_ratio > max_tombstone_ratio
+            or self.appended > max_segments
+        )
+
+    def compact(self, directory: Path) -> "CorpusIndex":
+        """
+        Новый индекс без удалённых чанков и с новым хранилищем текстов
+        в `directory`; текущий не меняется, поэтому поиск по нему может
+        идти во время уплотнения.
+        """
+        bm25, kept = self.bm25.compact()
+        vectors = self.vectors.compact(kept)
+        store = ChunkStore.create(directory)
+        for first in range(0, len(bm25.chunks), COMPACT_BATCH):
+            # Словари чанков общие со старым индексом — ref меняем в копиях
+            batch = bm25.chunks[first : first + COMPACT_BATCH]
+            refs = store.append(self.store.get(chunk["ref"]) for chunk in batch)
+            bm25.chunks[first : first + COMPACT_BATCH] = [
+                {**chunk, "ref": ref} for chunk, ref in zip(batch, refs)
+            ]
+        files: Dict[str, list] = {}
+        for chunk_id, chunk in enumerate(bm25.chunks):
+            entry = files.get(chunk["file"])
+            if entry is None:
+                files[chunk["file"]] = [self.files[chunk["file"]][0], chunk_id, 1]
+            else:
+                entry[2] += 1
+        # Файлы без чанков (пустые) тоже входят в сигнатуру
+        for name, (sha256, _, count) in self.files.items():
+            if count == 0:
+                files[name] = [sha256, len(bm25.chunks), 0]
+        index = CorpusIndex(bm25, vectors, files, store)
+        index.version = self.version
+        return index
+
+    def save(self, directory: Path) -> None:
+        """
+        Сохраняет индекс как базу (вызывается после полной сборки или уплотнения)
+        и удаляет хранилища текстов прежних баз.
+        """
+        signature = {"files": self.signature, "store": self.store.name}
+        self.vectors.save(directory, signature)
+        self.bm25.save(directory / BM25_FILE, signature)
+        ChunkStore.remove_stale(directory, self.store.name)
+        self.appended = 0
+
+    @classmethod
+    def load(cls, directory: Path, embedder: Embedder) -> Optional["CorpusIndex"]:
+        """
+        Загружает сохранённую базу или возвращает None, если её нет,
+        BM25 и векторы не согласованы между собой или база сохранена
+        в старом формате (с текстами чанков внутри bm25.json).
+        """
+        try:
+            bm25, bm25_signature = BM25Index.load(directory / BM25_FILE)
+            vectors, vectors_signature = VectorIndex.load(directory, embedder)
+        except (OSError, ValueError, KeyError):
+            return None
+        if vectors is None or bm25_signature != vectors_signature:
+            return None
+        if vectors.size != len(bm25.chunks) or not isinstance(bm25_signature, dict):
+            return None
+        try:
+            store = ChunkStore.open(directory, bm25_signature["store"])
+        except FileNotFoundError:
+            return None
+        stored = len(store)
+        if any(chunk["ref"] >= stored for chunk in bm25.chunks):
+            return None
+
+        files: Dict[str, list] = {
+            name: [sha256, 0, 0] for name, sha256 in bm25_signature["files"]
+        }
+        seen: Dict[str, bool] = {}
+        for chunk_id, chunk in enumerate(bm25.chunks):
+            entry = files.get(chunk["file"])
+            if entry is None:
+                return None
+            if not seen.get(chunk["file"]):
+                entry[1] = chunk_id
+                seen[chunk["file"]] = True
+            entry[2] += 1
+        # Чанки удалённых до сохранения файлов (если база была с tombstones)
+        vectors.remove(bm25.tombstones)
+        return cls(bm25, vectors, files, store)
@@ -0,0 +1,215 @@
+import logging
+import re
+import unicodedata
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional
+
+from docx import Document  # для извлечения текста из .docx
+from pypdf import PdfReader  # для извлечения текста из .pdf
+
+from config import settings
+from core.tracing import log_event
+from rag.chunking import PAGE_BREAK
+
+
+TEXT_SUFFIXES = {".txt", ".md", ".markdown"}
+
+# Меняется при изменении формата извлечённого текста, чтобы сбросить старый кэш
+EXTRACTION_VERSION = 3
+
+# Текстовые файлы читаются блоками такого размера (символов); строка
+# длиннее блока отдаётся по частям, так что память не зависит от файла
+TEXT_BLOCK_CHARS = 64 * 1024
+
+_SPACES_RE = re.compile(r"[ \t\v ]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def _normalize_page(text: str) -> str:
+    lines = [_SPACES_RE.sub(" ", line).strip() for line in text.split("\n")]
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+class ExtractionError(ValueError):
+    """Файл не удалось разобрать (повреждён или не того формата)."""
+
+
+class TextRecord(NamedTuple):
+    """
+    Кусок извлечённого текста: страница PDF, абзац DOCX или строка
+    текстового файла. `page` — номер страницы (только для PDF).
+    """
+
+    file: str
+    page: Optional[int]
+    text: str
+
+
+def normalize_text(text: str) -> str:
+    """
+    Приводит извлечённый текст к единому виду: NFC, без нулевых байтов,
+    без повторяющихся пробелов и лишних пустых строк.
+    """
+    text = unicodedata.normalize("NFC", text)
+    text = text.replace("\x00", "").replace("\r\n", "\n").replace("\r", "\n")
+    return _normalize_page(text.replace(PAGE_BREAK, " "))
+
+
+def _page_text(page) -> str:
+    try:
+        return page.extract_text() or ""
+    except Exception:
+        return ""
+
+
+def _extract_pdf_pages(path: str, start: int, stop: int) -> List[str]:
+    """
+    Извлекает текст страниц [start, stop). Выполняется в отдельном процессе,
+    поэтому функция верхнего уровня и принимает путь строкой.
+    """
+    reader = PdfReader(path)
+    return [_page_text(reader.pages[i]) for i in range(start, stop)]
+
+
+def _iter_pdf_parallel(
+    path: Path, n_pages: int, workers: int, window: int
+) -> Iterator[List[str]]:
+    """
+    Делит страницы на диапазоны и извлекает их в пуле процессов,
+    отдавая диапазоны по порядку. Впереди чтения извлекается не больше
+    `window` страниц, так что память не растёт с размером книги.
+    Диапазонов больше, чем процессов, чтобы тяжёлые страницы
+    не задерживали один воркер.
+    """
+    from core.executors import get_process_pool
+
+    step = max(1, min(-(-n_pages // (workers * 4)), window // workers))
+    max_in_flight = max(workers, window // step)
+    pool = get_process_pool()
+    starts = iter(range(0, n_pages, step))
+    in_flight = []
+    try:
+        for start in starts:
+            in_flight.append(
+                pool.submit(_extract_pdf_pages, str(path), start, min(start + step, n_pages))
+            )
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.pop(0).result()
+        while in_flight:
+            yield in_flight.pop(0).result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def _iter_pdf(path: Path) -> Iterator[TextRecord]:
+    """
+    Извлекает текст PDF по страницам.
+
+    pypdf написан на чистом Python и упирается в одно ядро, поэтому
+    большие файлы (от PDF_PARALLEL_MIN_PAGES страниц) разбираются
+    параллельно в пуле процессов окном из EXTRACTION_WINDOW_PAGES
+    страниц; маленькие — последовательно.
+    """
+    reader = PdfReader(str(path))
+    n_pages = len(reader.pages)
+    workers = settings.PDF_EXTRACTION_WORKERS
+    page_no = 0
+
+    if workers > 1 and n_pages >= settings.PDF_PARALLEL_MIN_PAGES:
+        try:
+            for pages_text in _iter_pdf_parallel(
+                path, n_pages, workers, settings.EXTRACTION_WINDOW_PAGES
+            ):
+                for page_text in pages_text:
+                    page_no += 1
+                    yield TextRecord(path.name, page_no, page_text)
+            return
+        except (BrokenProcessPool, OSError) as e:
+            log_event(
+                "Параллельное извлечение PDF не удалось, читаем последовательно",
+                logging.WARNING,
+                file=path.name,
+                error=str(e),
+            )
+
+    # Продолжаем с той страницы, на которой остановился пул
+    for index in range(page_no, n_pages):
+        yield TextRecord(path.name, index + 1, _page_text(reader.pages[index]))
+
+
+def _iter_docx(path: Path) -> Iterator[TextRecord]:
+    doc = Document(str(path))
+    for paragraph in doc.paragraphs:
+        yield TextRecord(path.name, None, paragraph.text)
+
+
+def _iter_lines(path: Path) -> Iterator[TextRecord]:
+    """
+    Читает текстовый файл блоками по TEXT_BLOCK_CHARS и отдаёт строки.
+    """
+    with open(path, encoding="utf-8", errors="ignore") as fh:
+        tail = ""
+        while block := fh.read(TEXT_BLOCK_CHARS):
+            lines = (tail + block).split("\n")
+            tail = lines.pop()
+            for line in lines:
+                yield TextRecord(path.name, None, line)
+            if len(tail) > TEXT_BLOCK_CHARS:
+                # Очень длинная строка: отдаём её по частям по границе слова
+                cut = tail.rfind(" ") + 1 or len(tail)
+                yield TextRecord(path.name, None, tail[:cut])
+                tail = tail[cut:]
+        if tail:
+            yield TextRecord(path.name, None, tail)
+
+
+def _iter_other(path: Path) -> Iterator[TextRecord]:
+    # Всё остальное пытаемся прочитать как текст,
+    # но фильтруем очевидный бинарник
+    with open(path, "rb") as fh:
+        sample = fh.read(2000)
+    # Простая эвристика: доля непечатных символов
+    non_printable = sum(1 for b in sample if b < 9 or (13 < b < 32))
+    if sample and non_printable / len(sample) > 0.3:
+        # Похоже на бинарный файл — пропускаем
+        return
+    yield TextRecord(path.name, None, sample.decode("utf-8", errors="ignore"))
+
+
+def iter_records(path: Path, suffix: Optional[str] = None) -> Iterator[TextRecord]:
+    """
+    Потоково извлекает нормализованный текст из одного файла.
+
+    - Для .txt / .md — строки, файл читается блоками
+    - Для .docx — абзацы (python-docx)
+    - Для .pdf — страницы (pypdf)
+    - Для остальных файлов — начало файла, если это не бинарные данные
+
+    Записи отдаются по мере извлечения, поэтому целиком текст книги
+    в памяти не собирается. Пустые записи пропускаются.
+    Формат определяется по `suffix` (если передан) или по расширению файла —
+    у блобов в хранилище расширения нет.
+    Если файл не удалось разобрать, выбрасывается ExtractionError.
+    """
+    suffix = (suffix if suffix is not None else path.suffix).lower()
+    if suffix in TEXT_SUFFIXES:
+        records = _iter_lines(path)
+    elif suffix == ".docx":
+        records = _iter_docx(path)
+    elif suffix == ".pdf":
+        records = _iter_pdf(path)
+    else:
+        records = _iter_other(path)
+    try:
+        for record in records:
+            text = normalize_text(record.text)
+            if text:
+                yield record._replace(text=text)
+    except OSError:
+        raise
+    except Exception as e:
+        kind = suffix or "без расширения"
+        raise ExtractionError(f"Не удалось разобрать файл ({kind}): {e}") from e
+
@@ -0,0 +1,205 @@
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from rag.tokenization import tokenize
+
+
+# Термины уже нормализованы rag.tokenization (стоп-слова, ё -> е, стемминг
+# для русского и английского), FTS5 остаётся только разбить их по пробелам
+# и привести регистр; remove_diacritics одинаково применяется к чанкам и запросам
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+
+
+def corpus_key(corpus_id: str) -> str:
+    """
+    Токен корпуса для колонки corpus_key: по нему FTS5 пересекает
+    совпадения с корпусом прямо в индексе, без фильтрации строк.
+    """
+    return "c" + hashlib.sha1(corpus_id.encode("utf-8")).hexdigest()[:16]
+
+
+class FtsIndex:
+    """
+    Полнотекстовый индекс чанков всех корпусов в одной базе SQLite FTS5.
+
+    - chunks — текст чанков (читается только для найденных);
+    - chunks_fts — нормализованные термины чанка и токен корпуса,
+      ранжирование встроенной bm25();
+    - fts_files — какие версии файлов (sha256) уже проиндексированы.
+
+    Поиск — один SQL-запрос к индексу на диске, поэтому память
+    процесса не растёт с размером библиотеки. Запись идёт через одно
+    соединение под блокировкой, чтение — через соединение своего потока
+    (WAL позволяет читать параллельно с записью).
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS fts_files (
+                corpus_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                PRIMARY KEY (corpus_id, filename)
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                corpus_id TEXT NOT NULL,
+                file TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                page INTEGER,
+                text TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_file ON chunks (corpus_id, file, position);
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                terms, corpus_key, tokenize = '{FTS_TOKENIZER}'
+            );
+            """
+        )
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        # Соединения читателей всех потоков, чтобы закрыть их в close()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+
+    def _reader(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # check_same_thread=False — только ради close() из другого потока,
+            # запросы через соединение идут из его собственного потока
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA query_only=ON")
+            self._local.db = db
+            with self._readers_lock:
+                self._readers.append(db)
+        return db
+
+    def is_empty(self) -> bool:
+        return self._reader().execute("SELECT 1 FROM fts_files LIMIT 1").fetchone() is None
+
+    def files(self, corpus_id: str) -> Dict[str, str]:
+        """
+        Проиндексированные файлы корпуса: имя -> sha256.
+        """
+        rows = self._reader().execute(
+            "SELECT filename, sha256 FROM fts_files WHERE corpus_id = ?", (corpus_id,)
+        )
+        return dict(rows.fetchall())
+
+    def _delete_rows(self, where: str, params: tuple) -> None:
+        self._db.execute(
+            f"DELETE FROM chunks_fts WHERE rowid IN (SELECT id FROM chunks WHERE {where})",
+            params,
+        )
+        self._db.execute(f"DELETE FROM chunks WHERE {where}", params)
+
+    def replace_file(
+        self, corpus_id: str, filename: str, sha256: str, chunks: Iterable[dict]
+    ) -> None:
+        """
+        Индексирует чанки файла, заменяя его прежнюю версию.
+        Чанки можно передать потоком: они токенизируются по одному
+        внутри транзакции (читателям она не мешает, WAL).
+        """
+        key = corpus_key(corpus_id)
+        with self._write_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_rows("corpus_id = ? AND file = ?", (corpus_id, filename))
+                for position, chunk in enumerate(chunks):
+                    terms = " ".join(tokenize(chunk["text"]))
+                    cursor = self._db.execute(
+                        "INSERT INTO chunks (corpus_id, file, position, page, text) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (corpus_id, filename, position, chunk.get("page"), chunk["text"]),
+                    )
+                    self._db.execute(
+                        "INSERT INTO chunks_fts (rowid, terms, corpus_key) VALUES (?, ?, ?)",
+                        (cursor.lastrowid, terms, key),
+                    )
+                self._db.execute(
+                    "INSERT OR REPLACE INTO fts_files (corpus_id, filename, sha256) "
+                    "VALUES (?, ?, ?)",
+                    (corpus_id, filename, sha256),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def delete_file(self, corpus_id: str, filename: str) -> None:
+        with self._write_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_rows("corpus_id = ? AND file = ?", (corpus_id, filename))
+                self._db.execute(
+                    "DELETE FROM fts_files WHERE corpus_id = ? AND filename = ?",
+                    (corpus_id, filename),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def delete_corpus(self, corpus_id: str) -> None:
+        with self._write_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_rows("corpus_id = ?", (corpus_id,))
+                self._db.execute("DELETE FROM fts_files WHERE corpus_id = ?", (corpus_id,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _row(row) -> dict:
+        file, position, page, text, score = row
+        return {"file": file, "position": position, "page": page, "text": text, "score": score}
+
+    def search(self, corpus_id: str, query: str, top_k: int = 5) -> List[dict]:
+        """
+        До `top_k` чанков корпуса по убыванию BM25 ({"file", "position",
+        "page", "text", "score"}). Колонка corpus_key в ранжировании
+        не участвует (вес 0).
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms or top_k <= 0:
+            return []
+        match = 'corpus_key : "{}" AND terms : ({})'.format(
+            corpus_key(corpus_id), " OR ".join(f'"{term}"' for term in terms)
+        )
+        rows = self._reader().execute(
+            "SELECT c.file, c.position, c.page, c.text, -bm25(chunks_fts, 1.0, 0.0) "
+            "FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid "
+            "WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts, 1.0, 0.0) LIMIT ?",
+            (match, top_k),
+        )
+        return [self._row(row) for row in rows.fetchall()]
+
+    def first_chunks(self, corpus_id: str, limit: int) -> List[dict]:
+        """
+        Первые чанки корпуса с нулевым score — запасной контекст,
+        когда по запросу ничего не нашлось.
+        """
+        rows = self._reader().execute(
+            "SELECT file, position, page, text, 0.0 FROM chunks "
+            "WHERE corpus_id = ? ORDER BY file, position LIMIT ?",
+            (corpus_id, limit),
+        )
+        return [self._row(row) for row in rows.fetchall()]
+
+    def close(self) -> None:
+        with self._readers_lock:
+            for db in self._readers:
+                db.close()
+            self._readers.clear()
+        with self._write_lock:
+            self._db.close()
@@ -0,0 +1,64 @@
+import re
+from typing import List
+
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Самые частые служебные слова, которые только зашумляют поиск
+STOPWORDS = frozenset(
+    """
+    и в во не что он на я с со как а то все она так его но да ты к у же вы за бы
+    по только ее её мне было вот от меня еще ещё нет о из ему теперь когда даже ну
+    ли если уже или ни быть был него до вас нибудь опять уж вам ведь там потом
+    себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам
+    чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому
+    этого какой совсем ним здесь этом один почти мой тем чтобы нее неё сейчас были
+    куда зачем всех никогда можно при наконец два об другой хоть после над больше
+    тот через эти нас про всего них какая много разве три эту моя впрочем хорошо
+    свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно
+    всю между это эта
+    a an the and or of to in on at by for with from is are was were be been it
+    its this that these those as not no but if then so do does did what which who
+    how
+    """.split()
+)
+
+# Окончания для лёгкого стемминга, от длинных к коротким
+_RU_ENDINGS = sorted(
+    set(
+        """
+    ями ами иями ого его ому ему ыми ими ая яя ое ее ые ие ый ий ой ую юю ом ем
+    ах ях ов ев ей ам ям ою ею ия ья ие ье ть ться тся ешь ет ем ете ут ют ит
+    им ат ят ла ло ли ал ил ыл ел а я о е ы и у ю ь й
+    """.split()
+    ),
+    key=len,
+    reverse=True,
+)
+_EN_ENDINGS = ("ingly", "ing", "edly", "ed", "ies", "es", "ly", "s")
+
+
+def stem(word: str) -> str:
+    """
+    Очень простой стемминг: отрезаем типичное окончание, если слово длинное.
+    Этого хватает, чтобы «книга», «книги» и «книгой» давали один термин.
+    """
+    if len(word) <= 4 or word.isdigit():
+        return word
+    endings = _EN_ENDINGS if word.isascii() else _RU_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[: -len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Разбивает текст на нормализованные термины для поиска.
+    """
+    terms: List[str] = []
+    for word in _WORD_RE.findall(text.lower().replace("ё", "е")):
+        if len(word) < 2 or word in STOPWORDS:
+            continue
+        terms.append(stem(word))
+    return terms
@@ -0,0 +1,215 @@
+import json
+import math
+import os
+import zlib
+from abc import ABC, abstractmethod
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+
+import numpy as np
+
+from rag.tokenization import tokenize
+
+
+class Embedder(ABC):
+    """
+    Базовый класс локального эмбеддера: превращает тексты в векторы
+    фиксированной размерности без обращения к сети.
+    """
+
+    name = "base"
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Возвращает матрицу float32 формы (len(texts), dim) с L2-нормированными строками.
+        """
+
+
+class HashingEmbedder(Embedder):
+    """
+    Хэширующий векторизатор по символьным n-граммам слов.
+
+    N-граммы («<кни», «ниг», «ига>» ...) устойчивы к падежам и опечаткам,
+    поэтому перефразированные русские вопросы попадают в нужные чанки
+    даже без совпадения слов целиком. Знак признака берётся из хэша,
+    чтобы коллизии в среднем гасили друг друга.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 1024, ngram_range: Tuple[int, int] = (3, 4)):
+        super().__init__(dim)
+        self.ngram_range = ngram_range
+
+    def _features(self, text: str) -> Counter:
+        features: Counter = Counter()
+        lo, hi = self.ngram_range
+        for term in tokenize(text):
+            features[term] += 1
+            padded = f"<{term}>"
+            for n in range(lo, hi + 1):
+                for i in range(len(padded) - n + 1):
+                    features[padded[i : i + n]] += 1
+        return features
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                h = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                matrix[row, h % self.dim] += sign * (1.0 + math.log(count))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+EMBEDDERS: Dict[str, Type[Embedder]] = {
+    HashingEmbedder.name: HashingEmbedder,
+}
+
+
+def get_embedder(name: str, dim: int) -> Embedder:
+    """
+    Возвращает эмбеддер по имени из реестра EMBEDDERS.
+    """
+    try:
+        return EMBEDDERS[name](dim=dim)
+    except KeyError:
+        raise ValueError(f"Неизвестный эмбеддер: {name}")
+
+
+class VectorIndex:
+    """
+    Плотный векторный индекс чанков корпуса.
+
+    Векторы лежат матрицей float32 (строка = id чанка, как в BM25Index)
+    в `vectors.npy` и открываются через memory map, поэтому несколько
+    процессов делят одни и те же страницы в page cache.
+
+    Векторы добавленных файлов дописываются отдельными сегментами
+    (append), удалённые чанки помечаются tombstone (remove) — матрица
+    не копируется, пока индекс не уплотнят (compact).
+    """
+
+    MATRIX_FILE = "vectors.npy"
+    META_FILE = "vectors.json"
+
+    def __init__(self, embedder: Embedder, matrix: np.ndarray):
+        self.embedder = embedder
+        self.segments: List[np.ndarray] = [matrix]
+        self.tombstones: set = set()
+        self._dead: Optional[np.ndarray] = None
+
+    @property
+    def size(self) -> int:
+        return sum(segment.shape[0] for segment in self.segments)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        Все векторы одной матрицей (сегменты склеиваются, если их несколько).
+        """
+        if len(self.segments) == 1:
+            return self.segments[0]
+        return np.vstack(self.segments)
+
+    def append(self, matrix: np.ndarray) -> None:
+        if matrix.shape[0]:
+            self.segments.append(matrix)
+
+    def remove(self, chunk_ids: Iterable[int]) -> None:
+        self.tombstones.update(chunk_ids)
+        self._dead = None
+
+    def compact(self, kept: List[int]) -> "VectorIndex":
+        """
+        Новый индекс из строк `kept` (старые id в новом порядке) одной матрицей.
+        """
+        matrix = self.matrix[np.asarray(kept, dtype=np.int64)] if kept else np.zeros(
+            (0, self.embedder.dim), dtype=np.float32
+        )
+        return VectorIndex(self.embedder, np.ascontiguousarray(matrix, dtype=np.float32))
+
+    @classmethod
+    def build(cls, embedder: Embedder, texts: List[str]) -> "VectorIndex":
+        matrix = embedder.embed(texts) if texts else np.zeros((0, embedder.dim), np.float32)
+        return cls(embedder, np.ascontiguousarray(matrix, dtype=np.float32))
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Возвращает до `top_k` пар (id чанка, косинусная близость) по убыванию.
+
+        Один матрично-векторный продукт по всему корпусу и argpartition
+        вместо полной сортировки.
+        """
+        return self.search_many([query], top_k)[0]
+
+    def search_many(
+        self, queries: List[str], top_k: int = 5
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Поиск сразу по нескольким запросам: все запросы векторизуются
+        одним вызовом эмбеддера, а оценки считаются одним матричным
+        произведением (запросы × чанки).
+        """
+        # Снимок: сегменты могут дописываться параллельно с поиском
+        segments = list(self.segments)
+        n_chunks = sum(segment.shape[0] for segment in segments)
+        dead = self._dead
+        if dead is None:
+            dead = np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones))
+            self._dead = dead
+        n_live = n_chunks - int(np.count_nonzero(dead < n_chunks))
+        if n_live <= 0 or top_k <= 0 or not queries:
+            return [[] for _ in queries]
+
+        query_matrix = self.embedder.embed(queries)
+        scores = np.hstack([query_matrix @ segment.T for segment in segments])
+        if dead.size:
+            scores[:, dead[dead < n_chunks]] = -np.inf
+        k = min(top_k, n_live)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        rows = np.arange(len(queries))[:, None]
+        order = np.argsort(-scores[rows, top], axis=1)
+        top = top[rows, order]
+        return [
+            [(int(i), float(scores[row, i])) for i in top[row]]
+            for row in range(len(queries))
+        ]
+
+    def save(self, directory: Path, signature: Optional[list] = None) -> None:
+        """
+        Сохраняет матрицу и метаданные (эмбеддер, размерность, сигнатуру файлов).
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp = directory / f".{self.MATRIX_FILE}.{os.getpid()}.tmp.npy"
+        np.save(tmp, self.matrix)
+        os.replace(tmp, directory / self.MATRIX_FILE)
+        meta = {
+            "embedder": self.embedder.name,
+            "dim": self.embedder.dim,
+            "signature": signature,
+        }
+        tmp = directory / f".{self.META_FILE}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, directory / self.META_FILE)
+
+    @classmethod
+    def load(
+        cls, directory: Path, embedder: Embedder
+    ) -> Tuple[Optional["VectorIndex"], Optional[list]]:
+        """
+        Открывает матрицу через memory map. Если индекс построен другим
+        эмбеддером, возвращает (None, None), и его нужно пересобрать.
+        """
+        meta = json.loads((directory / cls.META_FILE).read_text(encoding="utf-8"))
+        if meta["embedder"] != embedder.name or meta["dim"] != embedder.dim:
+            return None, None
+        matrix = np.load(directory / cls.MATRIX_FILE, mmap_mode="r")
+        return cls(embedder, matrix), meta.get("signature")
@@ -4,8 +4,10 @@ from typing import Optional
 
 class PromptResponseSchema(BaseModel):
     message: str
+    session_id: Optional[str] = None
 
 
 class PromptSchema(BaseModel):
     message: str
     corpus_id: Optional[str] = None  # ID корпуса для RAG (опционально)
+    session_id: Optional[str] = None  # ID сессии чата, чтобы модель видела историю
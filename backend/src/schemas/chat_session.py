@@ -0,0 +1,28 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+
+class ChatSessionCreateSchema(BaseModel):
+    """Схема для создания сессии чата."""
+
+    corpus_id: Optional[str] = None  # Корпус по умолчанию для сообщений сессии
+
+
+class ChatMessageSchema(BaseModel):
+    """Сообщение в истории сессии."""
+
+    id: int
+    role: str  # user или assistant
+    content: str
+    created_at: str
+
+
+class ChatSessionSchema(BaseModel):
+    """Сессия чата: сводка ранней истории и последние сообщения."""
+
+    session_id: str
+    corpus_id: Optional[str] = None
+    summary: str = ""
+    created_at: str
+    updated_at: str
+    messages: List[ChatMessageSchema] = []
@@ -0,0 +1,26 @@
+from pydantic import BaseModel
+from typing import Optional, List
+
+
+class IngestionFileSchema(BaseModel):
+    """Состояние обработки одного файла в задаче загрузки."""
+
+    filename: str
+    location: str
+    status: str = "queued"  # queued, processing, done, error
+    file_id: Optional[str] = None
+    error: Optional[str] = None
+
+
+class IngestionJobSchema(BaseModel):
+    """Фоновая задача загрузки файлов в корпус."""
+
+    job_id: str
+    corpus_id: str
+    status: str = "queued"  # queued, running, completed, failed
+    total: int = 0
+    processed: int = 0
+    files: List[IngestionFileSchema] = []
+    created_at: str
+    finished_at: Optional[str] = None
+    trace_id: Optional[str] = None  # Трассировка запроса загрузки; фоновая обработка пишется под ней же
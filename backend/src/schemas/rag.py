@@ -1,5 +1,11 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Optional, List, Literal
+
+from config import settings
+
+
+# Режимы поиска по корпусу (см. GeminiRagClient.query_corpus)
+RetrievalMode = Literal["bm25", "dense", "hybrid", "fts"]
 
 
 class CorpusSchema(BaseModel):
@@ -8,6 +14,9 @@ class CorpusSchema(BaseModel):
     name: str
     display_name: str
     create_time: Optional[str] = None
+    update_time: Optional[str] = None
+    file_count: int = 0
+    total_size: int = 0
 
 
 class CorpusCreateSchema(BaseModel):
@@ -30,6 +39,12 @@ class FileInfoSchema(BaseModel):
     corpus_id: str
     filename: str
     size: int
+    sha256: Optional[str] = None
+    # Статус извлечения: pending, indexed или failed (с текстом ошибки)
+    status: Optional[str] = None
+    error: Optional[str] = None
+    added_at: Optional[str] = None
+    indexed_at: Optional[str] = None
 
 
 class QuerySchema(BaseModel):
@@ -37,7 +52,9 @@ class QuerySchema(BaseModel):
 
     corpus_id: str
     query: str
-    max_results: int = 5
+    max_results: int = Field(5, ge=1, le=settings.RAG_MAX_RESULTS)
+    # Режим поиска: bm25, dense, hybrid или fts (по умолчанию из настроек)
+    retrieval_mode: Optional[RetrievalMode] = None
 
 
 class RAGResponseSchema(BaseModel):
@@ -45,6 +62,60 @@ class RAGResponseSchema(BaseModel):
 
     message: str
     relevant_docs: Optional[List[dict]] = None
+    # Использование бюджета токенов контекста (см. rag.context.assemble_context)
+    context: Optional[dict] = None
+
+
+class BatchQuerySchema(BaseModel):
+    """Схема для пакета вопросов к одному корпусу."""
+
+    corpus_id: str
+    queries: List[str]
+    max_results: int = Field(5, ge=1, le=settings.RAG_MAX_RESULTS)
+    retrieval_mode: Optional[RetrievalMode] = None
+
+
+class BatchAnswerSchema(RAGResponseSchema):
+    """Ответ на один вопрос из пакета."""
+
+    query: str
+
+
+class BatchRAGResponseSchema(BaseModel):
+    """Схема для ответа на пакет вопросов (ответы в порядке вопросов)."""
+
+    answers: List[BatchAnswerSchema]
+    # Сколько вопросов взято из кэша, сколько групп и запросов к модели
+    stats: dict
+
+
+class MultiQuerySchema(BaseModel):
+    """Схема для вопроса сразу к нескольким корпусам."""
+
+    # Пусто — все корпуса (не больше RAG_MULTI_MAX_CORPORA)
+    corpus_ids: Optional[List[str]] = None
+    query: str
+    max_results: int = Field(5, ge=1, le=settings.RAG_MAX_RESULTS)
+    retrieval_mode: Optional[RetrievalMode] = None
+    # Общий дедлайн поиска по всем корпусам, секунд (по умолчанию RAG_MULTI_DEADLINE)
+    deadline: Optional[float] = None
+
+
+class ShardStatusSchema(BaseModel):
+    """Результат поиска в одном корпусе из multi-запроса."""
+
+    corpus_id: str
+    # ok, timeout (не успел к дедлайну) или error
+    status: str
+    hits: int = 0
+    took_ms: Optional[float] = None
+    error: Optional[str] = None
+
+
+class MultiRAGResponseSchema(RAGResponseSchema):
+    """Схема для ответа по нескольким корпусам."""
+
+    shards: List[ShardStatusSchema]
 
 
 class RelevantDocumentSchema(BaseModel):
@@ -53,4 +124,17 @@ class RelevantDocumentSchema(BaseModel):
     file_uri: str
     chunk_uri: str
     chunk: str
+    page: Optional[int] = None
     relevance_score: Optional[float] = None
+
+
+class RetrievalResultSchema(BaseModel):
+    """
+    Результат поиска по корпусу.
+    Считается один раз на запрос и передаётся в генерацию ответа.
+    """
+
+    corpus_id: str
+    query: str
+    retrieval_mode: str
+    documents: List[RelevantDocumentSchema] = []
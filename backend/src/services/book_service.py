@@ -1,10 +1,13 @@
+import logging
 from functools import lru_cache
-import shutil
 from typing import Optional
 from fastapi import UploadFile
 
 from schemas.book import BookSchema
 from config import settings
+from core.executors import run_blocking
+from core.files import save_stream
+from core.tracing import log_event
 
 
 class BookService:
@@ -26,8 +29,9 @@ class BookService:
 
         settings.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        size = await run_blocking(
+            save_stream, file.file, file_path, settings.MAX_UPLOAD_SIZE
+        )
 
         # Загружаем в RAG, если требуется
         rag_file_id = None
@@ -42,14 +46,23 @@ class BookService:
                         file_path=str(file_path),
                         display_name=file.filename,
                     )
-                    print(f"✅ Файл загружен в RAG корпус: {rag_file_id}")
+                    log_event(
+                        "Файл загружен в RAG корпус",
+                        corpus_id=actual_corpus_id,
+                        file_id=rag_file_id,
+                    )
             except Exception as e:
-                print(f"⚠️ Ошибка загрузки файла в RAG: {e}")
+                log_event(
+                    "Ошибка загрузки файла в RAG",
+                    logging.WARNING,
+                    filename=file.filename,
+                    error=str(e),
+                )
 
         return BookSchema(
             filename=file.filename,
             content_type=file.content_type,
-            size=file.size,
+            size=size,
             location=str(file_path),
         )
 
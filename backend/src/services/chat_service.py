@@ -1,13 +1,21 @@
+import logging
+import time
+from contextlib import aclosing
 from functools import lru_cache
-from typing import Optional, TYPE_CHECKING
+from typing import AsyncIterator, Optional, Tuple, TYPE_CHECKING
 
 from schemas.chat_prompt import PromptResponseSchema
 from clients.gemini_client import gemini_client
 from config import settings
+from core.answer_cache import AnswerCache, is_cacheable, make_cache_key
+from core.dispatcher import DispatcherError
+from core.metrics import CHAT_SECONDS
+from core.tracing import log_event, record_span, span
 
 if TYPE_CHECKING:
     from clients.gemini_client import GeminiClient
     from services.rag_service import RagService
+    from services.session_service import SessionService
 
 
 class ChatService:
@@ -20,6 +28,8 @@ class ChatService:
         self,
         gemini_client_instance: Optional["GeminiClient"] = None,
         rag_service_instance: Optional["RagService"] = None,
+        answer_cache_instance: Optional[AnswerCache] = None,
+        session_service_instance: Optional["SessionService"] = None,
     ):
         """
         Инициализация ChatService.
@@ -27,9 +37,13 @@ class ChatService:
         Args:
             gemini_client_instance: Экземпляр GeminiClient для генерации ответов
             rag_service_instance: Экземпляр RagService для RAG функциональности
+            answer_cache_instance: Кэш готовых ответов
+            session_service_instance: Сервис сессий чата (история разговора)
         """
         self._gemini_client_instance = gemini_client_instance
         self._rag_service_instance = rag_service_instance
+        self._answer_cache_instance = answer_cache_instance
+        self._session_service_instance = session_service_instance
 
     @property
     def gemini_client(self):
@@ -53,39 +67,110 @@ class ChatService:
         from services.rag_service import rag_service
         return rag_service
 
+    @property
+    def session_service(self) -> "SessionService":
+        """
+        Получает сервис сессий динамически.
+        """
+        if self._session_service_instance is not None:
+            return self._session_service_instance
+        from services.session_service import session_service
+        return session_service
+
+    @property
+    def answer_cache(self) -> Optional[AnswerCache]:
+        """
+        Кэш ответов или None, если он выключен в настройках.
+        RAG-ответы кэширует сам RagService.
+        """
+        if self._answer_cache_instance is not None:
+            return self._answer_cache_instance
+        if not settings.ANSWER_CACHE_ENABLED:
+            return None
+        from core.answer_cache import answer_cache
+        return answer_cache
+
+    @staticmethod
+    def _rag_corpus_id(corpus_id: Optional[str]) -> Optional[str]:
+        """
+        Возвращает корпус для RAG, если он включен и указан corpus_id
+        (или корпус по умолчанию из настроек). Иначе None.
+        """
+        if not settings.RAG_ENABLED:
+            return None
+        return corpus_id or settings.RAG_CORPUS_ID or None
+
+    @staticmethod
+    def _with_history(message: str, history: Optional[str]) -> str:
+        """
+        Промпт обычной генерации: в сессии перед сообщением идёт история.
+        """
+        if not history:
+            return message
+        return f"История разговора:\n{history}\n\nНовое сообщение пользователя: {message}"
+
+    async def _load_session(
+        self, session_id: Optional[str], corpus_id: Optional[str]
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        История сессии для промпта и корпус (из запроса или корпус сессии).
+        """
+        if not session_id:
+            return None, corpus_id
+        history, session_corpus_id = await self.session_service.load_history(session_id)
+        return history or None, corpus_id or session_corpus_id
+
+    async def _record_turn(self, session_id: Optional[str], message: str, reply: str) -> None:
+        if session_id and is_cacheable(reply):
+            await self.session_service.record_turn(session_id, message, reply)
+
     async def generate_response(
-        self, message: str, corpus_id: Optional[str] = None
+        self,
+        message: str,
+        corpus_id: Optional[str] = None,
+        session_id: Optional[str] = None,
     ) -> PromptResponseSchema:
         """
         Генерирует ответ на сообщение пользователя.
         Если указан corpus_id и RAG включен, использует RAG для генерации ответа.
+        Если указан session_id, модель видит историю разговора, а вопрос
+        и ответ сохраняются в сессию.
 
         Args:
             message: Сообщение от пользователя
             corpus_id: ID корпуса для RAG (опционально)
+            session_id: ID сессии чата (опционально)
 
         Returns:
             PromptResponseSchema: Ответ с сгенерированным текстом
         """
-        # Используем RAG, если он включен и указан corpus_id
-        use_rag = (
-            settings.RAG_ENABLED
-            and corpus_id is not None
-            or (corpus_id is None and settings.RAG_ENABLED and settings.RAG_CORPUS_ID)
-        )
-
-        if use_rag:
-            actual_corpus_id = corpus_id or settings.RAG_CORPUS_ID
+        started = time.perf_counter()
+        history, corpus_id = await self._load_session(session_id, corpus_id)
+        actual_corpus_id = self._rag_corpus_id(corpus_id)
+        if actual_corpus_id:
             try:
                 rag_response = await self.rag_service.generate_rag_response(
                     corpus_id=actual_corpus_id,
                     query=message,
                     model_name=settings.model_name,
-            )
-                return PromptResponseSchema(message=rag_response.message)
+                    history=history,
+                )
+                CHAT_SECONDS.observe(time.perf_counter() - started, "rag")
+                await self._record_turn(session_id, message, rag_response.message)
+                return PromptResponseSchema(
+                    message=rag_response.message, session_id=session_id
+                )
+            except DispatcherError:
+                # Модель перегружена — обычная генерация упрётся в ту же очередь
+                raise
             except Exception as e:
                 # Если RAG не сработал, fallback на обычную генерацию
-                print(f"⚠️ Ошибка RAG, используем обычную генерацию: {e}")
+                log_event(
+                    "Ошибка RAG, используем обычную генерацию",
+                    logging.WARNING,
+                    corpus_id=actual_corpus_id,
+                    error=str(e),
+                )
 
         # Обычная генерация без RAG
         client = self.gemini_client
@@ -94,8 +179,109 @@ class ChatService:
                 message="❌ Ошибка: Клиент Gemini не инициализирован."
             )
 
-        reply = client.generate_text(message)
-        return PromptResponseSchema(message=reply)
+        # Ответ в сессии зависит от истории — такие ответы не кэшируем
+        cache = None if history else self.answer_cache
+        cache_key = None
+        if cache is not None:
+            cache_key = make_cache_key(message, "", client.model_name, None)
+            cached = await cache.get(cache_key)
+            if cached is not None:
+                CHAT_SECONDS.observe(time.perf_counter() - started, "plain")
+                await self._record_turn(session_id, message, cached["message"])
+                return PromptResponseSchema(
+                    message=cached["message"], session_id=session_id
+                )
+
+        with span("generate"):
+            reply = await client.generate_text(self._with_history(message, history))
+        if cache_key is not None and is_cacheable(reply):
+            await cache.set(cache_key, {"message": reply})
+        CHAT_SECONDS.observe(time.perf_counter() - started, "plain")
+        await self._record_turn(session_id, message, reply)
+        return PromptResponseSchema(message=reply, session_id=session_id)
+
+    async def stream_response(
+        self,
+        message: str,
+        corpus_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        Потоковая версия generate_response.
+
+        Отдаёт события ("token", {"text": ...}) по мере генерации и в конце
+        ("done", {"message": ...}); для RAG в "done" есть и relevant_docs.
+        В сессии ход разговора сохраняется перед событием "done".
+        """
+        history, corpus_id = await self._load_session(session_id, corpus_id)
+        async for event, data in self._stream_events(message, corpus_id, history):
+            if event == "done":
+                await self._record_turn(session_id, message, data["message"])
+                if session_id:
+                    data = {**data, "session_id": session_id}
+            yield event, data
+
+    async def _stream_events(
+        self, message: str, corpus_id: Optional[str], history: Optional[str]
+    ) -> AsyncIterator[Tuple[str, dict]]:
+        actual_corpus_id = self._rag_corpus_id(corpus_id)
+        if actual_corpus_id:
+            # aclosing закрывает генератор RAG и при переходе на обычную
+            # генерацию, и когда клиент ушёл посреди потока
+            async with aclosing(
+                self.rag_service.stream_rag_response(
+                    corpus_id=actual_corpus_id,
+                    query=message,
+                    model_name=settings.model_name,
+                    history=history,
+                )
+            ) as events:
+                try:
+                    # Поиск выполняется до первого события — если он упал,
+                    # ещё не поздно переключиться на обычную генерацию
+                    first_event = await anext(events)
+                except DispatcherError:
+                    raise
+                except Exception as e:
+                    log_event(
+                        "Ошибка RAG, используем обычную генерацию",
+                        logging.WARNING,
+                        corpus_id=actual_corpus_id,
+                        error=str(e),
+                    )
+                else:
+                    yield first_event
+                    async for event in events:
+                        yield event
+                    return
+
+        client = self.gemini_client
+        if client is None:
+            text = "❌ Ошибка: Клиент Gemini не инициализирован."
+            yield "token", {"text": text}
+            yield "done", {"message": text}
+            return
+
+        cache = None if history else self.answer_cache
+        cache_key = None
+        if cache is not None:
+            cache_key = make_cache_key(message, "", client.model_name, None)
+            cached = await cache.get(cache_key)
+            if cached is not None:
+                yield "token", {"text": cached["message"]}
+                yield "done", {"message": cached["message"]}
+                return
+
+        parts = []
+        started = time.perf_counter()
+        async for text in client.stream_text(self._with_history(message, history)):
+            parts.append(text)
+            yield "token", {"text": text}
+        record_span("generate", started, stream=True)
+        reply = "".join(parts)
+        if cache_key is not None and is_cacheable(reply):
+            await cache.set(cache_key, {"message": reply})
+        yield "done", {"message": reply}
 
 
 @lru_cache()
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import List, Optional, Tuple, TYPE_CHECKING
+
+from config import settings
+from core.metrics import INGESTION_QUEUE_DEPTH
+from core.tracing import current_trace_id, log_event, traced
+from schemas.ingestion import IngestionFileSchema, IngestionJobSchema
+
+if TYPE_CHECKING:
+    from services.rag_service import RagService
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class IngestionService:
+    """
+    Фоновая очередь загрузки файлов в корпуса.
+
+    Запрос на загрузку только сохраняет файлы и ставит задачу в очередь;
+    копирование в корпус, извлечение текста, чанкинг и индексация
+    выполняются пулом воркеров, а прогресс доступен по job_id.
+
+    Задачи хранятся только в памяти процесса: после перезапуска
+    незавершённые задачи теряются, а их job_id отвечает 404.
+    """
+
+    def __init__(
+        self,
+        rag_service_instance: Optional["RagService"] = None,
+        workers: Optional[int] = None,
+        max_jobs: Optional[int] = None,
+    ):
+        """
+        Инициализация IngestionService.
+
+        Args:
+            rag_service_instance: Экземпляр RagService для загрузки в корпус
+            workers: Количество воркеров (по умолчанию settings.INGESTION_WORKERS)
+            max_jobs: Сколько задач хранить в памяти для просмотра статуса
+        """
+        self._rag_service_instance = rag_service_instance
+        self._workers_count = workers or settings.INGESTION_WORKERS
+        self._max_jobs = max_jobs or settings.INGESTION_MAX_JOBS
+        self._jobs: "OrderedDict[str, IngestionJobSchema]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def rag_service(self):
+        """
+        Получает RAG сервис динамически.
+        """
+        if self._rag_service_instance is not None:
+            return self._rag_service_instance
+        from services.rag_service import rag_service
+        return rag_service
+
+    def start(self) -> None:
+        """
+        Запускает воркеры в текущем event loop (если они ещё не запущены
+        или все завершились).
+        """
+        if self._workers and not all(w.done() for w in self._workers):
+            return
+        self._queue = asyncio.Queue()
+        INGESTION_QUEUE_DEPTH.set_function(self._queue.qsize)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"ingestion-{i}")
+            for i in range(self._workers_count)
+        ]
+        # Воркеры этого же процесса остановлены (stop) или упали — файлы,
+        # которые они не успели обработать, ставим в новую очередь заново
+        for job in self._jobs.values():
+            for index, file in enumerate(job.files):
+                if file.status in ("queued", "processing"):
+                    file.status = "queued"
+                    self._queue.put_nowait((job.job_id, index))
+
+    async def stop(self) -> None:
+        """
+        Останавливает воркеры (вызывается при завершении приложения).
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    async def submit(self, corpus_id: str, files: List[dict]) -> IngestionJobSchema:
+        """
+        Создаёт задачу загрузки и сразу возвращает её, не дожидаясь обработки.
+
+        Args:
+            corpus_id: ID корпуса
+            files: Список {"filename": ..., "location": ...} уже сохранённых файлов
+
+        Returns:
+            IngestionJobSchema: Задача со статусом queued
+        """
+        self.start()
+        job = IngestionJobSchema(
+            job_id=uuid.uuid4().hex,
+            corpus_id=corpus_id,
+            total=len(files),
+            files=[
+                IngestionFileSchema(filename=f["filename"], location=f["location"])
+                for f in files
+            ],
+            created_at=_now(),
+            trace_id=current_trace_id(),
+        )
+        self._remember(job)
+        for index in range(len(job.files)):
+            self._queue.put_nowait((job.job_id, index))
+        return job
+
+    def get_job(self, job_id: str) -> Optional[IngestionJobSchema]:
+        """
+        Возвращает задачу по ID или None, если она неизвестна.
+        """
+        return self._jobs.get(job_id)
+
+    def _remember(self, job: IngestionJobSchema) -> None:
+        self._jobs[job.job_id] = job
+        # Забываем самые старые завершённые задачи, чтобы память не росла
+        while len(self._jobs) > self._max_jobs:
+            oldest = next(
+                (
+                    job_id
+                    for job_id, j in self._jobs.items()
+                    if j.status in ("completed", "failed")
+                ),
+                None,
+            )
+            if oldest is None:
+                break
+            del self._jobs[oldest]
+
+    async def _worker(self) -> None:
+        while True:
+            item: Tuple[str, int] = await self._queue.get()
+            try:
+                await self._process(*item)
+            except Exception as e:
+                log_event("Ошибка воркера загрузки", logging.ERROR, error=str(e))
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job_id: str, index: int) -> None:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        file = job.files[index]
+        file.status = "processing"
+        if job.status == "queued":
+            job.status = "running"
+
+        # Фоновая обработка пишется в лог под trace_id запроса загрузки
+        with traced(
+            "ingest", job.trace_id, job_id=job_id, corpus_id=job.corpus_id, file=file.filename
+        ):
+            try:
+                file.file_id = await self.rag_service.upload_file_to_corpus(
+                    corpus_id=job.corpus_id,
+                    file_path=file.location,
+                    display_name=file.filename,
+                )
+                file.status = "done"
+            except Exception as e:
+                file.status = "error"
+                file.error = str(e)
+                log_event(
+                    "Ошибка загрузки файла в RAG",
+                    logging.ERROR,
+                    filename=file.filename,
+                    error=str(e),
+                )
+            else:
+                # Содержимое уже в хранилище блобов, временная копия не нужна
+                self._discard_upload(file.location)
+
+        job.processed += 1
+        if job.processed == job.total:
+            failed = all(f.status == "error" for f in job.files)
+            job.status = "failed" if failed else "completed"
+            job.finished_at = _now()
+
+    @staticmethod
+    def _discard_upload(location: str) -> None:
+        path = Path(location)
+        path.unlink(missing_ok=True)
+        try:
+            # Директория загрузки удаляется вместе с последним её файлом
+            path.parent.rmdir()
+        except OSError:
+            pass
+
+
+@lru_cache()
+def get_ingestion_service() -> IngestionService:
+    """
+    Фабричная функция для создания экземпляра IngestionService.
+    Использует lru_cache для singleton паттерна.
+    """
+    return IngestionService()
+
+
+ingestion_service = get_ingestion_service()
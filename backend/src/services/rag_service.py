@@ -1,16 +1,34 @@
+import asyncio
+import time
 from functools import lru_cache
-from typing import Optional, List, TYPE_CHECKING
+from typing import AsyncIterator, Dict, Optional, List, Tuple, TYPE_CHECKING
 from pathlib import Path
 
 from config import settings
+from core.answer_cache import AnswerCache, is_cacheable, make_cache_key
+from core.dispatcher import DispatcherError, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from core.executors import run_blocking
+from core.metrics import PROMPT_BUILD_SECONDS, PROMPT_TOKENS
+from core.single_flight import SingleFlight
+from core.tracing import record_span, span
+from rag.context import (
+    assemble_context,
+    context_budget,
+    estimate_tokens,
+    group_by_shared_context,
+)
 from schemas.rag import (
+    BatchAnswerSchema,
     CorpusSchema,
     CorpusCreateSchema,
     FileUploadSchema,
     FileInfoSchema,
+    MultiRAGResponseSchema,
     QuerySchema,
     RAGResponseSchema,
     RelevantDocumentSchema,
+    RetrievalResultSchema,
+    ShardStatusSchema,
 )
 
 if TYPE_CHECKING:
@@ -21,16 +39,27 @@ class RagService:
     """
     Сервис для работы с RAG системой.
     Отвечает за бизнес-логику работы с корпусами документов и генерацией ответов.
+
+    Методы клиента, которые трогают диск или парсят файлы, вызываются
+    через run_blocking, чтобы не останавливать event loop.
     """
 
-    def __init__(self, rag_client_instance: Optional["GeminiRagClient"] = None):
+    def __init__(
+        self,
+        rag_client_instance: Optional["GeminiRagClient"] = None,
+        answer_cache_instance: Optional[AnswerCache] = None,
+    ):
         """
         Инициализация RagService.
 
         Args:
             rag_client_instance: Экземпляр GeminiRagClient для работы с RAG API
+            answer_cache_instance: Кэш готовых ответов
         """
         self._rag_client_instance = rag_client_instance
+        self._answer_cache_instance = answer_cache_instance
+        # Одинаковые одновременные вопросы к корпусу выполняются один раз
+        self.single_flight = SingleFlight()
 
     @property
     def rag_client(self) -> "GeminiRagClient":
@@ -45,6 +74,84 @@ class RagService:
             raise RuntimeError("RAG клиент не инициализирован")
         return gemini_rag_client
 
+    @property
+    def answer_cache(self) -> Optional[AnswerCache]:
+        """
+        Кэш ответов или None, если он выключен в настройках.
+        """
+        if self._answer_cache_instance is not None:
+            return self._answer_cache_instance
+        if not settings.ANSWER_CACHE_ENABLED:
+            return None
+        from core.answer_cache import answer_cache
+        return answer_cache
+
+    async def _answer_key(
+        self,
+        corpus_id: str,
+        query: str,
+        model_name: str,
+        max_results: int,
+        retrieval_mode: Optional[str],
+    ) -> str:
+        """
+        Ключ кэша ответа; версия содержимого корпуса входит в ключ,
+        поэтому после изменения файлов старые ответы не находятся.
+        """
+        version = await run_blocking(self.rag_client.corpus_version, corpus_id)
+        return self._versioned_answer_key(
+            corpus_id, version, query, model_name, max_results, retrieval_mode
+        )
+
+    @staticmethod
+    def _versioned_answer_key(
+        corpus_id: str,
+        version: str,
+        query: str,
+        model_name: str,
+        max_results: int,
+        retrieval_mode: Optional[str],
+    ) -> str:
+        return make_cache_key(
+            query,
+            f"{corpus_id}@{version}",
+            model_name,
+            settings.SYSTEM_PROMPT,
+            max_results=max_results,
+            retrieval_mode=retrieval_mode or settings.RAG_RETRIEVAL_MODE,
+        )
+
+    def _assemble_context(
+        self,
+        query: str,
+        relevant_docs: List[dict],
+        model_name: str,
+        prompt_without_context: Optional[str] = None,
+        history: Optional[str] = None,
+    ) -> Tuple[List[dict], dict]:
+        """
+        Отбирает найденные чанки в пределах бюджета токенов модели;
+        системный промпт и вопрос (или все вопросы группы,
+        `prompt_without_context`) вычитаются из бюджета заранее.
+        """
+        started = time.perf_counter()
+        with span("assemble"):
+            if prompt_without_context is None:
+                prompt_without_context = self.rag_client.build_rag_prompt(
+                    query, [], settings.SYSTEM_PROMPT, history
+                )
+            reserved = estimate_tokens(prompt_without_context)
+            docs, report = assemble_context(
+                relevant_docs, context_budget(model_name), reserved
+            )
+        PROMPT_BUILD_SECONDS.observe(time.perf_counter() - started)
+        PROMPT_TOKENS.observe(report["prompt_tokens"])
+        return docs, report
+
+    async def _invalidate_answers(self, corpus_id: str) -> None:
+        if self.answer_cache is not None:
+            await self.answer_cache.invalidate_corpus(corpus_id)
+
     async def create_corpus(self, display_name: str) -> CorpusSchema:
         """
         Создает новый корпус для хранения документов.
@@ -55,28 +162,37 @@ class RagService:
         Returns:
             CorpusSchema: Созданный корпус
         """
-        corpus_id = self.rag_client.create_corpus(display_name)
-        return CorpusSchema(
-            name=corpus_id,
-            display_name=display_name,
-        )
+        corpus_id = await run_blocking(self.rag_client.create_corpus, display_name)
+        corpus = await run_blocking(self.rag_client.get_corpus, corpus_id)
+        if corpus is None:
+            return CorpusSchema(name=corpus_id, display_name=display_name)
+        return CorpusSchema(**corpus)
 
-    async def list_corpora(self) -> List[CorpusSchema]:
+    async def list_corpora(
+        self,
+        limit: int = 100,
+        offset: int = 0,
+        query: Optional[str] = None,
+        sort: str = "created",
+        descending: bool = False,
+    ) -> Tuple[List[CorpusSchema], int]:
         """
-        Получает список всех корпусов.
+        Получает страницу корпусов из каталога.
+
+        Args:
+            limit: Размер страницы
+            offset: Сколько корпусов пропустить
+            query: Подстрока в имени или ID корпуса
+            sort: Поле сортировки (name, created, updated, size, files)
+            descending: Сортировка по убыванию
 
         Returns:
-            List[CorpusSchema]: Список корпусов
+            Tuple[List[CorpusSchema], int]: Корпуса страницы и общее число под фильтром
         """
-        corpora_data = self.rag_client.list_corpora()
-        return [
-            CorpusSchema(
-                name=corpus["name"],
-                display_name=corpus["display_name"],
-                create_time=corpus.get("create_time"),
-            )
-            for corpus in corpora_data
-        ]
+        corpora_data, total = await run_blocking(
+            self.rag_client.list_corpora, limit, offset, query, sort, descending
+        )
+        return [CorpusSchema(**corpus) for corpus in corpora_data], total
 
     async def upload_file_to_corpus(
         self, corpus_id: str, file_path: str, display_name: Optional[str] = None
@@ -96,41 +212,115 @@ class RagService:
         if not file_path_obj.exists():
             raise FileNotFoundError(f"Файл не найден: {file_path}")
 
-        file_id = self.rag_client.upload_file_to_corpus(
+        file_id = await run_blocking(
+            self.rag_client.upload_file_to_corpus,
             corpus_id=corpus_id,
             file_path=str(file_path_obj),
             display_name=display_name or file_path_obj.name,
         )
+        await self._invalidate_answers(corpus_id)
         return file_id
 
-    async def list_files(self, corpus_id: str) -> List[FileInfoSchema]:
+    async def list_files(
+        self,
+        corpus_id: str,
+        limit: int = 100,
+        offset: int = 0,
+        query: Optional[str] = None,
+        status: Optional[str] = None,
+        sort: str = "name",
+        descending: bool = False,
+    ) -> Tuple[List[FileInfoSchema], int]:
         """
-        Возвращает список файлов в корпусе.
+        Возвращает страницу файлов корпуса и их общее число под фильтром.
+        Если корпуса нет, выбрасывает CorpusNotFoundError.
         """
-        files_data = self.rag_client.list_files(corpus_id)
-        return [
-            FileInfoSchema(
-                corpus_id=f["corpus_id"],
-                filename=f["filename"],
-                size=f["size"],
-            )
-            for f in files_data
-        ]
+        files_data, total = await run_blocking(
+            self.rag_client.list_files,
+            corpus_id,
+            limit,
+            offset,
+            query,
+            status,
+            sort,
+            descending,
+        )
+        return [FileInfoSchema(**f) for f in files_data], total
+
+    async def rescan_catalog(self) -> dict:
+        """
+        Сверяет каталог корпусов с диском (после ручных правок или сбоев).
+        """
+        return await run_blocking(self.rag_client.rescan_catalog)
 
     async def delete_file(self, corpus_id: str, filename: str) -> bool:
         """
         Удаляет файл из корпуса.
         """
-        return self.rag_client.delete_file(corpus_id, filename)
+        deleted = await run_blocking(self.rag_client.delete_file, corpus_id, filename)
+        await self._invalidate_answers(corpus_id)
+        return deleted
 
     async def delete_corpus(self, corpus_id: str) -> bool:
         """
         Удаляет корпус и все его файлы.
         """
-        return self.rag_client.delete_corpus(corpus_id)
+        deleted = await run_blocking(self.rag_client.delete_corpus, corpus_id)
+        await self._invalidate_answers(corpus_id)
+        return deleted
+
+    async def retrieve(
+        self,
+        corpus_id: str,
+        query: str,
+        max_results: int = 5,
+        retrieval_mode: Optional[str] = None,
+    ) -> RetrievalResultSchema:
+        """
+        Выполняет поиск в корпусе и возвращает результат целиком,
+        чтобы его можно было передать в генерацию без повторного поиска.
+
+        Args:
+            corpus_id: ID корпуса
+            query: Поисковый запрос
+            max_results: Максимальное количество результатов
+            retrieval_mode: Режим поиска (bm25, dense, hybrid, fts);
+                по умолчанию settings.RAG_RETRIEVAL_MODE
+
+        Returns:
+            RetrievalResultSchema: Найденные документы и параметры поиска
+        """
+        retrieval_mode = retrieval_mode or settings.RAG_RETRIEVAL_MODE
+        with span("retrieve", mode=retrieval_mode):
+            results = await run_blocking(
+                self.rag_client.query_corpus,
+                corpus_id=corpus_id,
+                query=query,
+                max_results=max_results,
+                retrieval_mode=retrieval_mode,
+            )
+        return RetrievalResultSchema(
+            corpus_id=corpus_id,
+            query=query,
+            retrieval_mode=retrieval_mode,
+            documents=[
+                RelevantDocumentSchema(
+                    file_uri=doc["file_uri"],
+                    chunk_uri=doc["chunk_uri"],
+                    chunk=doc["chunk"],
+                    page=doc.get("page"),
+                    relevance_score=doc.get("relevance_score"),
+                )
+                for doc in results
+            ],
+        )
 
     async def query_corpus(
-        self, corpus_id: str, query: str, max_results: int = 5
+        self,
+        corpus_id: str,
+        query: str,
+        max_results: int = 5,
+        retrieval_mode: Optional[str] = None,
     ) -> List[RelevantDocumentSchema]:
         """
         Выполняет поиск релевантных документов в корпусе.
@@ -139,22 +329,13 @@ class RagService:
             corpus_id: ID корпуса
             query: Поисковый запрос
             max_results: Максимальное количество результатов
+            retrieval_mode: Режим поиска (bm25, dense, hybrid, fts)
 
         Returns:
             List[RelevantDocumentSchema]: Список релевантных документов
         """
-        results = self.rag_client.query_corpus(
-            corpus_id=corpus_id, query=query, max_results=max_results
-        )
-        return [
-            RelevantDocumentSchema(
-                file_uri=doc["file_uri"],
-                chunk_uri=doc["chunk_uri"],
-                chunk=doc["chunk"],
-                relevance_score=doc.get("relevance_score"),
-            )
-            for doc in results
-        ]
+        retrieval = await self.retrieve(corpus_id, query, max_results, retrieval_mode)
+        return retrieval.documents
 
     async def generate_rag_response(
         self,
@@ -162,43 +343,486 @@ class RagService:
         query: str,
         model_name: str = "gemini-2.0-flash-exp",
         max_results: int = 5,
+        retrieval_mode: Optional[str] = None,
+        history: Optional[str] = None,
     ) -> RAGResponseSchema:
         """
         Генерирует ответ на основе релевантных документов из корпуса.
+        Поиск выполняется ровно один раз, его результат идёт и в промпт,
+        и в relevant_docs ответа. Повторный вопрос к неизменённому корпусу
+        отдаётся из кэша ответов без поиска и обращения к модели, а
+        одинаковые вопросы, заданные одновременно, ждут один общий ответ.
+        Ответы с историей разговора зависят от сессии и не кэшируются.
 
         Args:
             corpus_id: ID корпуса
             query: Запрос пользователя
             model_name: Название модели
             max_results: Максимальное количество релевантных документов
+            retrieval_mode: Режим поиска (bm25, dense, hybrid, fts)
+            history: История разговора сессии чата
 
         Returns:
             RAGResponseSchema: Ответ с релевантными документами
         """
+        if history:
+            result = await self._generate_rag_answer(
+                corpus_id, query, model_name, max_results, retrieval_mode, None, history
+            )
+            return RAGResponseSchema(**result)
+
+        with span("cache"):
+            cache_key = await self._answer_key(
+                corpus_id, query, model_name, max_results, retrieval_mode
+            )
+            cache = self.answer_cache
+            cached = await cache.get(cache_key) if cache is not None else None
+        if cached is not None:
+            return RAGResponseSchema(**cached)
+
+        result = await self.single_flight.do(
+            cache_key,
+            lambda: self._generate_rag_answer(
+                corpus_id, query, model_name, max_results, retrieval_mode, cache_key
+            ),
+        )
+        return RAGResponseSchema(**result)
+
+    async def _generate_rag_answer(
+        self,
+        corpus_id: str,
+        query: str,
+        model_name: str,
+        max_results: int,
+        retrieval_mode: Optional[str],
+        cache_key: Optional[str],
+        history: Optional[str] = None,
+    ) -> dict:
+        """
+        Поиск и генерация для generate_rag_response; результат кладётся в кэш.
+        """
         # Получаем релевантные документы
-        relevant_docs = await self.query_corpus(corpus_id, query, max_results)
+        retrieval = await self.retrieve(corpus_id, query, max_results, retrieval_mode)
+        return await self._answer_from_documents(
+            corpus_id,
+            query,
+            [doc.model_dump() for doc in retrieval.documents],
+            model_name,
+            cache_key,
+            history=history,
+        )
 
-        # Генерируем ответ
-        response_text = self.rag_client.generate_rag_response(
+    async def _answer_from_documents(
+        self,
+        corpus_id: str,
+        query: str,
+        documents: List[dict],
+        model_name: str,
+        cache_key: Optional[str],
+        priority: int = PRIORITY_INTERACTIVE,
+        history: Optional[str] = None,
+    ) -> dict:
+        """
+        Сборка контекста и генерация по уже найденным чанкам;
+        результат кладётся в кэш (если передан cache_key).
+        """
+        relevant_docs, context = self._assemble_context(
+            query, documents, model_name, history=history
+        )
+
+        # Генерируем ответ по уже найденным документам
+        with span("generate"):
+            response_text = await self.rag_client.generate_from_documents(
+                query=query,
+                relevant_docs=relevant_docs,
+                model_name=model_name,
+                system_prompt=settings.SYSTEM_PROMPT,
+                priority=priority,
+                history=history,
+            )
+
+        result = {
+            "message": response_text,
+            "relevant_docs": relevant_docs,
+            "context": context,
+        }
+        cache = self.answer_cache
+        if cache is not None and cache_key is not None and is_cacheable(response_text):
+            await cache.set(cache_key, result, corpus_id=corpus_id)
+        return result
+
+    async def _resolve_corpora(self, corpus_ids: Optional[List[str]]) -> List[str]:
+        """
+        Корпуса для multi-запроса: переданные (без повторов) или все.
+        Выбрасывает ValueError, если их больше RAG_MULTI_MAX_CORPORA.
+        """
+        limit = settings.RAG_MULTI_MAX_CORPORA
+        if corpus_ids:
+            corpus_ids = list(dict.fromkeys(corpus_ids))
+        else:
+            corpora, _ = await run_blocking(self.rag_client.list_corpora, limit + 1)
+            corpus_ids = [corpus["name"] for corpus in corpora]
+        if len(corpus_ids) > limit:
+            raise ValueError(f"Не больше {limit} корпусов в одном запросе, укажите corpus_ids")
+        return corpus_ids
+
+    async def _retrieve_shard(
+        self, corpus_id: str, query: str, max_results: int, retrieval_mode: str
+    ) -> Tuple[List[dict], float]:
+        started = time.perf_counter()
+        docs = await run_blocking(
+            self.rag_client.query_corpus,
             corpus_id=corpus_id,
             query=query,
-            model_name=model_name,
             max_results=max_results,
-            system_prompt=settings.SYSTEM_PROMPT,
+            retrieval_mode=retrieval_mode,
         )
+        return docs, (time.perf_counter() - started) * 1000
 
-        return RAGResponseSchema(
-            message=response_text,
-            relevant_docs=[
-                {
-                    "file_uri": doc.file_uri,
-                    "chunk_uri": doc.chunk_uri,
-                    "chunk": doc.chunk,
-                    "relevance_score": doc.relevance_score,
-                }
-                for doc in relevant_docs
-            ],
+    async def retrieve_many(
+        self,
+        corpus_ids: List[str],
+        query: str,
+        max_results: int = 5,
+        retrieval_mode: Optional[str] = None,
+        deadline: Optional[float] = None,
+    ) -> Tuple[List[RelevantDocumentSchema], List[ShardStatusSchema]]:
+        """
+        Ищет во всех корпусах одновременно и сливает результаты
+        в общий top-k (см. GeminiRagClient.merge_corpus_results).
+
+        Корпуса, не ответившие за `deadline` секунд, и корпуса с ошибкой
+        пропускаются: ответ строится по тем, что успели, а их статус
+        возвращается в списке шардов.
+        """
+        retrieval_mode = retrieval_mode or settings.RAG_RETRIEVAL_MODE
+        # Иначе ошибка режима стала бы ошибкой каждого шарда, а не запроса
+        self.rag_client.check_retrieval_mode(retrieval_mode)
+        with span("retrieve", mode=retrieval_mode, corpora=len(corpus_ids)):
+            tasks = {
+                corpus_id: asyncio.create_task(
+                    self._retrieve_shard(corpus_id, query, max_results, retrieval_mode)
+                )
+                for corpus_id in corpus_ids
+            }
+            pending = set()
+            if tasks:
+                _, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+            for task in pending:
+                # Поиск в потоке доработает, но его результат уже не нужен
+                task.cancel()
+
+        results: List[List[dict]] = []
+        shards: List[ShardStatusSchema] = []
+        for corpus_id, task in tasks.items():
+            if task in pending:
+                shards.append(ShardStatusSchema(corpus_id=corpus_id, status="timeout"))
+                continue
+            try:
+                docs, took_ms = task.result()
+            except Exception as e:
+                shards.append(
+                    ShardStatusSchema(corpus_id=corpus_id, status="error", error=str(e))
+                )
+                continue
+            results.append(docs)
+            shards.append(
+                ShardStatusSchema(
+                    corpus_id=corpus_id,
+                    status="ok",
+                    hits=len(docs),
+                    took_ms=round(took_ms, 2),
+                )
+            )
+
+        merged = self.rag_client.merge_corpus_results(results, max_results, retrieval_mode)
+        return [RelevantDocumentSchema(**doc) for doc in merged], shards
+
+    async def generate_rag_multi(
+        self,
+        query: str,
+        corpus_ids: Optional[List[str]] = None,
+        model_name: str = "gemini-2.0-flash-exp",
+        max_results: int = 5,
+        retrieval_mode: Optional[str] = None,
+        deadline: Optional[float] = None,
+    ) -> MultiRAGResponseSchema:
+        """
+        Отвечает на вопрос по нескольким корпусам (по умолчанию — по всем).
+
+        Поиск идёт параллельно во всех корпусах с общим дедлайном,
+        найденные чанки сливаются в один top-k и идут в один промпт.
+        Полный ответ (все корпуса успели) кэшируется с версиями всех
+        корпусов в ключе; частичный — нет.
+
+        Args:
+            query: Запрос пользователя
+            corpus_ids: ID корпусов; пусто — все корпуса
+            model_name: Название модели
+            max_results: Сколько чанков взять из всех корпусов вместе
+            retrieval_mode: Режим поиска (bm25, dense, hybrid, fts)
+            deadline: Дедлайн поиска, секунд (по умолчанию RAG_MULTI_DEADLINE)
+
+        Returns:
+            MultiRAGResponseSchema: Ответ, relevant_docs и статус каждого корпуса
+        """
+        corpus_ids = await self._resolve_corpora(corpus_ids)
+        if deadline is None:
+            deadline = settings.RAG_MULTI_DEADLINE or None
+
+        cache = self.answer_cache
+        with span("cache"):
+            versions = await run_blocking(
+                lambda: [self.rag_client.corpus_version(c) for c in corpus_ids]
+            )
+            cache_key = make_cache_key(
+                query,
+                "multi:" + ",".join(sorted(f"{c}@{v}" for c, v in zip(corpus_ids, versions))),
+                model_name,
+                settings.SYSTEM_PROMPT,
+                max_results=max_results,
+                retrieval_mode=retrieval_mode or settings.RAG_RETRIEVAL_MODE,
+            )
+            cached = await cache.get(cache_key) if cache is not None else None
+        if cached is not None:
+            return MultiRAGResponseSchema(**cached)
+
+        documents, shards = await self.retrieve_many(
+            corpus_ids, query, max_results, retrieval_mode, deadline
         )
+        result = await self._answer_from_documents(
+            "", query, [doc.model_dump() for doc in documents], model_name, None
+        )
+        result["shards"] = [shard.model_dump() for shard in shards]
+        complete = all(shard.status == "ok" for shard in shards)
+        if cache is not None and complete and is_cacheable(result["message"]):
+            await cache.set(cache_key, result)
+        return MultiRAGResponseSchema(**result)
+
+    async def generate_rag_batch(
+        self,
+        corpus_id: str,
+        queries: List[str],
+        model_name: str = "gemini-2.0-flash-exp",
+        max_results: int = 5,
+        retrieval_mode: Optional[str] = None,
+    ) -> Tuple[List[BatchAnswerSchema], dict]:
+        """
+        Отвечает на список вопросов к одному корпусу.
+
+        - ответы из кэша и повторы вопросов внутри пакета не генерируются заново;
+        - индекс корпуса загружается один раз, поиск по всем вопросам —
+          один проход (query_corpus_batch);
+        - вопросы с общим контекстом, который целиком влезает в бюджет,
+          задаются модели одним запросом; если модель ответила не в том
+          формате, вопросы группы задаются по одному;
+        - запросы к модели идут с приоритетом PRIORITY_BATCH, не больше
+          RAG_BATCH_CONCURRENCY одновременно.
+
+        Args:
+            corpus_id: ID корпуса
+            queries: Вопросы пользователя
+            model_name: Название модели
+            max_results: Максимальное количество релевантных документов на вопрос
+            retrieval_mode: Режим поиска (bm25, dense, hybrid, fts)
+
+        Returns:
+            Tuple[List[BatchAnswerSchema], dict]: Ответы в порядке вопросов и статистика
+        """
+        retrieval_mode = retrieval_mode or settings.RAG_RETRIEVAL_MODE
+        answers: Dict[str, dict] = {}
+        with span("cache"):
+            version = await run_blocking(self.rag_client.corpus_version, corpus_id)
+            keys = [
+                self._versioned_answer_key(
+                    corpus_id, version, query, model_name, max_results, retrieval_mode
+                )
+                for query in queries
+            ]
+            unique: Dict[str, str] = {}
+            for key, query in zip(keys, queries):
+                unique.setdefault(key, query)
+            cache = self.answer_cache
+            if cache is not None:
+                for key in unique:
+                    cached = await cache.get(key)
+                    if cached is not None:
+                        answers[key] = cached
+        stats = {
+            "questions": len(queries),
+            "unique": len(unique),
+            "cached": len(answers),
+            "groups": 0,
+            "llm_calls": 0,
+        }
+
+        pending = [(key, query) for key, query in unique.items() if key not in answers]
+        if pending:
+            with span("retrieve", mode=retrieval_mode, questions=len(pending)):
+                retrievals = await run_blocking(
+                    self.rag_client.query_corpus_batch,
+                    corpus_id=corpus_id,
+                    queries=[query for _, query in pending],
+                    max_results=max_results,
+                    retrieval_mode=retrieval_mode,
+                )
+            base = estimate_tokens(
+                self.rag_client.build_batch_rag_prompt([], [], settings.SYSTEM_PROMPT)
+            )
+            groups = group_by_shared_context(
+                retrievals,
+                context_budget(model_name) - base,
+                [estimate_tokens(f"[{len(pending)}] {query}") + 1 for _, query in pending],
+                max_group_size=settings.RAG_BATCH_GROUP_SIZE,
+                min_overlap=settings.RAG_BATCH_GROUP_OVERLAP,
+            )
+            stats["groups"] = len(groups)
+            semaphore = asyncio.Semaphore(settings.RAG_BATCH_CONCURRENCY)
+
+            async def answer_group(members: List[int]) -> None:
+                async with semaphore:
+                    results, calls = await self._answer_group(
+                        corpus_id,
+                        [pending[i] for i in members],
+                        [retrievals[i] for i in members],
+                        model_name,
+                    )
+                answers.update(results)
+                stats["llm_calls"] += calls
+
+            with span("generate", groups=len(groups)):
+                await asyncio.gather(*(answer_group(members) for members in groups))
+
+        return [
+            BatchAnswerSchema(query=query, **answers[key])
+            for key, query in zip(keys, queries)
+        ], stats
+
+    async def _answer_group(
+        self,
+        corpus_id: str,
+        items: List[Tuple[str, str]],
+        retrievals: List[List[dict]],
+        model_name: str,
+    ) -> Tuple[Dict[str, dict], int]:
+        """
+        Ответы на группу вопросов (ключ кэша, вопрос) с общим контекстом.
+        Возвращает ответы по ключам и число запросов к модели.
+        """
+        cache = self.answer_cache
+        if len(items) > 1:
+            queries = [query for _, query in items]
+            union: Dict[str, dict] = {}
+            for docs in retrievals:
+                for doc in docs:
+                    union.setdefault(doc["chunk_uri"], doc)
+            relevant_docs, context = self._assemble_context(
+                queries[0],
+                list(union.values()),
+                model_name,
+                self.rag_client.build_batch_rag_prompt(queries, [], settings.SYSTEM_PROMPT),
+            )
+            try:
+                texts = await self.rag_client.generate_batch_from_documents(
+                    queries=queries,
+                    relevant_docs=relevant_docs,
+                    model_name=model_name,
+                    system_prompt=settings.SYSTEM_PROMPT,
+                    priority=PRIORITY_BATCH,
+                )
+            except DispatcherError as e:
+                return {key: {"message": f"❌ {e}"} for key, _ in items}, 1
+            if texts is not None:
+                results = {}
+                for (key, _), docs, text in zip(items, retrievals, texts):
+                    own = {doc["chunk_uri"] for doc in docs}
+                    result = {
+                        "message": text,
+                        "relevant_docs": [d for d in relevant_docs if d["chunk_uri"] in own],
+                        "context": {**context, "batch_size": len(items)},
+                    }
+                    if cache is not None and is_cacheable(text):
+                        await cache.set(key, result, corpus_id=corpus_id)
+                    results[key] = result
+                return results, 1
+            calls = 1
+        else:
+            calls = 0
+
+        async def answer_one(key: str, query: str, docs: List[dict]) -> dict:
+            try:
+                return await self.single_flight.do(
+                    key,
+                    lambda: self._answer_from_documents(
+                        corpus_id, query, docs, model_name, key, PRIORITY_BATCH
+                    ),
+                )
+            except DispatcherError as e:
+                return {"message": f"❌ {e}"}
+
+        answered = await asyncio.gather(
+            *(answer_one(key, query, docs) for (key, query), docs in zip(items, retrievals))
+        )
+        return {key: result for (key, _), result in zip(items, answered)}, calls + len(items)
+
+    async def stream_rag_response(
+        self,
+        corpus_id: str,
+        query: str,
+        model_name: str = "gemini-2.0-flash-exp",
+        max_results: int = 5,
+        retrieval_mode: Optional[str] = None,
+        history: Optional[str] = None,
+    ) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        Потоковая версия generate_rag_response.
+
+        Отдаёт события ("token", {"text": ...}) по мере генерации и в конце
+        ("done", {"message": ..., "relevant_docs": [...], "context": {...}}).
+        Ошибка поиска пробрасывается до первого события.
+        Ответ из кэша отдаётся одним событием "token".
+        """
+        cache = None if history else self.answer_cache
+        cache_key = None
+        if cache is not None:
+            cache_key = await self._answer_key(
+                corpus_id, query, model_name, max_results, retrieval_mode
+            )
+            cached = await cache.get(cache_key)
+            if cached is not None:
+                yield "token", {"text": cached["message"]}
+                yield "done", cached
+                return
+
+        retrieval = await self.retrieve(corpus_id, query, max_results, retrieval_mode)
+        relevant_docs, context = self._assemble_context(
+            query,
+            [doc.model_dump() for doc in retrieval.documents],
+            model_name,
+            history=history,
+        )
+
+        parts: List[str] = []
+        started = time.perf_counter()
+        async for text in self.rag_client.stream_from_documents(
+            query=query,
+            relevant_docs=relevant_docs,
+            model_name=model_name,
+            system_prompt=settings.SYSTEM_PROMPT,
+            history=history,
+        ):
+            parts.append(text)
+            yield "token", {"text": text}
+        record_span("generate", started, stream=True)
+
+        result = {
+            "message": "".join(parts),
+            "relevant_docs": relevant_docs,
+            "context": context,
+        }
+        if cache_key is not None and is_cacheable(result["message"]):
+            await cache.set(cache_key, result, corpus_id=corpus_id)
+        yield "done", result
 
 
 @lru_cache()
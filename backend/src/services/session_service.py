@@ -0,0 +1,261 @@
+import asyncio
+import logging
+from functools import lru_cache
+from typing import List, Optional, Set, Tuple, TYPE_CHECKING
+
+from config import settings
+from core.dispatcher import PRIORITY_BACKGROUND
+from core.session_store import SessionStore
+from core.tracing import current_trace_id, log_event, traced
+from rag.context import estimate_tokens, trim_to_sentences
+from schemas.chat_session import ChatMessageSchema, ChatSessionSchema
+
+if TYPE_CHECKING:
+    from clients.gemini_client import GeminiClient
+
+
+ROLE_USER = "user"
+ROLE_ASSISTANT = "assistant"
+ROLE_LABELS = {ROLE_USER: "Пользователь", ROLE_ASSISTANT: "Ассистент"}
+# Служебные токены на строку «Роль: » в промпте
+MESSAGE_HEADER_TOKENS = 4
+
+
+class SessionService:
+    """
+    Сервис сессий чата: история разговора в промпте в пределах бюджета.
+
+    В промпт идут сводка ранних сообщений и столько последних сообщений,
+    сколько влезает в CHAT_HISTORY_TOKEN_BUDGET. Когда несвёрнутый хвост
+    перерастает бюджет, старшая половина сворачивается в сводку
+    фоновым запросом к модели (PRIORITY_BACKGROUND), так что промпт
+    не растёт, сколько бы ни длился разговор.
+    """
+
+    def __init__(
+        self,
+        store_instance: Optional[SessionStore] = None,
+        gemini_client_instance: Optional["GeminiClient"] = None,
+        history_budget: Optional[int] = None,
+        summary_budget: Optional[int] = None,
+    ):
+        """
+        Инициализация SessionService.
+
+        Args:
+            store_instance: Хранилище сессий
+            gemini_client_instance: Клиент модели для сворачивания истории
+            history_budget: Бюджет токенов истории (по умолчанию CHAT_HISTORY_TOKEN_BUDGET)
+            summary_budget: Максимум токенов сводки (по умолчанию CHAT_SUMMARY_TOKEN_BUDGET)
+        """
+        self._store_instance = store_instance
+        self._gemini_client_instance = gemini_client_instance
+        self.history_budget = history_budget or settings.CHAT_HISTORY_TOKEN_BUDGET
+        self.summary_budget = summary_budget or settings.CHAT_SUMMARY_TOKEN_BUDGET
+        # Сессии, которые сейчас сворачиваются, и их фоновые задачи
+        self._summarizing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def store(self) -> SessionStore:
+        if self._store_instance is not None:
+            return self._store_instance
+        from core.session_store import session_store
+        return session_store
+
+    @property
+    def gemini_client(self):
+        """
+        Получает клиент Gemini динамически из модуля.
+        """
+        if self._gemini_client_instance is not None:
+            return self._gemini_client_instance
+        from clients.gemini_client import gemini_client
+        return gemini_client
+
+    @staticmethod
+    def _to_schema(session: dict, messages: List[dict]) -> ChatSessionSchema:
+        return ChatSessionSchema(
+            session_id=session["session_id"],
+            corpus_id=session["corpus_id"],
+            summary=session["summary"],
+            created_at=session["created_at"],
+            updated_at=session["updated_at"],
+            messages=[ChatMessageSchema(**m) for m in messages],
+        )
+
+    async def create_session(self, corpus_id: Optional[str] = None) -> ChatSessionSchema:
+        session = await self.store.create_session(corpus_id)
+        return self._to_schema(session, [])
+
+    async def get_session(self, session_id: str, limit: int = 20) -> ChatSessionSchema:
+        """
+        Сессия с последними `limit` сообщениями.
+        Выбрасывает SessionNotFoundError, если сессии нет.
+        """
+        session = await self.store.get_session(session_id)
+        messages = await self.store.list_messages(session_id, limit)
+        return self._to_schema(session, messages)
+
+    async def list_messages(
+        self, session_id: str, limit: int = 50, before_id: Optional[int] = None
+    ) -> List[ChatMessageSchema]:
+        await self.store.get_session(session_id)
+        messages = await self.store.list_messages(session_id, limit, before_id)
+        return [ChatMessageSchema(**m) for m in messages]
+
+    async def delete_session(self, session_id: str) -> bool:
+        return await self.store.delete_session(session_id)
+
+    @staticmethod
+    def _message_tokens(message: dict) -> int:
+        return message["tokens"] + MESSAGE_HEADER_TOKENS
+
+    async def load_history(self, session_id: str) -> Tuple[str, Optional[str]]:
+        """
+        История разговора для промпта и корпус сессии.
+
+        Сводка плюс последние сообщения, которые влезают в бюджет;
+        если хвост ещё не успели свернуть, старые сообщения просто
+        не попадают в промпт.
+        """
+        session = await self.store.get_session(session_id)
+        tail = await self.store.get_messages_after(session_id, session["summarized_upto"])
+        available = self.history_budget - session["summary_tokens"]
+        window: List[dict] = []
+        for message in reversed(tail):
+            cost = self._message_tokens(message)
+            if cost > available:
+                break
+            window.append(message)
+            available -= cost
+        window.reverse()
+        return self.format_history(session["summary"], window), session["corpus_id"]
+
+    @staticmethod
+    def format_history(summary: str, messages: List[dict]) -> str:
+        parts = []
+        if summary:
+            parts.append(f"Краткое содержание начала разговора: {summary}")
+        parts.extend(f"{ROLE_LABELS[m['role']]}: {m['content']}" for m in messages)
+        return "\n\n".join(parts)
+
+    async def record_turn(self, session_id: str, message: str, reply: str) -> None:
+        """
+        Сохраняет вопрос и ответ; если история перестала влезать
+        в бюджет, запускает её сворачивание в фоне.
+        """
+        await self.store.append_messages(
+            session_id,
+            [
+                (ROLE_USER, message, estimate_tokens(message)),
+                (ROLE_ASSISTANT, reply, estimate_tokens(reply)),
+            ],
+        )
+        session = await self.store.get_session(session_id)
+        tail_tokens = await self.store.count_tokens_after(
+            session_id, session["summarized_upto"]
+        )
+        if session["summary_tokens"] + tail_tokens > self.history_budget:
+            self._schedule_summary(session_id)
+
+    def _schedule_summary(self, session_id: str) -> None:
+        if session_id in self._summarizing:
+            return
+        self._summarizing.add(session_id)
+        task = asyncio.create_task(self._summarize(session_id, current_trace_id()))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, session_id: str, trace_id: Optional[str] = None) -> None:
+        try:
+            with traced("summarize", trace_id, session_id=session_id):
+                await self.summarize(session_id)
+        except Exception as e:
+            log_event(
+                "Не удалось свернуть историю сессии",
+                logging.WARNING,
+                session_id=session_id,
+                error=str(e),
+            )
+        finally:
+            self._summarizing.discard(session_id)
+
+    async def summarize(self, session_id: str) -> bool:
+        """
+        Сворачивает старшую часть несвёрнутой истории в сводку, оставляя
+        последние сообщения на половину бюджета.
+
+        Returns:
+            bool: Сводка обновлена
+        """
+        session = await self.store.get_session(session_id)
+        tail = await self.store.get_messages_after(session_id, session["summarized_upto"])
+        keep_tokens = 0
+        split = len(tail)
+        while split > 0:
+            cost = self._message_tokens(tail[split - 1])
+            if keep_tokens + cost > self.history_budget // 2:
+                break
+            keep_tokens += cost
+            split -= 1
+        rolled = tail[:split]
+        if not rolled:
+            return False
+
+        summary = await self._generate_summary(session["summary"], rolled)
+        return await self.store.save_summary(
+            session_id,
+            summary,
+            estimate_tokens(summary),
+            summarized_upto=rolled[-1]["id"],
+            expected_upto=session["summarized_upto"],
+        )
+
+    async def _generate_summary(self, previous: str, messages: List[dict]) -> str:
+        """
+        Новая сводка из предыдущей и сворачиваемых сообщений.
+        Если модель недоступна, сводка собирается из первых предложений сообщений.
+        """
+        prompt = (
+            "Сократи разговор пользователя с ассистентом до краткой сводки "
+            f"(не больше {self.summary_budget} токенов, примерно "
+            f"{self.summary_budget * 2} символов). Сохрани имена, договорённости, "
+            "факты о пользователе и о чём шла речь. Без форматирования.\n\n"
+            f"{self.format_history(previous, messages)}\n\nСводка:"
+        )
+        client = self.gemini_client
+        summary = ""
+        if client is not None:
+            try:
+                summary = (await client.generate_text(prompt, priority=PRIORITY_BACKGROUND)).strip()
+            except Exception as e:
+                log_event("Сводка истории без модели", logging.WARNING, error=str(e))
+        if not summary or summary.startswith("❌"):
+            first_sentences = [trim_to_sentences(m["content"], 40) for m in messages]
+            summary = " ".join(filter(None, [previous, *first_sentences]))
+        if estimate_tokens(summary) > self.summary_budget:
+            summary = trim_to_sentences(summary, self.summary_budget) or summary[
+                : self.summary_budget * 2
+            ]
+        return summary
+
+    async def close(self) -> None:
+        """
+        Останавливает фоновые сворачивания (вызывается при завершении приложения).
+        """
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+@lru_cache()
+def get_session_service() -> SessionService:
+    """
+    Фабричная функция для создания экземпляра SessionService.
+    Использует lru_cache для singleton паттерна.
+    """
+    return SessionService()
+
+
+session_service = get_session_service()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+
+# Настройки читаются при импорте config, поэтому окружение задаётся до импортов
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("RAG_ENABLED", "true")
+os.environ.setdefault("TRACE_LOG_ENABLED", "false")
+os.environ.setdefault("FAKE_LLM_LATENCY", "0")
+os.environ.setdefault("UPLOAD_DIR", tempfile.mkdtemp(prefix="kasa-tests-"))
+
+import pytest
+
+from clients.gemini_rag_client import GeminiRagClient
+from clients.llm_backend import FakeBackend
+from config import settings
+
+
+@pytest.fixture
+def rag_client(tmp_path, monkeypatch):
+    """
+    RAG-клиент с заглушкой модели и отдельным UPLOAD_DIR на каждый тест.
+    """
+    monkeypatch.setattr(settings, "UPLOAD_DIR", tmp_path / "uploads")
+    monkeypatch.setattr(settings, "CORPUS_CATALOG_DB", "")
+    monkeypatch.setattr(settings, "RAG_FTS_DB", "")
+    monkeypatch.setattr(settings, "ANSWER_CACHE_ENABLED", False)
+    client = GeminiRagClient(backend=FakeBackend())
+    yield client
+    client.catalog.close()
+    if client.fts is not None:
+        client.fts.close()
+
+
+@pytest.fixture
+def write_file(tmp_path):
+    """
+    Создаёт файл для загрузки в корпус и возвращает путь к нему.
+    """
+
+    def write(name: str, content) -> str:
+        path = tmp_path / "src" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(content, bytes):
+            path.write_bytes(content)
+        else:
+            path.write_text(content, encoding="utf-8")
+        return str(path)
+
+    return write
+
+
+@pytest.fixture
+def rag_service(rag_client):
+    from services.rag_service import RagService
+
+    return RagService(rag_client_instance=rag_client)
+
+
+@pytest.fixture
+def count_retrievals(rag_client, monkeypatch):
+    """
+    Считает вызовы GeminiRagClient.query_corpus (поиска по корпусу).
+    """
+    calls = []
+    query_corpus = rag_client.query_corpus
+
+    def counting(*args, **kwargs):
+        calls.append((args, kwargs))
+        return query_corpus(*args, **kwargs)
+
+    monkeypatch.setattr(rag_client, "query_corpus", counting)
+    return calls
@@ -0,0 +1,72 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import api.rag
+
+
+@pytest.fixture
+def client(rag_service, monkeypatch):
+    monkeypatch.setattr(api.rag, "rag_service", rag_service)
+    app = FastAPI()
+    app.include_router(api.rag.router, prefix="/api/rag")
+    return TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "method, path, body",
+    [
+        ("post", "/api/rag/query", {"corpus_id": "nope", "query": "q"}),
+        ("post", "/api/rag/query/batch", {"corpus_id": "nope", "queries": ["q"]}),
+        ("post", "/api/rag/query/stream", {"corpus_id": "nope", "query": "q"}),
+        ("post", "/api/rag/query/multi", {"corpus_ids": ["nope"], "query": "q"}),
+        ("get", "/api/rag/corpus/nope/files", None),
+    ],
+)
+def test_unknown_corpus_is_404(client, method, path, body):
+    response = client.request(method, path, json=body)
+
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("max_results", [0, -1, 10**6])
+@pytest.mark.parametrize(
+    "path, body",
+    [
+        ("/api/rag/query", {"corpus_id": "lib", "query": "q"}),
+        ("/api/rag/query/batch", {"corpus_id": "lib", "queries": ["q"]}),
+        ("/api/rag/query/multi", {"corpus_ids": ["lib"], "query": "q"}),
+    ],
+)
+def test_max_results_out_of_bounds_is_422(client, path, body, max_results):
+    response = client.post(path, json={**body, "max_results": max_results})
+
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize(
+    "path, body",
+    [
+        ("/api/rag/query", {"corpus_id": "lib", "query": "q"}),
+        ("/api/rag/query/batch", {"corpus_id": "lib", "queries": ["q"]}),
+        ("/api/rag/query/stream", {"corpus_id": "lib", "query": "q"}),
+        ("/api/rag/query/multi", {"corpus_ids": ["lib"], "query": "q"}),
+    ],
+)
+def test_fts_mode_when_disabled_is_400(client, rag_client, write_file, path, body):
+    rag_client.create_corpus("lib")
+    rag_client.upload_file_to_corpus("lib", write_file("book.txt", "Текст книги."))
+
+    response = client.post(path, json={**body, "retrieval_mode": "fts"})
+
+    assert rag_client.fts is None
+    assert response.status_code == 400
+    assert "fts" in response.json()["detail"]
+
+
+def test_unknown_retrieval_mode_is_422(client):
+    response = client.post(
+        "/api/rag/query", json={"corpus_id": "lib", "query": "q", "retrieval_mode": "bogus"}
+    )
+
+    assert response.status_code == 422
@@ -0,0 +1,117 @@
+import json
+
+import pytest
+
+
+def _refs(rag_client) -> dict:
+    return json.loads(rag_client.blob_store.refs_path.read_text(encoding="utf-8"))
+
+
+def test_shared_blob_survives_delete_in_other_corpus(rag_client, write_file):
+    path = write_file("book.txt", "Общая книга для двух корпусов.")
+    for corpus_id in ("a", "b"):
+        rag_client.create_corpus(corpus_id)
+        rag_client.upload_file_to_corpus(corpus_id, path)
+    # Повторная загрузка того же файла не добавляет ссылку
+    rag_client.upload_file_to_corpus("a", path)
+    (sha256, count), = _refs(rag_client).items()
+    assert count == 2
+
+    rag_client.delete_corpus("a")
+
+    assert _refs(rag_client) == {sha256: 1}
+    assert rag_client.blob_store.blob_path(sha256).exists()
+    assert rag_client.query_corpus("b", "книга", 1)[0]["file_uri"] == "b/book.txt"
+
+
+def test_legacy_corpus_is_migrated(rag_client):
+    corpus_dir = rag_client.corpora_root / "old"
+    corpus_dir.mkdir()
+    (corpus_dir / "book.txt").write_text("Старый корпус.", encoding="utf-8")
+
+    manifest = rag_client._load_manifest("old")
+
+    assert list(manifest) == ["book.txt"]
+    assert not (corpus_dir / "book.txt").exists()
+    assert rag_client.blob_store.blob_path(manifest["book.txt"]["sha256"]).exists()
+    assert _refs(rag_client) == {manifest["book.txt"]["sha256"]: 1}
+
+
+def test_failed_legacy_migration_keeps_originals(rag_client, monkeypatch):
+    corpus_dir = rag_client.corpora_root / "old"
+    corpus_dir.mkdir()
+    (corpus_dir / "book.txt").write_text("Старый корпус.", encoding="utf-8")
+
+    def fail(*args):
+        raise OSError("диск заполнен")
+
+    monkeypatch.setattr(rag_client, "_save_manifest", fail)
+    with pytest.raises(OSError):
+        rag_client._load_manifest("old")
+
+    assert (corpus_dir / "book.txt").read_text(encoding="utf-8") == "Старый корпус."
+    assert _refs(rag_client) == {}
+
+
+def _restart(rag_client, monkeypatch):
+    from clients.gemini_rag_client import GeminiRagClient
+    from clients.llm_backend import FakeBackend
+
+    # Любой блоб без ссылки считается старым
+    monkeypatch.setattr("rag.blob_store.GC_GRACE_SECONDS", -60)
+    rag_client.catalog.close()
+    return GeminiRagClient(backend=FakeBackend())
+
+
+@pytest.mark.parametrize("refs", ["{\"abc", "{}"])
+def test_gc_keeps_blobs_referenced_by_catalog(rag_client, write_file, monkeypatch, refs):
+    rag_client.create_corpus("lib")
+    rag_client.upload_file_to_corpus("lib", write_file("book.txt", "Текст книги."))
+    (sha256, _), = _refs(rag_client).items()
+    # Недописанный или отставший от каталога refs.json
+    rag_client.blob_store.refs_path.write_text(refs, encoding="utf-8")
+
+    client = _restart(rag_client, monkeypatch)
+
+    assert client.blob_store.blob_path(sha256).exists()
+    if refs != "{}":
+        assert _refs(client) == {sha256: 1}
+    client.catalog.close()
+
+
+def test_corrupt_refs_are_not_overwritten(rag_client, write_file):
+    from rag.blob_store import RefsCorruptedError
+
+    rag_client.blob_store.refs_path.write_text("{\"abc", encoding="utf-8")
+    rag_client.create_corpus("lib")
+
+    with pytest.raises(RefsCorruptedError):
+        rag_client.upload_file_to_corpus("lib", write_file("book.txt", "Текст книги."))
+    assert rag_client.blob_store.refs_path.read_text(encoding="utf-8") == "{\"abc"
+
+
+def test_concurrent_deletes_release_refs_once(rag_client, write_file):
+    import threading
+
+    path = write_file("book.txt", "Общая книга для двух корпусов.")
+    for corpus_id in ("a", "b"):
+        rag_client.create_corpus(corpus_id)
+        rag_client.upload_file_to_corpus(corpus_id, path)
+    (sha256, _), = _refs(rag_client).items()
+
+    results = []
+    lock = rag_client._corpus_lock("a")
+    with lock:
+        # Оба удаления проходят мимо проверки, пока корпус занят
+        threads = [
+            threading.Thread(target=lambda: results.append(rag_client.delete_corpus("a")))
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert sorted(results) == [False, True]
+    assert _refs(rag_client) == {sha256: 1}
+    assert rag_client.blob_store.blob_path(sha256).exists()
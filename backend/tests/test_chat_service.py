@@ -0,0 +1,35 @@
+import asyncio
+
+from config import settings
+from services.chat_service import ChatService
+
+
+class _StreamingRag:
+    """
+    Заглушка RagService: поток из двух событий, отмечает своё закрытие.
+    """
+
+    def __init__(self):
+        self.closed = False
+
+    async def stream_rag_response(self, **kwargs):
+        try:
+            yield "token", {"text": "часть"}
+            yield "done", {"message": "часть"}
+        finally:
+            self.closed = True
+
+
+def test_rag_stream_is_closed_when_client_leaves(monkeypatch):
+    monkeypatch.setattr(settings, "RAG_ENABLED", True)
+    rag = _StreamingRag()
+    service = ChatService(rag_service_instance=rag)
+
+    async def leave_after_first_event():
+        events = service._stream_events("вопрос", "lib", None)
+        assert await anext(events) == ("token", {"text": "часть"})
+        await events.aclose()
+        # Закрыт сразу, а не сборщиком асинхронных генераторов при остановке loop
+        assert rag.closed
+
+    asyncio.run(leave_after_first_event())
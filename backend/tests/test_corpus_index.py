@@ -0,0 +1,47 @@
+import threading
+
+from clients.gemini_rag_client import GeminiRagClient
+from clients.llm_backend import FakeBackend
+
+
+def _restart(client: GeminiRagClient) -> GeminiRagClient:
+    client.catalog.close()
+    return GeminiRagClient(backend=FakeBackend())
+
+
+def test_reload_does_not_duplicate_appended_chunks(rag_client, write_file):
+    rag_client.create_corpus("lib")
+    rag_client.upload_file_to_corpus("lib", write_file("base.txt", "Базовая глава."))
+    # Второй файл дописывается поверх сохранённой базы
+    rag_client.upload_file_to_corpus("lib", write_file("extra.txt", "Глава о море."))
+    stored = len(rag_client._get_indexes("lib").store)
+
+    client = rag_client
+    for _ in range(3):
+        client = _restart(client)
+        index = client._get_indexes("lib")
+        assert index.appended == 1
+        assert len(index.store) == stored
+
+    docs = client.query_corpus("lib", "море", 1)
+    assert docs[0]["file_uri"] == "lib/extra.txt"
+    assert docs[0]["chunk"] == "Глава о море."
+    client.catalog.close()
+
+
+def test_delete_corpus_waits_for_index_update(rag_client, write_file):
+    rag_client.create_corpus("lib")
+    rag_client.upload_file_to_corpus("lib", write_file("book.txt", "Текст книги."))
+
+    lock = rag_client._corpus_lock("lib")
+    lock.acquire()
+    deleter = threading.Thread(target=rag_client.delete_corpus, args=("lib",))
+    deleter.start()
+    deleter.join(timeout=0.2)
+    # Пока индекс корпуса обновляется (или уплотняется), директория на месте
+    assert deleter.is_alive()
+    assert rag_client._corpus_dir("lib").exists()
+
+    lock.release()
+    deleter.join(timeout=5)
+    assert not rag_client._corpus_dir("lib").exists()
@@ -0,0 +1,65 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from clients.gemini_rag_client import GeminiRagClient
+from clients.llm_backend import FakeBackend
+from config import settings
+
+
+@pytest.fixture
+def fts_client(rag_client, monkeypatch):
+    monkeypatch.setattr(settings, "RAG_FTS_ENABLED", True)
+    client = GeminiRagClient(backend=FakeBackend())
+    yield client
+    client.catalog.close()
+    client.fts.close()
+
+
+def test_fts_query_does_not_write(fts_client, write_file, monkeypatch):
+    fts_client.create_corpus("lib")
+    fts_client.upload_file_to_corpus("lib", write_file("book.txt", "Глава о море."))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("запрос не должен писать в FTS5")
+
+    monkeypatch.setattr(fts_client.fts, "replace_file", fail)
+    monkeypatch.setattr(fts_client.fts, "delete_file", fail)
+
+    assert fts_client.query_corpus("lib", "море", 1, "fts")[0]["file_uri"] == "lib/book.txt"
+    # Ничего не найдено — запасной контекст, тоже без записи
+    assert fts_client.query_corpus("lib", "пустыня", 1, "fts")[0]["relevance_score"] == 0.0
+
+
+def test_corpora_from_before_fts_are_indexed_at_startup(rag_client, write_file, monkeypatch):
+    rag_client.create_corpus("lib")
+    rag_client.upload_file_to_corpus("lib", write_file("book.txt", "Глава о море."))
+    rag_client.catalog.close()
+
+    monkeypatch.setattr(settings, "RAG_FTS_ENABLED", True)
+    client = GeminiRagClient(backend=FakeBackend())
+    deadline = time.monotonic() + 5
+    while not client.fts.files("lib") and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert client.query_corpus("lib", "море", 1, "fts")[0]["file_uri"] == "lib/book.txt"
+    client.catalog.close()
+    client.fts.close()
+
+
+def test_close_closes_reader_connections(fts_client):
+    readers = []
+
+    def read():
+        fts_client.fts.is_empty()
+        readers.append(fts_client.fts._reader())
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    thread.join()
+    fts_client.fts.close()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        readers[0].execute("SELECT 1")
@@ -0,0 +1,26 @@
+import pytest
+
+from rag.catalog import FILE_FAILED, FILE_INDEXED
+from rag.extraction import ExtractionError
+
+
+def test_corrupt_pdf_is_marked_failed(rag_client, write_file):
+    rag_client.create_corpus("lib")
+    path = write_file("broken.pdf", b"%PDF-1.7\nthis is not a pdf body\n%%EOF")
+
+    with pytest.raises(ExtractionError):
+        rag_client.upload_file_to_corpus("lib", path)
+
+    files, _ = rag_client.list_files("lib")
+    assert [(f["filename"], f["status"]) for f in files] == [("broken.pdf", FILE_FAILED)]
+    assert files[0]["error"]
+    # Частично извлечённый текст не должен остаться в кэше как готовый
+    assert not list(rag_client.blob_store.root.glob("*/*.jsonl"))
+
+
+def test_valid_file_is_indexed(rag_client, write_file):
+    rag_client.create_corpus("lib")
+    rag_client.upload_file_to_corpus("lib", write_file("book.txt", "Глава первая. Квазар."))
+
+    files, _ = rag_client.list_files("lib")
+    assert [(f["filename"], f["status"]) for f in files] == [("book.txt", FILE_INDEXED)]
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def corpus(rag_client, write_file):
+    rag_client.create_corpus("lib")
+    rag_client.upload_file_to_corpus(
+        "lib", write_file("book.txt", "Квазар — ядро далёкой галактики.\nГлава вторая.")
+    )
+    return "lib"
+
+
+def test_generate_rag_response_retrieves_once(rag_service, corpus, count_retrievals):
+    response = asyncio.run(rag_service.generate_rag_response(corpus, "Что такое квазар?"))
+
+    assert len(count_retrievals) == 1
+    assert response.relevant_docs
+    assert response.relevant_docs[0]["file_uri"] == "lib/book.txt"
+
+
+def test_generate_rag_response_with_history_retrieves_once(
+    rag_service, corpus, count_retrievals
+):
+    asyncio.run(
+        rag_service.generate_rag_response(corpus, "А подробнее?", history="Про квазары")
+    )
+
+    assert len(count_retrievals) == 1
+
+
+def test_stream_rag_response_retrieves_once(rag_service, corpus, count_retrievals):
+    async def collect():
+        return [event async for event, _ in rag_service.stream_rag_response(corpus, "квазар")]
+
+    events = asyncio.run(collect())
+
+    assert len(count_retrievals) == 1
+    assert events[-1] == "done"
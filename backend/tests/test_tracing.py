@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from config import settings
+from core import profiling
+
+
+def test_profiler_lock_released_when_client_leaves_early(tmp_path, monkeypatch):
+    import main
+
+    monkeypatch.setattr(settings, "PROFILE_HEADER_ENABLED", True)
+    monkeypatch.setattr(settings, "PROFILE_DIR", tmp_path)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/metrics",
+        "raw_path": b"/metrics",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"x-profile", b"1")],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        # Клиент отключился до того, как ушли заголовки
+        raise OSError("connection reset")
+
+    with pytest.raises(OSError):
+        asyncio.run(main.app(scope, receive, send))
+
+    assert profiling._profile_lock.acquire(blocking=False)
+    profiling._profile_lock.release()
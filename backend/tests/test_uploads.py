@@ -0,0 +1,66 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import api.file_uploading
+from config import settings
+from services.ingestion_service import IngestionService
+
+
+class _Queue:
+    """
+    Заглушка IngestionService: запоминает задачи, не обрабатывая их.
+    """
+
+    def __init__(self):
+        self.submitted = []
+
+    async def submit(self, corpus_id, files):
+        self.submitted.append(files)
+        return type("Job", (), {"job_id": str(len(self.submitted))})
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", tmp_path / "uploads")
+    monkeypatch.setattr(settings, "RAG_ENABLED", True)
+    queue = _Queue()
+    monkeypatch.setattr(api.file_uploading, "ingestion_service", queue)
+    app = FastAPI()
+    app.include_router(api.file_uploading.router, prefix="/upload")
+    return TestClient(app), queue
+
+
+def test_same_name_uploads_do_not_overwrite_each_other(client):
+    http, queue = client
+    for content in (b"first", b"second"):
+        response = http.post(
+            "/upload/", files={"files": ("book.txt", content)}, data={"corpus_id": "lib"}
+        )
+        assert response.status_code == 200
+
+    (first,), (second,) = queue.submitted
+    assert first["location"] != second["location"]
+    assert Path(first["location"]).read_bytes() == b"first"
+    assert Path(second["location"]).read_bytes() == b"second"
+
+
+def test_ingested_upload_is_removed(rag_service, rag_client, write_file):
+    rag_client.create_corpus("lib")
+    path = Path(write_file("incoming/1/book.txt", "Текст книги."))
+    service = IngestionService(rag_service_instance=rag_service, workers=1)
+
+    async def ingest():
+        job = await service.submit("lib", [{"filename": "book.txt", "location": str(path)}])
+        await service._queue.join()
+        await service.stop()
+        return job
+
+    job = asyncio.run(ingest())
+
+    assert job.status == "completed"
+    assert not path.exists() and not path.parent.exists()
+    assert rag_client.query_corpus("lib", "книги", 1)[0]["file_uri"] == "lib/book.txt"